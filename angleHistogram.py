@@ -0,0 +1,141 @@
+#/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from __future__ import division
+import csv
+import numpy as np
+
+__all__ = ['AngleHistogram', 'direction_angles']
+
+
+def direction_angles(directions, angle='azimuth', axis=None):
+    """出射光方向的角度 单位为度
+    @param:directions (N, 2) 或 (N, 3) 方向数组
+    @param:angle 'azimuth' 方位角，'elevation' 抬升角，'scattering' 与 axis 的夹角
+        二维的方位角同 Vec2d.angle 三维的方位角与抬升角同 funcs3d.calculate_azimuth，calculate_elevation_angle
+    @param:axis 入射光的方向 angle 为 'scattering' 时使用
+    """
+    directions = np.asarray(directions, dtype=np.float64)
+    if angle == 'scattering':
+        if axis is None:
+            raise ValueError('Scattering angle needs the incident axis')
+        axis = np.asarray(tuple(axis), dtype=np.float64)
+        lengths = np.linalg.norm(directions, axis=-1) * np.linalg.norm(axis)
+        cos = np.sum(directions*axis, axis=-1) / np.where(lengths == 0, 1, lengths)
+        return np.degrees(np.arccos(np.clip(cos, -1, 1)))
+    if directions.shape[-1] == 2:
+        if angle != 'azimuth':
+            raise ValueError('Only azimuth and scattering angle in 2d')
+        return np.degrees(np.arctan2(directions[..., 1], directions[..., 0]))
+    if angle == 'azimuth':
+        return np.degrees(np.arctan2(directions[..., 0], directions[..., 1]))
+    if angle == 'elevation':
+        return np.degrees(np.arctan2(directions[..., 2], np.hypot(directions[..., 0], directions[..., 1])))
+    raise ValueError('Use correct angle in {0}'.format(['azimuth', 'elevation', 'scattering']))
+
+
+class AngleHistogram(object):
+    """
+    出射光角度分布的累加器 每次作用一行 不保存每条光线
+    追迹的结果直接累加进来，多个进程的结果用 merge 合并
+    @param:bins 分格数或分格边界
+    @param:range 角度范围 (最小, 最大) 单位为度 bins 为边界时忽略
+    @param:angle 统计的角度 见 direction_angles
+    @param:axis 入射光方向 angle 为 'scattering' 时使用
+    """
+    def __init__(self, bins=360, range=(-180, 180), angle='azimuth', axis=None):
+        if np.ndim(bins):
+            self.edges = np.asarray(bins, dtype=np.float64)
+        else:
+            self.edges = np.linspace(range[0], range[1], int(bins)+1)
+        if len(self.edges) < 2 or np.any(np.diff(self.edges) <= 0):
+            raise ValueError('Bins should be increasing')
+        self.angle = angle
+        self.axis = None if axis is None else tuple(axis)
+        self.counts = np.zeros((0, len(self.edges)-1), dtype=np.int64)     # (K, bins) 第k行为第k+1次作用
+        self.weights = np.zeros((0, len(self.edges)-1), dtype=np.float64)
+
+    def __repr__(self):
+        return "AngleHistogram({0} bins, {1} orders):{2}".format(len(self.centers), len(self.counts), int(self.counts.sum()))
+
+    @property
+    def centers(self):
+        return (self.edges[:-1] + self.edges[1:]) / 2
+
+    @property
+    def orders(self):
+        return np.arange(1, len(self.counts)+1)
+
+    @property
+    def total_counts(self):
+        return self.counts.sum(axis=0)
+
+    @property
+    def total_weights(self):
+        return self.weights.sum(axis=0)
+
+    def _grow(self, orders):
+        # 作用次数超过已有行数时补零
+        if orders > len(self.counts):
+            extra = orders - len(self.counts)
+            self.counts = np.vstack([self.counts, np.zeros((extra, self.counts.shape[1]), dtype=np.int64)])
+            self.weights = np.vstack([self.weights, np.zeros((extra, self.weights.shape[1]), dtype=np.float64)])
+
+    def add(self, order, angles, weights=None):
+        """累加第 order 次作用的出射角
+        @param:order 作用次数 从1开始
+        @param:angles (N,) 角度 单位为度 超出范围的舍弃
+        @param:weights (N,) 权重 默认每条光线为1
+        """
+        if not isinstance(order, (int, np.integer)) or order < 1:
+            raise ValueError('Order should not be less than 1 and should be int')
+        angles = np.asarray(angles, dtype=np.float64).reshape(-1)
+        weights = np.ones(len(angles)) if weights is None else np.asarray(weights, dtype=np.float64).reshape(-1)
+        self._grow(order)
+        index = np.searchsorted(self.edges, angles, side='right') - 1
+        index[angles == self.edges[-1]] = len(self.edges) - 2    # 包含右端点
+        inside = (index >= 0) & (index < len(self.edges)-1)
+        self.counts[order-1] += np.bincount(index[inside], minlength=self.counts.shape[1])
+        self.weights[order-1] += np.bincount(index[inside], weights[inside], minlength=self.weights.shape[1])
+        return self
+
+    def add_directions(self, order, directions, weights=None):
+        # 由出射方向累加
+        return self.add(order, direction_angles(directions, self.angle, self.axis), weights)
+
+    def update(self, result):
+        """累加追迹的结果
+        @param:result intersectionTracer/tracer3d 中 trace，compute 返回的字典
+                      或 iter_orders 输出的一个字典 有 weights 时按出射光的功率累加
+        """
+        if 'orders' in result:
+            weights = result.get('weights')
+            for i, (order, directions) in enumerate(zip(result['orders'], result['directions'])):
+                self.add_directions(int(order), directions, None if weights is None else weights[i])
+        else:
+            self.add_directions(int(result['order']), result['directions'], result.get('weights'))
+        return self
+
+    def merge(self, other):
+        """合并另一个累加器的结果 分格与角度必须相同
+        """
+        if not np.array_equal(self.edges, other.edges) or (self.angle, self.axis) != (other.angle, other.axis):
+            raise ValueError('Histograms with different bins or angle can not be merged')
+        self._grow(len(other.counts))
+        self.counts[:len(other.counts)] += other.counts
+        self.weights[:len(other.weights)] += other.weights
+        return self
+
+    def write_csv(self, f, weighted=False):
+        """写入CSV 每个分格一行：分格中心，各次作用，合计
+        @param:f 文件对象或文件名
+        @param:weighted 输出权重而不是光线数
+        """
+        if isinstance(f, str):
+            with open(f, 'w', newline='') as _f:
+                return self.write_csv(_f, weighted)
+        data = self.weights if weighted else self.counts
+        f_csv = csv.writer(f)
+        f_csv.writerow(['angle'] + ['N%s' % order for order in self.orders] + ['total'])
+        for center, row, total in zip(self.centers, data.T, data.sum(axis=0)):
+            f_csv.writerow([center] + row.tolist() + [total])
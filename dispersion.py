@@ -0,0 +1,80 @@
+#/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from __future__ import division
+import numpy as np
+from intersectionElements import UNITS
+
+__all__ = ['Cauchy', 'Sellmeier', 'Tabulated', 'WATER']
+
+
+def _to_um(wavelengths, unit):
+    # 波长换算为 um 色散公式的系数以 um 为单位
+    if unit not in UNITS.keys():
+        raise ValueError('Use correct unit in {0}'.format(list(UNITS.keys())))
+    return np.asarray(wavelengths, dtype=np.float64) * UNITS[unit] * 1e3
+
+
+class Cauchy(object):
+    """
+    Cauchy 色散公式 n = A + B/λ^2 + C/λ^4
+    @A, B, C: 系数 λ 的单位为 um
+    """
+    def __init__(self, A, B=0, C=0):
+        self.A, self.B, self.C = A, B, C
+
+    def __call__(self, wavelengths, unit='nm'):
+        """折射率 与 wavelengths 形状相同
+        @wavelengths: 波长 标量或数组
+        @unit: 波长的单位 同 Light
+        """
+        inverse = 1 / np.square(_to_um(wavelengths, unit))
+        return self.A + self.B*inverse + self.C*inverse*inverse
+
+    def __repr__(self):
+        return "Cauchy({0}, {1}, {2})".format(self.A, self.B, self.C)
+
+
+class Sellmeier(object):
+    """
+    Sellmeier 色散公式 n^2 = 1 + Σ B_i λ^2 / (λ^2 - C_i)
+    @B: 系数的序列
+    @C: 系数的序列 单位为 um^2
+    """
+    def __init__(self, B, C):
+        if len(B) != len(C):
+            raise ValueError('B and C should have the same length')
+        self.B = np.asarray(B, dtype=np.float64)
+        self.C = np.asarray(C, dtype=np.float64)
+
+    def __call__(self, wavelengths, unit='nm'):
+        square = np.square(_to_um(wavelengths, unit))[..., None]
+        return np.sqrt(1 + np.sum(self.B*square / (square - self.C), axis=-1))
+
+    def __repr__(self):
+        return "Sellmeier({0}, {1})".format(self.B.tolist(), self.C.tolist())
+
+
+class Tabulated(object):
+    """
+    由测量数据线性插值的折射率 超出范围时取端点的值
+    @wavelengths: 波长 升序
+    @indices: 对应的折射率
+    @unit: 波长的单位
+    """
+    def __init__(self, wavelengths, indices, unit='nm'):
+        self.wavelengths = _to_um(wavelengths, unit)
+        self.indices = np.asarray(indices, dtype=np.float64)
+        if self.wavelengths.shape != self.indices.shape or np.any(np.diff(self.wavelengths) <= 0):
+            raise ValueError('Wavelengths should be increasing and match the indices')
+
+    def __call__(self, wavelengths, unit='nm'):
+        return np.interp(_to_um(wavelengths, unit), self.wavelengths, self.indices)
+
+    def __repr__(self):
+        return "Tabulated({0} points)".format(len(self.wavelengths))
+
+
+# 20°C 的水 Daimon & Masumura (2007)
+WATER = Sellmeier((5.684027565e-1, 1.726177391e-1, 2.086189578e-2, 1.130748688e-1),
+                  (5.101829712e-3, 1.821153936e-2, 2.620722293e-2, 1.069792721e1))
@@ -5,13 +5,14 @@ from __future__ import division
 import math
 import numpy as np
 import matplotlib.pyplot as plt
-from itertools import product
-from copy import deepcopy
 from mpl_toolkits.mplot3d import axes3d
 from mpl_toolkits.mplot3d import art3d
+from matplotlib.colors import to_rgba_array
 from pygameVector import Vec3d
 from funcs3d import *
-from intersectionElements import Sphere, Light
+from intersectionElements import Sphere, Light, LightBundle
+from tracer3d import compute
+from traceResult import TraceResult
 
 # 光线颜色的取值
 COLORS = ['#FF0033', '#CC00CC', '#FF6600', '#33FF33',
@@ -170,120 +171,168 @@ def drawer(sphere, incident_light, refraction_index, start_point, intersection_t
                     lines=lines)
 
 
-def generate_multi_start_points(radius, num, set_x=None, set_y=None, set_z=None):
-    """绘制片状光与面状光 若设定某个坐标值不变，则其余的从（-r，r）取num个值，步长为2r/(num-1)
-    @param:set_x 设定x不变的坐标值
-    @param:set_y
-    @param:set_z
+def _valid(*arrays):
+    # 逐行组合 跳过含 nan 的行（min_power 舍弃的光线）
+    return [row for row in zip(*arrays) if not any(np.isnan(r).any() for r in row)]
 
+
+def render(traced, radius):
+    """由追迹的结果生成3d线段 见 tracer3d.compute
+    @param:traced compute 或 trace 返回的字典
+    @param:radius 球的半径 球外线段的长度为两倍半径
+    RETURN 字典 refraction_lines, reflection_lines, incident_lines 每次作用一个列表 舍弃的光线(nan)不画
     """
-    def combine(iterable, _set):
-        for i in iterable:
-            yield (i, _set)
-
-    coordinates = [[], [], []]   # 初始化三个坐标容器
-    x, y, z = [], [], []
-    step = 2*radius/(num-1)
-    scope = [-radius+step*i for i in range(num)]    # 不设定的坐标值的取值范围
-    for i, _setting in enumerate((set_x, set_y, set_z)):
-        if _setting is None:
-            _co = deepcopy(scope)
-        else:
-            _co = [_setting]
-        coordinates[i] = _co
-    start_point_list = list(product(coordinates[0], coordinates[1], coordinates[2]))
-    return start_point_list
-
-
-def multi_line_drawer(sphere, incident_light, refraction_index, start_point_list, intersection_time):
-    """光簇的追迹的主程序
-    """
-    if not isinstance(intersection_time, int) or intersection_time < 1:
-        raise ValueError('Intersection times should not be less than 1 and should be int') # 作用次数不能小于1，作用次数为整数
+    intersection_points = traced['points']
+    reflection_directions = traced['reflection_directions']
+    refraction_directions = traced['refraction_directions']
 
-    radius = sphere.radius
-    
-    points = []
-    reflection_lines = []
-    refraction_lines = []
-    incident_lines = []
-    refraction_lights_main = [] # 所有折射光线的列表
-    reflection_lights_main = [] # 所有反射光线的列表
-    lines = {'refraction_lines': refraction_lines,
-             'reflection_lines': reflection_lines,
-             'incident_lines': incident_lines}
-    lights = {'refraction_lights': refraction_lights_main,
-              'reflection_lights': reflection_lights_main}
-
-    points.append(start_point_list) # 将起始点加入到绘制点的列表中
-    time_of_intersection = 1
-    color_offset = 2
     # 第一次作用
-    first_intersection_point_list = [calculate_intersection_on_sphere(sphere, incident_light, p) for p in start_point_list]
-    incident_line = [draw_line(s, e[0], 'solid', COLORS[0]) for (s, e) in zip(start_point_list, first_intersection_point_list) if e]
-    lines['incident_lines'].append(incident_line)
-
-    first_intersection_point_list = [p[0] for p in first_intersection_point_list if p] # 过滤无作用点的起始点点
-    if not first_intersection_point_list:   # 若过滤后无作用点 则返回 退出追迹
-        return 
-    points.append(first_intersection_point_list)
-
-    factors_list = [ref_factors(sphere, incident_light, p) for p in first_intersection_point_list] # 交点处边界条件的参数的列表
-    first_reflection_lights = [reflection(factor, incident_light) for factor in factors_list]
-    reflection_lights_main.append(first_reflection_lights)
-    first_refraction_lights = [refraction(factor, incident_light, refraction_index) for factor in factors_list]
-    refraction_lights_main.append(first_refraction_lights)
-
-    first_reflection_lines = [draw_line_outside(s, light.direction, 2*radius, 'solid', COLORS[color_offset])
-                                for (light, s) in zip(first_reflection_lights, first_intersection_point_list)]
-    first_reflection_lines[0].set_label('N1')
-    # [0] (end, start)的第一项，第一项是指除去给定的起点以外的，与球两个交点中的另外一个交点
-    second_intersection_point_list = [calculate_intersection_on_sphere(sphere, light, p)[0] 
-                                for (light, p) in zip(first_refraction_lights, first_intersection_point_list)]
-    first_refraction_lines = [draw_line(s, e, color=COLORS[1]) for (s, e) in zip(first_intersection_point_list, second_intersection_point_list)]
-
-    reflection_lines.append(first_reflection_lines)
-    refraction_lines.append(first_refraction_lines)
-
-
-    if 1 < intersection_time:
-        # 作用次数大于1
-        incident_lights = first_refraction_lights
-        intersection_point_list = second_intersection_point_list
-        while time_of_intersection < intersection_time:
-            time_of_intersection += 1
-            # 选择颜色
-            color_offset = color_offset+1
-            # 球内反射光
-            factors_list = [ref_factors(sphere, light, p) for (light, p) in zip(incident_lights, intersection_point_list)]
-            reflection_lights = [reflection(factor, light) 
-                                    for (factor, light) in zip(factors_list, incident_lights)]
-            reflection_lights_main.append(reflection_lights)
-            # 折射光
-            refraction_lights = [refraction(factor, light, 1)
-                                    for (factor, light) in zip(factors_list, incident_lights)]
-            refraction_lights_main.append(refraction_lights)
-
-            # 折射光的线段 球外的线段
-            refraction_lines = [draw_line_outside(s, light.direction, 2*radius, 'solid', COLORS[color_offset])
-                                    for (light, s) in zip(refraction_lights, intersection_point_list)]
-            refraction_lines[0].set_label('N%s' % time_of_intersection)
-            lines['refraction_lines'].append(refraction_lines)
-
-            # 下次作用点的坐标
-            next_intersection_point_list = [calculate_intersection_on_sphere(sphere, light, p)[0]
-                                                for (light, p) in zip(reflection_lights, intersection_point_list)]
-            points.append(next_intersection_point_list)
-            # 反射光线段 球内的线段
-            reflection_lines = [draw_line(s, e, color=COLORS[1]) for (s, e) in zip(intersection_point_list, next_intersection_point_list)]
-            lines['reflection_lines'].append(reflection_lines)
-            incident_lights = reflection_lights
-            intersection_point_list = next_intersection_point_list  # 将下次作用点的列表作为起始点的列表
-    points = [(x, y, z) for times_points in points for (x, y, z) in times_points]   # 将作用点和起点转化为绘图所需的表示方式
+    color_offset = 2
+    incident_lines = [[draw_line(s, e, 'solid', COLORS[0]) for (s, e) in _valid(traced['start_points'], intersection_points[0])]]
+    first_reflection_lines = [draw_line(s, s + d*2*radius, 'solid', COLORS[color_offset])
+                                for (s, d) in _valid(intersection_points[0], reflection_directions[0])]
+    if first_reflection_lines:
+        first_reflection_lines[0].set_label('N1')
+    reflection_lines = [first_reflection_lines]
+    refraction_lines = [[draw_line(s, e, color=COLORS[1]) for (s, e) in _valid(intersection_points[0], intersection_points[1])]]
+
+    for time_of_intersection in range(2, len(reflection_directions)+1):
+        color_offset = color_offset+1   # 选择颜色
+        points_list = intersection_points[time_of_intersection-1]
+        # 折射光的线段 球外的线段
+        time_refraction_lines = [draw_line(s, s + d*2*radius, 'solid', COLORS[color_offset])
+                                    for (s, d) in _valid(points_list, refraction_directions[time_of_intersection-1])]
+        if time_refraction_lines:
+            time_refraction_lines[0].set_label('N%s' % time_of_intersection)
+        refraction_lines.append(time_refraction_lines)
+        # 反射光线段 球内的线段
+        reflection_lines.append([draw_line(s, e, color=COLORS[1])
+                                    for (s, e) in _valid(points_list, intersection_points[time_of_intersection])])
+    return {'refraction_lines': refraction_lines,
+            'reflection_lines': reflection_lines,
+            'incident_lines': incident_lines}
+
+
+def _segments(starts, ends):
+    # (M, 2, 3) 的线段数组与其所属光线的序号 跳过含 nan 的线段（min_power 舍弃的光线）
+    segments = np.stack((starts, ends), axis=-2)
+    valid = ~np.isnan(segments).any(axis=(-2, -1))
+    return segments[valid], np.flatnonzero(valid)
+
+
+def _order_segments(traced, radius):
+    """按作用次数分组的线段 颜色与 render 相同
+    RETURN 列表 每组一个元组 (segments (M, 2, 3), rays (M,), colors (M, 4), label)
+        第一组为入射光线 之后第k组为第k次作用 球外的线段在前（图例使用第一个颜色） 球内的线段在后
+    """
+    points = traced['points']
+    reflection_directions = traced['reflection_directions']
+    refraction_directions = traced['refraction_directions']
+
+    def group(parts, label):
+        # parts 为 ((segments, rays), color) 的列表 合并为一组
+        segments = np.concatenate([p[0] for (p, c) in parts])
+        rays = np.concatenate([p[1] for (p, c) in parts])
+        colors = np.concatenate([np.repeat(to_rgba_array(c), len(p[0]), axis=0) for (p, c) in parts])
+        return segments, rays, colors, label
+
+    groups = [group([(_segments(traced['start_points'], points[0]), COLORS[0])], None)]
+    # 第一次作用 球外的反射光线和球内的折射光线
+    groups.append(group([(_segments(points[0], points[0] + reflection_directions[0]*2*radius), COLORS[2]),
+                         (_segments(points[0], points[1]), COLORS[1])], 'N1'))
+    for time_of_intersection in range(2, len(reflection_directions)+1):
+        points_list = points[time_of_intersection-1]
+        # 球外的折射光线 颜色随作用次数变化 球内的反射光线都用第二种颜色
+        outside = points_list + refraction_directions[time_of_intersection-1]*2*radius
+        groups.append(group([(_segments(points_list, outside), COLORS[time_of_intersection+1]),
+                             (_segments(points_list, points[time_of_intersection]), COLORS[1])],
+                            'N%s' % time_of_intersection))
+    return groups
+
+
+def render_collections(traced, radius, linewidth=1.5):
+    """由追迹的结果生成 Line3DCollection 入射光线一个 之后每次作用一个 颜色与 render 相同
+    用 ax.add_collection3d 添加 旋转时的开销不随线段数目增加
+    @param:traced compute 或 trace 返回的字典
+    @param:radius 球的半径 球外线段的长度为两倍半径
+    RETURN 列表 Line3DCollection 第k+1个为第k次作用的线段 标记为 Nk
+    """
+    return LevelOfDetail(traced, radius, None, linewidth).collections
+
+
+class LevelOfDetail(object):
+    """
+    可以切换显示全部或部分光线的 Line3DCollection 拖动旋转 3d 图时只画部分光线 松开鼠标后恢复
+    部分光线按光线序号等间隔选取 每条选中的光线的各次作用都保留
+    @param:traced compute 或 trace 返回的字典
+    @param:radius 球的半径
+    @param:max_rays 拖动时最多显示的光线条数 None 时总是显示全部光线
+    @param:linewidth 线宽
+    """
+    def __init__(self, traced, radius, max_rays=200, linewidth=1.5):
+        self._groups = _order_segments(traced, radius)
+        self.collections = [art3d.Line3DCollection(segments, colors=colors, linewidths=linewidth, label=label)
+                            for (segments, rays, colors, label) in self._groups]
+        rays = len(traced['start_points'])
+        self.step = max(int(math.ceil(rays / max_rays)), 1) if max_rays else 1
+        self.coarse = False
+
+    def __repr__(self):
+        return "LevelOfDetail({0} segments, step={1}, coarse={2})".format(
+            sum(len(g[0]) for g in self._groups), self.step, self.coarse)
+
+    def set_coarse(self, coarse):
+        """切换显示部分（True）或全部（False）光线
+        @return: 显示是否改变 需要重画
+        """
+        coarse = bool(coarse) and self.step > 1
+        if coarse == self.coarse:
+            return False
+        for collection, (segments, rays, colors, label) in zip(self.collections, self._groups):
+            keep = rays % self.step == 0 if coarse else slice(None)
+            collection.set_segments(segments[keep])
+            collection.set_color(colors[keep])
+        self.coarse = coarse
+        return True
+
+
+def multi_line_drawer(sphere, incident_light, refraction_index, start_point_list, intersection_time, symmetry=False, histogram=None,
+                      min_power=None, lines=True):
+    """光簇的追迹的主程序
+    @param:symmetry 利用平面波照射球的旋转对称性，只追迹不同碰撞参数的光线 见 tracer3d.compute
+    @param:histogram AngleHistogram的实例 出射光的角度分布累加到其中 默认是None
+    @param:min_power 球内光线的功率低于该值后不再追迹 默认是None 追迹全部作用次数
+    @param:lines 是否生成每条线段的 Line3D 为 False 时 lines 为 None 由 render_collections 或 LevelOfDetail 绘制
+    RETURN 字典 points, lines, lights 与按列存储的 TraceResult result 没有交点时为 None
+    只需要数值结果时使用 tracer3d.compute
+    """
+    traced = compute(sphere, incident_light, refraction_index, start_point_list, intersection_time, symmetry, min_power)
+    if histogram is not None:
+        histogram.update(traced)
+    if not traced['hit'].any():   # 若无作用点 则返回 退出追迹
+        return
+    wavelength = incident_light.wavelength
+    intersection_points = traced['points']
+
+    # 第一次作用的反射光在球外 折射光在球内 之后反射光在球内 折射光在球外（外界折射率为1）
+    reflection_indices = [incident_light.refraction_index] + [refraction_index]*(intersection_time-1)
+    refraction_indices = [refraction_index] + [1]*(intersection_time-1)
+    # 每次作用一个 LightBundle 可以像 Light 的列表一样遍历
+    lights = {'refraction_lights': [LightBundle(wavelength, directions[~np.isnan(directions[:, 0])], n)
+                                        for (directions, n) in zip(traced['refraction_directions'], refraction_indices)],
+              'reflection_lights': [LightBundle(wavelength, directions[~np.isnan(directions[:, 0])], n)
+                                        for (directions, n) in zip(traced['reflection_directions'], reflection_indices)]}
+
+    # 起始点，第一个交点与第三个及之后的交点 转化为绘图所需的表示方式
+    points = [tuple(p) for p in start_point_list]
+    points.extend(tuple(p) for p in intersection_points[0])
+    points.extend(tuple(p) for (p,) in _valid(intersection_points[2:].reshape(-1, 3)))
     points = tuple(zip(*points))
+    result = TraceResult.from_trace(traced, sphere)
     return dict(points=points,
-                lines=lines,
-                lights=lights)
+                lines=result.lines if lines else None,
+                lights=lights,
+                result=result)
 
 
 def draw_azimuth_angle_distribution():
@@ -301,11 +350,7 @@ def draw_azimuth_angle_distribution():
     start_point_list1 = generate_multi_start_points(radius, density, set_y=-15, set_z=set_z)
 
     intersection_time = 4
-    points_and_lines_and_lights = multi_line_drawer(sphere, light, refraction_index, start_point_list1, intersection_time)
-    points = points_and_lines_and_lights['points']
-
-    lights = points_and_lines_and_lights['lights']['refraction_lights']
-    lights[0] = points_and_lines_and_lights['lights']['reflection_lights'][0]   # 第一次作用的光线选取反射光线
+    directions = compute(sphere, light, refraction_index, start_point_list1, intersection_time)['directions']  # 只计算 不生成线段
 
     x = []
     y = []
@@ -313,17 +358,17 @@ def draw_azimuth_angle_distribution():
     annotate_y = [] # 标记的纵坐标
 
     # 方位角
-    for l in lights:
-        x.append(list(range(len(l))))
-        azimuth = [calculate_azimuth(light.direction) for light in l]
-        y.append(azimuth) 
-        anno_x = [0, len(l)//2, len(l)-1]
+    for d in directions:
+        x.append(list(range(len(d))))
+        azimuth = np.degrees(np.arctan2(d[:, 0], d[:, 1]))   # 同 calculate_azimuth
+        y.append(azimuth)
+        anno_x = [0, len(d)//2, len(d)-1]
         annotate_x.append(anno_x)
         annotate_y.append([azimuth[anno_x[0]],
                            azimuth[anno_x[1]],
                            azimuth[anno_x[2]]])
 
-    s = [5]*len(x) # 设置点的大小
+    s = 5 # 设置点的大小 所有点相同
     fig, axes = plt.subplots(2, 2)
     axes[0][0].scatter(x[0], y[0], s=s)
     axes[0][0].set_title('N=1')
@@ -369,11 +414,7 @@ def draw_elevation_angle_distribution():
     start_point_list1 = generate_multi_start_points(radius, density, set_y=-15, set_z=set_z)    # 设定y轴坐标不变为-15， z轴不变味set_z
 
     intersection_time = 4
-    points_and_lines_and_lights = multi_line_drawer(sphere, light, refraction_index, start_point_list1, intersection_time)
-    points = points_and_lines_and_lights['points']
-
-    lights = points_and_lines_and_lights['lights']['refraction_lights']
-    lights[0] = points_and_lines_and_lights['lights']['reflection_lights'][0]   # 第一次作用的光线选取反射光线
+    directions = compute(sphere, light, refraction_index, start_point_list1, intersection_time)['directions']  # 只计算 不生成线段
 
     x = []
     y = []
@@ -381,18 +422,18 @@ def draw_elevation_angle_distribution():
     annotate_y = [] # 标记的纵坐标
 
     # 抬升角
-    for l in lights:
-        x.append(list(range(len(l))))
-        elevation_angle = [ calculate_elevation_angle(light.direction) for light in l]
-        y.append(elevation_angle)  
-        anno_x = [0, len(l)//2, len(l)-1]
+    for d in directions:
+        x.append(list(range(len(d))))
+        elevation_angle = np.degrees(np.arctan2(d[:, 2], np.hypot(d[:, 0], d[:, 1])))   # 同 calculate_elevation_angle
+        y.append(elevation_angle)
+        anno_x = [0, len(d)//2, len(d)-1]
         annotate_x.append(anno_x)
         annotate_y.append([elevation_angle[anno_x[0]], 
                            elevation_angle[anno_x[1]], 
                            elevation_angle[anno_x[2]]])
 
 
-    s = [5]*len(x) # 设置点的大小
+    s = 5 # 设置点的大小 所有点相同
     fig, axes = plt.subplots(2, 2)  # 设置四个子图
     axes[0][0].scatter(x[0], y[0], s=s)
     axes[0][0].set_title('N=1')
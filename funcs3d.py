@@ -2,12 +2,17 @@
 # -*- coding:utf-8 -*-
 
 import math
-from numpy import matrix
-from pygameVector import Vec3d
-from intersectionElements import Light, Sphere
+import numpy as np
+from itertools import product
+from copy import deepcopy
+from pygameVector import Vec2d, Vec3d
+from intersectionElements import Light, Sphere, Circle
+from intersectionFuncs import refine_samples, deviation_angles, fresnel_coefficients
 
-__all__ = [ 'calculate_elevation_angle', 'calculate_intersection_on_sphere',
-            'calculate_azimuth','reflection', 'refraction', 'ref_factors']  # 暴露给外部的函数
+__all__ = [ 'calculate_elevation_angle', 'calculate_intersection_on_sphere', 'generate_multi_start_points',
+            'adaptive_multi_start_points',
+            'calculate_azimuth','reflection', 'refraction', 'ref_factors',
+            'batch_intersection_on_sphere', 'batch_ref_factors', 'batch_reflection', 'batch_refraction', 'batch_fresnel']  # 暴露给外部的函数
 
 
 def calculate_elevation_angle(vector):
@@ -30,8 +35,9 @@ def calculate_intersection_on_sphere(sphere, light, start):
     if Vec3d(0, 0, 0) == v: # 若矢量为0，返回None，避免除数为0
         return None
     if sphere.on_sphere(start):
-        # 起点在球上，则顺序为（另一点， 起点）
-        t = (-2) * (v.x*start[0] + v.y*start[1] + v.z*start[2]) / (v.x**2+v.y**2+v.z**2)
+        # 起点在球上，则顺序为（另一点， 起点） 弦的长度由起点相对于球心的位置计算
+        offset = Vec3d(start) - center_vector
+        t = (-2) * v.dot(offset) / v.dot(v)
         end = start + t*v
         return (end, start)
     else:
@@ -49,41 +55,172 @@ def calculate_intersection_on_sphere(sphere, light, start):
         return (start+t1*v, start+t2*v)
         
 
-def ref_factors(sphere, light, intersection_point):
-    """作用点处的计算（根据边界条件的公式）
+def generate_multi_start_points(radius, num, set_x=None, set_y=None, set_z=None):
+    """绘制片状光与面状光 若设定某个坐标值不变，则其余的从（-r，r）取num个值，步长为2r/(num-1)
+    @param:set_x 设定x不变的坐标值
+    @param:set_y
+    @param:set_z
+
+    """
+    def combine(iterable, _set):
+        for i in iterable:
+            yield (i, _set)
+
+    coordinates = [[], [], []]   # 初始化三个坐标容器
+    x, y, z = [], [], []
+    step = 2*radius/(num-1)
+    scope = [-radius+step*i for i in range(num)]    # 不设定的坐标值的取值范围
+    for i, _setting in enumerate((set_x, set_y, set_z)):
+        if _setting is None:
+            _co = deepcopy(scope)
+        else:
+            _co = [_setting]
+        coordinates[i] = _co
+    start_point_list = list(product(coordinates[0], coordinates[1], coordinates[2]))
+    return start_point_list
+
+
+def adaptive_multi_start_points(sphere, incident_light, refraction_index, orders, budget, initial=32, resolution=None,
+                                set_x=None, set_y=None, set_z=None):
+    """片状光起始点的自适应生成 设定两个坐标值不变，另一个坐标在（-r，r）内自适应取值
+    与 generate_multi_start_points 的片状光相同，但在出射角随起始点变化快的地方（如虹的焦散附近）加密
+    平面波照射球时出射光的偏折角只与碰撞参数有关，由 intersectionFuncs.deviation_angles 直接计算 不需要追迹
+    @param:orders 依据的作用次数 整数或整数列表
+    @param:budget 最多的光线条数
+    @param:initial 初始均匀分布的光线条数
+    @param:resolution 相邻光线偏折角的最大差值（度） None 时用完 budget
+    @return: list 同 generate_multi_start_points
+    """
+    settings = (set_x, set_y, set_z)
+    free = [i for i, _setting in enumerate(settings) if _setting is None]
+    if len(free) != 1:
+        raise ValueError('Set exactly two coordinates for a sheet of light')
+    radius = sphere.radius
+    center = np.asarray(sphere.center, dtype=np.float64)
+    axis = np.array(tuple(incident_light.direction), dtype=np.float64)
+    axis = axis / np.linalg.norm(axis)
+    base = np.array([0 if _setting is None else _setting for _setting in settings], dtype=np.float64)
+    span = np.zeros(3)
+    span[free[0]] = 1
+    across = span - np.dot(span, axis)*axis   # 起始点所在直线垂直于入射光的分量
+    if np.linalg.norm(across) < 1e-12:
+        raise ValueError('The sheet should not be parallel to the incident light')
+    across = across / np.linalg.norm(across)
+    # 偏折角用同半径的圆与沿x轴的入射光计算
+    circle = Circle(radius)
+    light = Light(incident_light.wavelength, Vec2d(1, 0), incident_light.refraction_index)
+
+    def points(t):
+        return base + t[:, None]*span
+
+    def angles(t):
+        offset = points(t) - center
+        radial = offset - np.dot(offset, axis)[:, None]*axis
+        impact = np.linalg.norm(radial, axis=-1) * np.where(np.dot(radial, across) < 0, -1, 1)
+        return deviation_angles(circle, light, refraction_index, impact, orders)
+
+    t = refine_samples(angles, -radius, radius, budget, initial, resolution)
+    return [tuple(p) for p in points(t)]
+
+
+def batch_intersection_on_sphere(sphere, directions, starts, tol=1e-5):
+    """calculate_intersection_on_sphere 的批量版本
+    起点在球上时 first 为另一个交点，否则 first/second 为离起点较近/较远的交点
+    @param:directions (N, 3) 或 (3,) 光线方向
+    @param:starts (N, 3) 起点
+    @param:tol 判断起点在球上的精度 同 Sphere.on_sphere
+    @return: tuple (first, second, hit) 无交点的行为nan
     """
-    center = sphere.center
+    center = np.asarray(sphere.center, dtype=np.float64)
     radius = sphere.radius
+    starts = np.asarray(starts, dtype=np.float64)
+    directions = np.broadcast_to(np.asarray(directions, dtype=np.float64), starts.shape)
+
+    offset = starts - center
+    a = (directions*directions).sum(-1)
+    b = 2*(directions*offset).sum(-1)
+    c = (offset*offset).sum(-1) - radius*radius
+    on_sphere = np.abs(c) < tol
+    disc = b*b - 4*a*c
+    hit = (disc >= 0) & (a > 0)   # 矢量为0或判别式小于0则没有交点
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sqrt_disc = np.sqrt(np.where(hit, disc, np.nan))
+        t1 = np.where(on_sphere, -b/a, (-b - sqrt_disc) / (2*a))  # 起点在球上 另一个交点为弦的终点
+        t2 = np.where(on_sphere, 0, (-b + sqrt_disc) / (2*a))
+    first = starts + t1[..., None]*directions
+    second = starts + t2[..., None]*directions
+    return (first, second, hit)
+
+
+def _normalized(vectors):
+    # 单位化 长度为0的矢量保持不变 同 Vec3d.normalized
+    length = np.sqrt((vectors*vectors).sum(-1))[..., None]
+    return vectors / np.maximum(length, np.finfo(np.float64).tiny)
+
+
+def _cross(a, b):
+    # 逐行叉乘 比 numpy.cross 在小数组上快
+    return np.stack((a[..., 1]*b[..., 2] - a[..., 2]*b[..., 1],
+                     a[..., 2]*b[..., 0] - a[..., 0]*b[..., 2],
+                     a[..., 0]*b[..., 1] - a[..., 1]*b[..., 0]), axis=-1)
+
+
+def batch_ref_factors(sphere, intersection_points, k_vectors):
+    """ref_factors 的批量版本 作用点处的坐标系 (n, t, b) 和入射光的分量
+    @param:intersection_points (N, 3) 作用点
+    @param:k_vectors (N, 3) 入射光的波矢量
+    @return: dict n, t, b (N, 3) 坐标系的单位矢量 normal (N,) 法向分量 tangen (N,) 切向分量
+    """
+    center = np.asarray(sphere.center, dtype=np.float64)
+    points = np.asarray(intersection_points, dtype=np.float64)
+    k_vectors = np.asarray(k_vectors, dtype=np.float64)
 
-    k_li_vector = light.k_vector # 入射光的波矢量
+    unit_n_vector = _normalized(points - center)
+    k_normal = (k_vectors*unit_n_vector).sum(-1)  # 入射光的法向分量
+    # b = k x n, t = b x n = (k.n)n - k 单位化，正入射时 t 与 b 均为0
+    unit_t_vector = _normalized(k_normal[..., None]*unit_n_vector - k_vectors)
+    unit_b_vector = _cross(unit_n_vector, unit_t_vector)
+    k_tangen = (k_vectors*unit_t_vector).sum(-1)  # 入射光的切向分量
+    return dict(n=unit_n_vector, t=unit_t_vector, b=unit_b_vector, normal=k_normal, tangen=k_tangen)
 
-    # vector on the surface of the intersection 作用点处建立的坐标系
-    unit_n_vector = Vec3d(tuple((intersection_point[i]-center[i])/radius for i in range(3))).normalized()   # 单位化
-    unit_b_vector = (light.direction.cross(unit_n_vector)).normalized()
-    unit_t_vector = (unit_b_vector.cross(unit_n_vector)).normalized()
-    c = matrix([unit_n_vector, unit_t_vector, unit_b_vector]).T   # 由该坐标系得到的矩阵C
- 
-    k_normal = k_li_vector.dot(unit_n_vector) # 入射光的法向分量
-    k_tangen = k_li_vector.dot(unit_t_vector) # 入射光的切向分量
 
-    return dict(c=c, tangen=k_tangen, normal=k_normal)
+def batch_reflection(factors):
+    """反射光的单位方向 (N, 3)
+    """
+    direction = (-factors['normal'])[..., None]*factors['n'] + factors['tangen'][..., None]*factors['t']
+    return _normalized(direction)
 
 
-def reflection(factors, light):
-    """计算反射光
+def batch_refraction(factors, wavenums):
+    """折射光的单位方向 (N, 3)
+    @wavenums 折射光的波数 标量或 (N,) 全反射时法向分量取0
     """
-    wavelength = light.wavelength
-    refraction_index = light.refraction_index   # 反射光的折射率和入射光相同
+    tangen = factors['tangen']
+    normal_sgn = np.where(factors['normal'] > 0, 1., -1.)    # 折射光线在边界的另一侧（与入射光相比）
+    normal = normal_sgn * np.sqrt(np.maximum(np.square(wavenums) - tangen*tangen, 0))
+    direction = normal[..., None]*factors['n'] + tangen[..., None]*factors['t']
+    return _normalized(direction)
+
+
+def batch_fresnel(factors, wavenums, incident_wavenums):
+    """作用点处的 Fresnel 功率反射率与透射率 见 intersectionFuncs.fresnel_coefficients
+    """
+    return fresnel_coefficients(factors['normal'], factors['tangen'], wavenums, incident_wavenums)
 
-    # light factor 
-    normal = (-1) * factors['normal']   # 反射光的法向分量
-    tangen = factors['tangen']  # 反射光的切向分量
-    c = factors['c']    # 获取矩阵C
 
-    # reflection light vector
-    direction = c * matrix([[normal], [tangen], [0]])   # 方向转化为（x，y，z）坐标系下的坐标表示
-    direction = Vec3d(direction.A1).normalized()    # 转化为Vec3d矢量
-    return Light(wavelength, direction, refraction_index)   # 返回该光线
+def ref_factors(sphere, light, intersection_point):
+    """作用点处的计算（根据边界条件的公式）batch_ref_factors 的单条光线版本
+    """
+    k_vector = light.k_vector
+    point = (intersection_point[0], intersection_point[1], intersection_point[2])
+    return batch_ref_factors(sphere, point, (k_vector.x, k_vector.y, k_vector.z))
+
+
+def reflection(factors, light):
+    """计算反射光
+    """
+    direction = Vec3d(batch_reflection(factors))
+    return Light(light.wavelength, direction, light.refraction_index)   # 反射光的折射率和入射光相同
 
 
 def refraction(factors, light, refraction_index):
@@ -91,23 +228,5 @@ def refraction(factors, light, refraction_index):
     """
     wavelength = light.wavelength
     k = Light.wavenum(wavelength, refraction_index) # 由入射光的波长和给定的折射率计算光波数
-
-    normal_sgn = 1 if factors['normal'] > 0 else -1 # 折射光线在边界的另一侧（与入射光相比）
-    tangen = factors['tangen']  # 折射光的切向分量
-    normal = normal_sgn * math.sqrt(k*k-tangen*tangen) # 折射光的法向分量
-    c = factors['c']    # 矩阵C
-
-    direction = (c*matrix([[normal], [tangen], [0]])).A1    # 折射光的方向转化为（x，y，z）坐标系下的坐标表示
-    direction = Vec3d(direction).normalized()
+    direction = Vec3d(batch_refraction(factors, k))
     return Light(wavelength, direction, refraction_index)
-
-
-
-
-
-
-
-
-
-
-
@@ -2,11 +2,16 @@
 # -*- coding:utf-8 -*-
 
 from __future__ import division
+import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import lines
+from matplotlib.collections import LineCollection
 from pygameVector import Vec2d
-from intersectionElements import Circle, Light
-from intersectionFuncs import intersection, reflection, refraction, pick_start_points, ref_factors
+from intersectionElements import Circle, Light, LightBundle
+from intersectionFuncs import intersection, reflection, refraction, pick_start_points, ref_factors, \
+                              impact_parameters, deviation_angles
+from intersectionTracer import compute
+from traceResult import TraceResult
 
 
 # 光线的颜色取值
@@ -56,7 +61,86 @@ def light_intersection(circle, light, start_point, color='b'):
     return line
 
 
-def drawer(circle, incident_light, refraction_index, density=1, outside_ref_index=1, intersection_time=1, distance=2, tol=1e-2, start_point=None):
+def _valid(*arrays):
+    # 逐行组合 跳过含 nan 的行（min_power 舍弃的光线）
+    return [row for row in zip(*arrays) if not any(np.isnan(r).any() for r in row)]
+
+
+def _color_offset(time_of_intersection):
+    # 第二次及之后作用的颜色偏移量 参照COLORS全局变量 正负交替
+    return (-1)*(time_of_intersection+1)//2 - 1 if (time_of_intersection+1)%2 else (time_of_intersection+1)//2
+
+
+def _segments(starts, ends):
+    # (N, 2, 2) 的线段数组 跳过含 nan 的线段（min_power 舍弃的光线）
+    segments = np.stack((starts, ends), axis=-2)
+    return segments[~np.isnan(segments).any(axis=(-2, -1))]
+
+
+def render(traced, circle, distance=2):
+    """由追迹的结果生成线段 见 intersectionTracer.compute
+    @param:traced compute 或 trace 返回的字典
+    @param:circle Circle的实例
+    @param:distance 画圆外的光线时，长度为半径的几倍
+    RETURN 字典 入射光线，反射光线，折射光线的线段 每次作用一个列表 舍弃的光线(nan)不画
+    """
+    radius = circle.radius
+    points = traced['points']
+    reflection_directions = traced['reflection_directions']
+    refraction_directions = traced['refraction_directions']
+
+    # 第一次作用 入射光线的线段，圆外的反射光线和圆内的折射光线
+    incident_lines = [[draw_linesegment(s, e, color=COLORS[0]) for (s, e) in _valid(traced['start_points'], points[0])]]
+    reflection_lines = [[draw_linesegment(s, s + d*radius*distance, color=COLORS[-1])
+                            for (s, d) in _valid(points[0], reflection_directions[0])]]
+    refraction_lines = [[draw_linesegment(s, e, color=COLORS[-1]) for (s, e) in _valid(points[0], points[1])]]
+
+    # 之后的作用 圆内的反射光线和圆外的折射光线
+    for time_of_intersection in range(2, len(reflection_directions)+1):
+        color_offset = _color_offset(time_of_intersection)
+        intersect_points = points[time_of_intersection-1]
+        reflection_lines.append([draw_linesegment(s, e, COLORS[color_offset])
+                                    for (s, e) in _valid(intersect_points, points[time_of_intersection])])
+        refraction_lines.append([draw_linesegment(s, s + d*radius*distance, COLORS[color_offset])
+                                    for (s, d) in _valid(intersect_points, refraction_directions[time_of_intersection-1])])
+    return dict(incident_lines=incident_lines,
+                reflection_lines=reflection_lines,
+                refraction_lines=refraction_lines)
+
+
+def render_collections(traced, circle, distance=2, linewidth=1.5):
+    """由追迹的结果生成 LineCollection 颜色与 render 相同 每种颜色一个集合
+    入射光线一个 之后每次作用一个（圆内的反射光线与圆外的折射光线颜色相同）
+    大量光线时绘制的开销不随线段数目增加 用 ax.add_collection 添加
+    @param:traced compute 或 trace 返回的字典
+    @param:circle Circle的实例
+    @param:distance 画圆外的光线时，长度为半径的几倍
+    RETURN 列表 LineCollection 第k+1个为第k次作用的线段 其 segments 为 (M, 2, 2) 的数组
+    """
+    length = circle.radius * distance
+    points = traced['points']
+    reflection_directions = traced['reflection_directions']
+    refraction_directions = traced['refraction_directions']
+
+    def collection(segments, color, label):
+        return LineCollection(np.concatenate(segments), colors=color, linewidths=linewidth, label=label)
+
+    # 第一次作用 入射光线，圆外的反射光线和圆内的折射光线
+    collections = [collection([_segments(traced['start_points'], points[0])], COLORS[0], 'incident'),
+                   collection([_segments(points[0], points[0] + reflection_directions[0]*length),
+                               _segments(points[0], points[1])], COLORS[-1], 'N1')]
+    # 之后的作用 圆内的反射光线和圆外的折射光线
+    for time_of_intersection in range(2, len(reflection_directions)+1):
+        intersect_points = points[time_of_intersection-1]
+        collections.append(collection([_segments(intersect_points, points[time_of_intersection]),
+                                       _segments(intersect_points,
+                                                 intersect_points + refraction_directions[time_of_intersection-1]*length)],
+                                      COLORS[_color_offset(time_of_intersection)], 'N%s' % time_of_intersection))
+    return collections
+
+
+def drawer(circle, incident_light, refraction_index, density=1, outside_ref_index=1, intersection_time=1, distance=2, tol=1e-2, start_point=None, histogram=None,
+           min_power=None, cache=None, lines=True):
     """根据给定的条件，画追迹光线的主程序
     @param:circle Circle的实例
     @param:incident_light 入射光
@@ -67,98 +151,38 @@ def drawer(circle, incident_light, refraction_index, density=1, outside_ref_inde
     @param:distance 画圆外的光线时，长度为半径的几倍             how many times of line expand multiply by the radius
     @param:tol 光线离圆顶端的距离默认是0.01                  the distance to the boarder of the circle
     @param:start_point 给定的起始点，可以是列表，可以是单个点，默认是None，则自动生成
-    RETURN 字典 交点，光线与线段的结果
+    @param:histogram AngleHistogram的实例 出射光的角度分布累加到其中 默认是None
+    @param:min_power 圆内光线的功率低于该值后不再追迹 默认是None 追迹全部作用次数
+    @param:cache TraceCache的实例 没有给定起始点时 半径与圆心不同的相同追迹由缓存得到 默认是None
+    @param:lines 是否生成每条线段的 Line2D 为 False 时结果中没有线段 由 result.collections 绘制
+    RETURN 字典 交点，光线与线段的结果 result 为按列存储的 TraceResult 线段由其生成
+    只需要数值结果时使用 intersectionTracer.compute
     """
-    if not isinstance(intersection_time, int) or intersection_time < 1:
-        raise ValueError('Intersection times should not be less than 1 and should be int') # 作用次数不能小于1，作用次数为整数
-
-    radius = circle.radius
-    center = circle.center
-    incident_light_vector = incident_light.direction.normalized()  # 入射光方向的单位化
-
-    if not start_point:
-        start_points = pick_start_points(circle, incident_light_vector, density, distance, tol)
+    if cache is not None and (start_point is None or not len(start_point)):
+        traced = cache.compute(circle, incident_light, refraction_index, density, outside_ref_index,
+                               intersection_time, distance, tol, min_power)
     else:
-        start_points = start_point if isinstance(start_point, list) else [start_point] # 转化为列表
-
-    intersection_points = [] # 交点列表
-    reflection_lights = []  # 反射光线
-    refraction_lights = []  # 折射光线
-
-    incident_lines = [] # 入射光线
-    reflection_lines = [] # 反射线段
-    refraction_lines = [] # 折射线段
-
-    time_of_intersection = 1
-    # 第一次作用的交点 若没有交点则舍弃
-    intersection_points_1 = [intersection(circle, incident_light_vector, p)[0] for p in start_points if intersection(circle, incident_light_vector, p)]
-    intersection_points.append(intersection_points_1)
-
-    factors_list = [ref_factors(circle, incident_light, p) for p in intersection_points_1]  # 第一次作用的边界条件计算的到中间变量
-    reflect_1 = [reflection(factor, incident_light) \
-                        for factor in factors_list]
-    refract_1 =  [refraction(factor, incident_light, refraction_index) \
-                        for factor in factors_list]
-    reflection_lights.append(reflect_1)
-    refraction_lights.append(refract_1)
-
-    # 入射光线的线段
-    incident_line_1 = [draw_linesegment(start_point, end_point, color=COLORS[0]) \
-        for (start_point, end_point) in zip(start_points, intersection_points_1)]
-    # 反射光线的线段
-    reflect_line_1 = [light_reflection_outside(circle, reflection_light, intersection_point, color=COLORS[-1], times=distance) \
-        for (reflection_light, intersection_point) in zip(reflect_1, intersection_points_1)]
-    # 折射光线的线段
-    refract_line_1 = [light_intersection(circle, refraction_light, intersection_point, color=COLORS[-1]) \
-        for (refraction_light, intersection_point) in zip(refract_1, intersection_points_1)]
-    incident_lines.append(incident_line_1)
-    reflection_lines.append(reflect_line_1)
-    refraction_lines.append(refract_line_1)
-
-
-    if 1 == intersection_time:
-        intersection_points = [(x, y) for p in intersection_points for (x, y) in p]
-        intersection_points = tuple(zip(*intersection_points))
-        points_and_lines = dict(incident_lines=incident_lines,
-                            reflection_lines=reflection_lines,
-                            refraction_lines=refraction_lines,
-                            intersection_points=intersection_points,
-                            reflection_lights=reflection_lights,
-                            refraction_lights=refraction_lights)
-        return points_and_lines
-
-    incident_lights = refraction_lights[0]
-    # 循环到输入的作用的次数
-    while time_of_intersection < intersection_time:
-        time_of_intersection += 1
-        # 选取颜色偏移量 参照COLORS全局变量
-        color_offset = (-1)*(time_of_intersection+1)//2 - 1 if (time_of_intersection+1)%2 else (time_of_intersection+1)//2 
-        intersect_points = [intersection(circle, incident_light.direction, start_p)[0] \
-                                for (incident_light, start_p) in zip(incident_lights, intersection_points[time_of_intersection-2])]
-        intersection_points.append(intersect_points)
-
-        factors_list = [ref_factors(circle, incident_light, p) for (incident_light, p) in zip(incident_lights, intersect_points)]
-        reflect_lights = [reflection(factor, incident_light) \
-                                for (factor, incident_light) in zip(factors_list, incident_lights)]
-        refract_lights = [refraction(factor, incident_light, outside_ref_index) \
-                                for (factor, incident_light) in zip(factors_list, incident_lights)]
-        reflection_lights.append(reflect_lights)
-        refraction_lights.append(refract_lights)
-
-        reflect_lines = [light_intersection(circle, reflect_light, intersect_point, COLORS[color_offset]) \
-                                for (reflect_light, intersect_point) in zip(reflect_lights, intersect_points)]
-        refract_lines = [light_reflection_outside(circle, refract_light, intersect_point, COLORS[color_offset], distance) \
-                                for (refract_light, intersect_point) in zip(refract_lights, intersect_points)]
-        reflection_lines.append(reflect_lines)
-        refraction_lines.append(refract_lines)
-
-        incident_lights = reflect_lights
-
-    intersection_points = [(x, y) for p in intersection_points for (x, y) in p] # 解构交点
-    intersection_points = tuple(zip(*intersection_points))   # 转化为x，y的两个列表
-    points_and_lines = dict(incident_lines=incident_lines, 
-                            reflection_lines=reflection_lines,
-                            refraction_lines=refraction_lines,
+        traced = compute(circle, incident_light, refraction_index, density, outside_ref_index,
+                         intersection_time, distance, tol, start_point, min_power)     # 整个光束一次追迹
+    if histogram is not None:
+        histogram.update(traced)
+    wavelength = incident_light.wavelength
+
+    # 第一次作用的反射光在圆外 折射光在圆内 之后反射光在圆内 折射光在圆外
+    reflection_indices = [incident_light.refraction_index] + [refraction_index]*(intersection_time-1)
+    refraction_indices = [refraction_index] + [outside_ref_index]*(intersection_time-1)
+    # 每次作用一个 LightBundle 可以像 Light 的列表一样遍历
+    reflection_lights = [LightBundle(wavelength, directions[~np.isnan(directions[:, 0])], n)
+                            for (directions, n) in zip(traced['reflection_directions'], reflection_indices)]
+    refraction_lights = [LightBundle(wavelength, directions[~np.isnan(directions[:, 0])], n)
+                            for (directions, n) in zip(traced['refraction_directions'], refraction_indices)]
+
+    intersection_points = traced['points'][:intersection_time].reshape(-1, 2)  # 解构交点
+    intersection_points = intersection_points[~np.isnan(intersection_points[:, 0])]
+    intersection_points = (tuple(intersection_points[:, 0]), tuple(intersection_points[:, 1]))   # 转化为x，y的两个列表
+    result = TraceResult.from_trace(traced, circle, distance)
+    points_and_lines = dict(result.lines) if lines else {}
+    points_and_lines.update(result=result,
                             intersection_points=intersection_points,
                             reflection_lights=reflection_lights,
                             refraction_lights=refraction_lights)
@@ -178,19 +202,15 @@ def main():
     incident_light = Light(532, vector, 1, unit='nm')
     refraction_index = 1.335
 
-    points_and_lines = drawer(circle, incident_light, refraction_index, density, intersection_time=8)
-    xy = points_and_lines.pop('intersection_points')
-
-    lights = points_and_lines['refraction_lights']
-    lights[0] = points_and_lines['reflection_lights'][0]
-    x = list(range(len(lights[0])))
-    y = []
-    for l in lights:
-        y.append([light.direction.angle for light in l])
+    # 方位角由偏折角公式直接得到 不需要追迹
+    start_points = pick_start_points(circle, vector, density)
+    impact = impact_parameters(circle, vector, start_points)
+    x = list(range(len(start_points)))
+    y = deviation_angles(circle, incident_light, refraction_index, impact, range(1, 9))
 
     # 画出论文所需的方位角的图
     fig, axes = plt.subplots(2, 4)
-    s = [5] * len(x) # size of the point
+    s = 5 # size of the point 所有点的大小相等
     axes[0][0].scatter(x, y[0], s=s)
     axes[0][1].scatter(x, y[1], s=s)
     axes[0][2].scatter(x, y[2], s=s)
@@ -3,8 +3,13 @@
 
 from __future__ import division
 from math import pi
+import numpy as np
+from pygameVector import Vec2d, Vec3d
 
-__all__ = ['Circle', 'Light', 'Sphere']
+__all__ = ['Circle', 'Light', 'LightBundle', 'Sphere', 'RayBundle', 'UNITS']
+
+# 长度单位换算为 mm
+UNITS = {'nm':1e-6, 'um':1e-3, 'mm':1, 'cm':1e3}
 
 class Circle(object):
     """
@@ -38,11 +43,10 @@ class Light(object):
     @unit: 单位可选 nm, um, mm, cm
     """
     def __init__(self, wavelength, direction, refraction_index=1, unit='mm'):
-        units = {'nm':1e-6, 'um':1e-3, 'mm':1, 'cm':1e3}
-        if unit not in units.keys():
-            raise ValueError('Use correct unit in {0}'.format(list(units.keys())))
+        if unit not in UNITS.keys():
+            raise ValueError('Use correct unit in {0}'.format(list(UNITS.keys())))
         self.unit = unit
-        self.wavelength = wavelength * units[unit]    # unit: mm
+        self.wavelength = wavelength * UNITS[unit]    # unit: mm
         self.refraction_index = refraction_index
         self.direction = direction.normalized()
         self.k = Light.wavenum(self.wavelength, refraction_index)
@@ -58,6 +62,50 @@ class Light(object):
         return k
 
 
+class LightBundle(object):
+    """
+    一组光线的类 每个属性是一个数组 代替 Light 的列表
+    单位只换算一次，每条光线的 Light 只在取出时生成
+    @wavelengths: (N,) 或标量 波长
+    @directions: (N, 2) 或 (N, 3) 方向 自动单位化
+    @refraction_indices: (N,) 或标量 折射率
+    @unit: 单位可选 nm, um, mm, cm
+    属性与 Light 相同 wavelength (N,) 单位为mm，refraction_index (N,)，direction (N, d)，k (N,)，k_vector (N, d)
+    """
+    def __init__(self, wavelengths, directions, refraction_indices=1, unit='mm'):
+        if unit not in UNITS.keys():
+            raise ValueError('Use correct unit in {0}'.format(list(UNITS.keys())))
+        self.unit = unit
+        directions = np.array(directions, dtype=np.float64)
+        directions = directions.reshape(-1, directions.shape[-1])
+        size = len(directions)
+        self.wavelength = np.array(np.broadcast_to(wavelengths, size), dtype=np.float64) * UNITS[unit]   # unit: mm
+        self.refraction_index = np.array(np.broadcast_to(refraction_indices, size), dtype=np.float64)
+        lengths = np.linalg.norm(directions, axis=-1)[:, None]
+        self.direction = directions / np.maximum(lengths, np.finfo(np.float64).tiny)
+        self.k = Light.wavenum(self.wavelength, self.refraction_index)
+        self.k_vector = self.k[:, None] * self.direction
+
+    def __len__(self):
+        return len(self.direction)
+
+    def __getitem__(self, key):
+        # 整数取出一条光线的 Light 切片或掩码取出子光束
+        if isinstance(key, (int, np.integer)):
+            vector = Vec2d if self.direction.shape[-1] == 2 else Vec3d
+            return Light(self.wavelength[key] / UNITS[self.unit], vector(*self.direction[key]),
+                         self.refraction_index[key], unit=self.unit)
+        return LightBundle(self.wavelength[key] / UNITS[self.unit], self.direction[key],
+                           self.refraction_index[key], unit=self.unit)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return "LightBundle({0} lights, dim={1})".format(len(self), self.direction.shape[-1])
+
+
 class Sphere(object):
     """
     定义球的类
@@ -68,7 +116,7 @@ class Sphere(object):
     """
     def __init__(self, radius, center_or_x=(0, 0, 0), center_y=None, center_z=None):
         self.radius = radius
-        if not center_y or center_z:
+        if center_y is None and center_z is None:
             self.center = center_or_x
         else:
             self.center = (center_or_x, center_y, center_z)
@@ -80,8 +128,51 @@ class Sphere(object):
         return False
 
 
+class RayBundle(object):
+    """
+    光束的类 每条光线占一行 (struct-of-arrays)
+    @positions: (N, 2) 或 (N, 3) 光线的起点/当前作用点
+    @directions: (N, 2) 或 (N, 3) 光线方向 自动单位化
+    @wavenums: (N,) 波数 同 Light.k
+    @refraction_indices: (N,) 光线所在介质的折射率
+    @orders: (N,) 已作用的次数
+    @powers: (N, 2) 光线的 s 偏振与 p 偏振的功率 默认为非偏振光 总功率为1
+    """
+    def __init__(self, positions, directions, wavenums, refraction_indices=1, orders=0, powers=0.5):
+        self.positions = np.array(positions, dtype=np.float64, ndmin=2)
+        directions = np.array(directions, dtype=np.float64, ndmin=2)
+        directions = np.broadcast_to(directions, self.positions.shape)
+        self.directions = directions / np.linalg.norm(directions, axis=-1)[:, None]
+        size = len(self.positions)
+        self.wavenums = np.array(np.broadcast_to(wavenums, size), dtype=np.float64)
+        self.refraction_indices = np.array(np.broadcast_to(refraction_indices, size), dtype=np.float64)
+        self.orders = np.array(np.broadcast_to(orders, size), dtype=np.intp)
+        self.powers = np.array(np.broadcast_to(powers, (size, 2)), dtype=np.float64)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, key):
+        # 按掩码或索引取出子光束
+        return RayBundle(self.positions[key], self.directions[key], self.wavenums[key],
+                         self.refraction_indices[key], self.orders[key], self.powers[key])
 
+    def __repr__(self):
+        return "RayBundle({0} rays, dim={1})".format(len(self), self.positions.shape[-1])
 
+    @property
+    def k_vectors(self):
+        return self.wavenums[:, None] * self.directions
 
-
-
+    @classmethod
+    def from_light(cls, light, start_points, directions=None):
+        """由一束平行光和起始点生成光束
+        @light: Light的实例
+        @start_points: 起始点的列表
+        @directions: (N, d) 每条光线的方向 如点光源的扇形光束 默认为 light.direction
+        """
+        dim = len(light.direction)
+        positions = np.array(start_points, dtype=np.float64).reshape(-1, dim)
+        if directions is None:
+            directions = [light.direction[i] for i in range(dim)]
+        return cls(positions, directions, light.k, light.refraction_index)
@@ -4,11 +4,15 @@
 from __future__ import division
 import math
 import decimal
-from numpy import matrix, linspace
-from pygameVector import Vec2d
+import numpy as np
+from numpy import linspace
+from pygameVector import Vec2d, Vec2dArray
 from intersectionElements import Circle, Light
 
-__all__ = ['tangential_vector_to_circle', 'intersection', 'reflection', 'refraction', 'pick_start_points']
+__all__ = ['tangential_vector_to_circle', 'tangent_cones', 'point_source_fan', 'intersection', 'reflection', 'refraction', 'pick_start_points',
+           'batch_intersection', 'batch_ref_factors', 'batch_reflection', 'batch_refraction',
+           'impact_parameters', 'deviation_angles', 'chord_rotations', 'rotate_about', 'circle_paths',
+           'refine_samples', 'adaptive_start_points', 'fresnel_coefficients', 'batch_fresnel']
 
 
 def tangential_vector_to_circle(circle, start_point):
@@ -18,25 +22,11 @@ def tangential_vector_to_circle(circle, start_point):
     @param:start_point: (x, y)
     @return: tuple
     """
-    center = circle.center
-    radius = circle.radius
-    dx = center[0] - start_point[0]
-    dy = center[1] - start_point[1] 
-    dd = math.sqrt(dx*dx + dy*dy)
-    if dd < radius:
+    cone = tangent_cones(circle, start_point)
+    if np.isnan(cone['half_angle'][0]):
         return None
-    a = math.asin(radius/dd)
-    b = math.atan2(dy, dx)
-
-    # 顺时针一个角度，逆时针一个角度
-    t1 = dict(x=radius*math.sin(b-a), y=radius*(-math.cos(b-a)))
-    t2 = dict(x=radius*(-math.sin(b+a)), y=radius*math.cos(b+a))
-    # 两个切点
-    p1 = (center[0]+t1['x'], center[1]+t1['y'])
-    p2 = (center[0]+t2['x'], center[1]+t2['y'])
     # 两条切线方向
-    vector1 = Vec2d((p1[0]-start_point[0]), (p1[1]-start_point[1])).normalized()
-    vector2 = Vec2d((p2[0]-start_point[0]), (p2[1]-start_point[1])).normalized()
+    vector1, vector2 = [Vec2d(tuple(t)) for t in cone['tangents'][0]]
     # 保留两位小数 切断其他位
     vector1 = Vec2d(1, decimal.Decimal(vector1.y/vector1.x).quantize(decimal.Decimal('.01'), rounding=decimal.ROUND_DOWN))
     vector2 = Vec2d(1, decimal.Decimal(vector2.y/vector2.x).quantize(decimal.Decimal('.01'), rounding=decimal.ROUND_DOWN))
@@ -44,6 +34,47 @@ def tangential_vector_to_circle(circle, start_point):
     return vector
 
 
+def tangent_cones(circle, source_points):
+    """点光源照到圆上的方向范围 即两条切线之间的锥 tangential_vector_to_circle 的批量版本
+    @param:circle: instance of Circle
+    @param:source_points: (M, 2) 点光源的位置
+    @return: 字典
+        axis (M,) 点光源指向圆心的方向角 单位为度 同 Vec2d.angle
+        half_angle (M,) 锥的半角 单位为度 点光源在圆内或圆上时为 nan
+        tangents (M, 2, 2) 两条切线的单位方向 先顺时针一侧 后逆时针一侧
+    """
+    center = np.asarray(circle.center, dtype=np.float64)
+    offset = center - np.asarray(source_points, dtype=np.float64).reshape(-1, 2)
+    dd = np.hypot(offset[:, 0], offset[:, 1])
+    outside = dd > circle.radius
+    a = np.where(outside, np.arcsin(circle.radius / np.where(outside, dd, circle.radius)), np.nan)
+    b = np.arctan2(offset[:, 1], offset[:, 0])
+    angles = np.stack((b-a, b+a), axis=-1)     # 顺时针一个角度，逆时针一个角度
+    tangents = Vec2dArray(np.cos(angles), np.sin(angles)).data.reshape(-1, 2, 2)
+    return dict(axis=np.degrees(b), half_angle=np.degrees(a), tangents=tangents)
+
+
+def point_source_fan(circle, source_points, density):
+    """点光源（发散光）的扇形光束 方向只取切线之间 每条光线都与圆相交
+    方向按角度等分 取每份的中点 不取切线本身
+    @param:circle: instance of Circle
+    @param:source_points: (M, 2) 点光源的位置 必须在圆外
+    @param:density: 每个点光源的光线条数
+    @return: tuple (positions, directions) 都是 (M*density, 2) 第 i 个点光源的光线为 i*density 到 (i+1)*density-1 行
+    """
+    density = int(density)
+    if density < 1:
+        raise ValueError('Density should not be less than 1')
+    sources = np.asarray(source_points, dtype=np.float64).reshape(-1, 2)
+    cones = tangent_cones(circle, sources)
+    if np.isnan(cones['half_angle']).any():
+        raise ValueError('Point source should be outside the circle')
+    spread = (np.arange(density) + 0.5) / density * 2 - 1    # (-1, 1) 内等分的中点
+    angles = np.radians(cones['axis'][:, None] + cones['half_angle'][:, None]*spread).reshape(-1)
+    directions = Vec2dArray(np.cos(angles), np.sin(angles))
+    return np.repeat(sources, density, axis=0), directions.data
+
+
 def intersection(circle, vector, start_point):
     """计算向量与源的交点get circle attributes
     @param:circle: instance of Circle
@@ -78,6 +109,39 @@ def intersection(circle, vector, start_point):
     return ((intersection_one.x, intersection_one.y), (intersection_two.x, intersection_two.y))
 
 
+def batch_intersection(circle, vectors, start_points):
+    """intersection 的批量版本 一次计算N条光线与圆的交点
+    @param:circle: instance of Circle
+    @param:vectors: (N, 2) 或 (2,) 光线方向
+    @param:start_points: (N, 2) 起始点
+    @return: tuple (first, second, hit)
+             first/second 与 intersection 的两个交点顺序相同 无交点的行为nan
+             hit 是否有交点的布尔数组
+    """
+    center = np.asarray(circle.center, dtype=np.float64)
+    radius = circle.radius
+
+    start_points = np.asarray(start_points, dtype=np.float64)
+    vectors = np.broadcast_to(np.asarray(vectors, dtype=np.float64), start_points.shape)
+    offset = start_points - center
+    # the params for calculating t
+    a = np.sum(vectors*vectors, axis=-1)
+    b = 2 * np.sum(vectors*offset, axis=-1)
+    c = np.sum(offset*offset, axis=-1) - radius*radius
+    disc = b*b - 4*a*c
+    hit = disc >= 0     # 判别式小于零则没有交点
+    sqrt_disc = np.sqrt(np.where(hit, disc, np.nan))
+    t1 = (-b - sqrt_disc) / (2*a)
+    t2 = (-b + sqrt_disc) / (2*a)
+    # filt the start point 如果起始点为交点之一则舍弃
+    keep_t1 = np.abs(t1) > 1e-6
+    first_t = np.where(keep_t1, t1, t2)
+    second_t = np.where(keep_t1 & (np.abs(t2) > 1e-6), t2, 0)
+    first = start_points + first_t[..., None]*vectors
+    second = start_points + second_t[..., None]*vectors
+    return (first, second, hit)
+
+
 def pick_start_points(circle, vector, density, distance=2, tol=1e-2):
     """光簇起始点的生成
     @param:circle: instance of Circle
@@ -93,45 +157,244 @@ def pick_start_points(circle, vector, density, distance=2, tol=1e-2):
     t_range = linspace(tol, t_limits-tol, density) if 0 < t_limits \
                 else linspace(t_limits+tol, -tol, density)               # span of vector factor 决定范围的t的步长
     basic_point_v = Vec2d(p1) - vector*circle.radius*distance           # vector of the starting point
-    start_points_v = [basic_point_v + t*v for t in t_range]             # collection of the start points vector
-    start_points = [(p.x, p.y) for p in start_points_v]
-    return start_points
+    start_points_v = Vec2dArray(t_range*v.x, t_range*v.y) + basic_point_v     # collection of the start points vector
+    return [tuple(p) for p in start_points_v.data.tolist()]
+
+
+def impact_parameters(circle, vector, start_points):
+    """光线的碰撞参数 起始点到过圆心且平行于入射光的直线的有向距离
+    在入射方向左侧为正 与 deviation_angles 配合使用
+    @param:circle: instance of Circle
+    @param:vector: instance of Vec2d 入射光方向
+    @param:start_points: (N, 2) 起始点
+    @return: (N,) 有向距离 单位同半径
+    """
+    center = np.asarray(circle.center, dtype=np.float64)
+    offset = np.asarray(start_points, dtype=np.float64).reshape(-1, 2) - center
+    ux, uy = vector.normalized()
+    return ux*offset[:, 1] - uy*offset[:, 0]
+
+
+def deviation_angles(circle, light, refraction_index, impact_parameters, orders):
+    """平面波照射均匀圆时出射光的方位角 无需追迹
+    第N次作用的出射光（N=1 为圆外的反射光，N>=2 为圆内反射 N-2 次后的折射光）
+    偏折角 D = 2θi - 2(N-1)θr + (N-2)π，即 Descartes 公式中 p = N-2
+    每条光线每个作用次数为O(1)，可以只计算某一个作用次数
+    @param:circle: instance of Circle
+    @param:light: instance of Light 入射光 其折射率为外界折射率
+    @param:refraction_index: 圆柱内折射率 标量或 (L,) 每个波长的折射率（见 dispersion）
+    @param:impact_parameters: (N,) 碰撞参数 见 impact_parameters
+    @param:orders: 作用次数 整数或整数列表
+    @return: 方位角（度）与 Vec2d.angle 相同，范围 (-180, 180]
+             orders 为整数时形状为 (N,)，否则为 (len(orders), N)
+             refraction_index 为数组时在 N 之前多一维 L，如 (len(orders), L, N)
+    """
+    orders = np.asarray(orders)
+    if np.any(orders < 1):
+        raise ValueError('Intersection times should not be less than 1')
+    ratio = np.asarray(impact_parameters, dtype=np.float64) / circle.radius
+    sign = np.where(ratio < 0, -1., 1.)     # 在入射方向左侧的光线顺时针偏折
+    theta_i = np.arcsin(np.minimum(np.abs(ratio), 1))
+    refraction_index = np.asarray(refraction_index, dtype=np.float64)
+    theta_r = np.arcsin(np.sin(theta_i) * light.refraction_index / refraction_index[..., None])
+
+    n = orders.reshape(orders.shape + (1,)*theta_r.ndim)
+    deviation = 2*theta_i - 2*(n-1)*theta_r + (n-2)*math.pi
+    azimuth = math.radians(light.direction.angle) - sign*deviation
+    return 180 - np.degrees(math.pi - azimuth) % 360
+
+
+def refine_samples(func, lower, upper, budget, initial=32, resolution=None):
+    """一维自适应采样 在相邻采样点角度变化最大的区间中点加密
+    每一轮二分角度差不小于最大角度差一半的区间（角度差大的优先），直到采样点数达到 budget
+    或所有相邻采样点的角度差都不大于 resolution
+    @param:func 由采样点 (N,) 得到角度 (N,) 或 (K, N) 的函数 单位为度
+    @param:lower, upper 采样范围
+    @param:budget 最多的采样点数
+    @param:initial 初始均匀采样点数
+    @param:resolution 角度分辨率（度） None 时用完 budget
+    @return: (N,) 升序的采样点
+    """
+    x = linspace(lower, upper, max(2, min(initial, budget)))
+    y = np.atleast_2d(func(x))
+    min_width = abs(upper - lower) * 1e-12
+    while len(x) < budget:
+        gaps = np.max(np.abs((np.diff(y, axis=-1) + 180) % 360 - 180), axis=0)  # 相邻采样点的角度差 考虑周期
+        gaps[np.diff(x) <= min_width] = 0   # 区间过窄则不再二分
+        if not gaps.any() or (resolution is not None and gaps.max() <= resolution):
+            break
+        limit = max(gaps.max() / 2, 0 if resolution is None else resolution)
+        candidates = np.flatnonzero(gaps >= limit)
+        chosen = candidates[np.argsort(-gaps[candidates])][:budget-len(x)]
+        new_x = (x[chosen] + x[chosen+1]) / 2
+        order = np.argsort(np.concatenate([x, new_x]), kind='mergesort')
+        x = np.concatenate([x, new_x])[order]
+        y = np.concatenate([y, np.atleast_2d(func(new_x))], axis=-1)[:, order]
+    return x
+
+
+def adaptive_start_points(circle, light, refraction_index, orders, budget, initial=32, resolution=None, distance=2, tol=1e-2):
+    """光簇起始点的自适应生成 范围与 pick_start_points 相同
+    在出射方位角随起始点变化快的地方（如虹的焦散附近）加密，变化慢的地方稀疏
+    方位角由 deviation_angles 直接计算 不需要追迹
+    @param:circle: instance of Circle
+    @param:light: instance of Light 入射光
+    @param:refraction_index: 圆柱内折射率
+    @param:orders: 依据的作用次数 整数或整数列表（取各次作用中最大的角度差）
+    @param:budget: 最多的光线条数
+    @param:initial: 初始均匀分布的光线条数
+    @param:resolution: 相邻光线出射角的最大差值（度） None 时用完 budget
+    @return: list 同 pick_start_points
+    """
+    vector = light.direction.normalized()
+    first, last = np.asarray(pick_start_points(circle, vector, 2, distance, tol), dtype=np.float64)  # 范围的两端
+
+    def points(s):
+        return first + s[:, None]*(last - first)
+
+    def angles(s):
+        return deviation_angles(circle, light, refraction_index, impact_parameters(circle, vector, points(s)), orders)
+
+    s = refine_samples(angles, 0, 1, budget, initial, resolution)
+    return [tuple(p) for p in points(s)]
+
+
+def chord_rotations(circle, intersection_points, directions):
+    """圆内每条弦对应的圆心角相同（π - 2θr），下一个交点即当前交点绕圆心旋转该角度
+    由圆内光线的方向直接得到旋转角的余弦和正弦，不需要三角函数
+    @param:circle: instance of Circle
+    @param:intersection_points: (N, 2) 圆上的作用点
+    @param:directions: (N, 2) 圆内光线的单位方向
+    @return: tuple (cos, sin) 每条光线的旋转角的余弦和正弦 (N,)
+    """
+    center = np.asarray(circle.center, dtype=np.float64)
+    normal = (np.asarray(intersection_points, dtype=np.float64) - center) / circle.radius
+    directions = np.asarray(directions, dtype=np.float64)
+    cos_r = np.sum(directions*normal, axis=-1)      # -cos(θr)
+    cross = normal[..., 0]*directions[..., 1] - normal[..., 1]*directions[..., 0]  # 符号决定旋转方向
+    return (1 - 2*cos_r*cos_r, -2*cos_r*cross)
+
+
+def rotate_about(circle, points, cos, sin):
+    """将圆上的点绕圆心旋转 (cos, sin) 给定的角度
+    """
+    center = np.asarray(circle.center, dtype=np.float64)
+    offset = np.asarray(points, dtype=np.float64) - center
+    return center + np.stack((cos*offset[..., 0] - sin*offset[..., 1],
+                              sin*offset[..., 0] + cos*offset[..., 1]), axis=-1)
+
+
+def circle_paths(circle, light, refraction_index, impact_parameters, intersection_time):
+    """平面波照射均匀圆时所有交点的坐标 无需求解交点方程
+    第一个交点由碰撞参数得到，之后的交点依次绕圆心旋转 π - 2θr
+    对 (K+1, N) 的数组一次广播计算
+    @param:circle: instance of Circle
+    @param:light: instance of Light 入射光 其折射率为外界折射率
+    @param:refraction_index: 圆柱内折射率
+    @param:impact_parameters: (N,) 碰撞参数 见 impact_parameters
+    @param:intersection_time: 作用次数 K
+    @return: (K+1, N, 2) 第1到第K+1个交点，与 intersectionTracer.trace 的 points 相同
+             第k次作用在圆内的线段为 points[k-1] -> points[k]
+    """
+    if not isinstance(intersection_time, int) or intersection_time < 1:
+        raise ValueError('Intersection times should not be less than 1 and should be int')
+    center = np.asarray(circle.center, dtype=np.float64)
+    ratio = np.asarray(impact_parameters, dtype=np.float64) / circle.radius
+    sign = np.where(ratio < 0, -1., 1.)
+    theta_i = np.arcsin(np.minimum(np.abs(ratio), 1))
+    theta_r = np.arcsin(np.sin(theta_i) * light.refraction_index / refraction_index)
+
+    first = math.radians(light.direction.angle) + math.pi - sign*theta_i   # 第一个交点的角度
+    times = np.arange(intersection_time+1)[:, None]
+    angles = first - times*sign*(math.pi - 2*theta_r)
+    return center + circle.radius*np.stack((np.cos(angles), np.sin(angles)), axis=-1)
+
+
+def batch_ref_factors(circle, intersection_points, k_vectors):
+    """ref_factors 的批量版本 计算边界条件的参数
+    法向直接由 (p-c)/r 得到，不再经过角度和C矩阵
+    @param:circle instance of Circle
+    @param:intersection_points (N, 2) 作用点
+    @param:k_vectors (N, 2) 入射光的波矢量
+    @return: dict
+        n (N, 2) 法向单位矢量, t (N, 2) 切向单位矢量
+        vertical (N,) 入射光的法向分量, tangen (N,) 入射光的切向分量
+    """
+    center = np.asarray(circle.center, dtype=np.float64)
+    points = np.asarray(intersection_points, dtype=np.float64)
+    k_vectors = np.asarray(k_vectors, dtype=np.float64)
+
+    vertical_direction = points - center
+    vertical_direction = vertical_direction / np.linalg.norm(vertical_direction, axis=-1)[..., None]
+    tangen_direction = np.stack((-vertical_direction[..., 1], vertical_direction[..., 0]), axis=-1)
+    # the components of the incident ray
+    incident_k_vertical = np.sum(k_vectors*vertical_direction, axis=-1)  # 法向
+    incident_k_tangen = np.sum(k_vectors*tangen_direction, axis=-1)      # 切向
+    return dict(n=vertical_direction, t=tangen_direction,
+                vertical=incident_k_vertical, tangen=incident_k_tangen)
+
+
+def batch_reflection(factors):
+    """反射光的单位方向 (N, 2)
+    @factors batch_ref_factors 返回的字典
+    """
+    direction = (-factors['vertical'])[..., None]*factors['n'] + factors['tangen'][..., None]*factors['t']
+    return direction / np.linalg.norm(direction, axis=-1)[..., None]
+
+
+def batch_refraction(factors, wavenums):
+    """折射光的单位方向 (N, 2)
+    @factors batch_ref_factors 返回的字典
+    @wavenums 折射光的波数 标量或 (N,)
+    切向分量守恒 法线方向的符号和入射光线相同 全反射时法向分量取0
+    """
+    tangen = factors['tangen']
+    sign = np.where(factors['vertical'] > 0, 1., -1.)
+    kt_vertical = sign * np.sqrt(np.maximum(np.square(wavenums) - tangen*tangen, 0))
+    direction = kt_vertical[..., None]*factors['n'] + tangen[..., None]*factors['t']
+    return direction / np.linalg.norm(direction, axis=-1)[..., None]
+
+
+def fresnel_coefficients(k_normal, k_tangen, wavenums, incident_wavenums):
+    """Fresnel 公式 s 偏振与 p 偏振的功率反射率与透射率 二维与三维通用
+    n1cosθi 与 n2cosθt 分别正比于入射光与折射光波矢的法向分量，不需要三角函数
+    @param:k_normal (N,) 入射光波矢的法向分量
+    @param:k_tangen (N,) 入射光波矢的切向分量
+    @param:wavenums 折射光的波数 标量或 (N,)
+    @param:incident_wavenums 入射光的波数 标量或 (N,)
+    @return: dict Rs, Rp, Ts, Tp (N,) 全反射时 R 为1 T 为0
+    """
+    incident_normal = np.abs(k_normal)
+    k1, k2 = np.square(incident_wavenums), np.square(wavenums)
+    refracted_normal = np.sqrt(np.maximum(k2 - np.square(k_tangen), 0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rs = (incident_normal - refracted_normal) / (incident_normal + refracted_normal)
+        rp = (k2*incident_normal - k1*refracted_normal) / (k2*incident_normal + k1*refracted_normal)
+    # 掠入射时分母为0 全部反射
+    Rs = np.where(np.isnan(rs), 1, np.square(rs))
+    Rp = np.where(np.isnan(rp), 1, np.square(rp))
+    return dict(Rs=Rs, Rp=Rp, Ts=1-Rs, Tp=1-Rp)
+
+
+def batch_fresnel(factors, wavenums, incident_wavenums):
+    """作用点处的 Fresnel 功率反射率与透射率 见 fresnel_coefficients
+    @factors batch_ref_factors 返回的字典
+    @wavenums 折射光的波数
+    @incident_wavenums 入射光的波数
+    """
+    return fresnel_coefficients(factors['vertical'], factors['tangen'], wavenums, incident_wavenums)
 
 
 def ref_factors(circle, incident_light, intersection_point):
-    """calculate the C matrix and the K factor of the incident ray
-    计算边界条件的参数 入射光线的分量和C矩阵
+    """calculate the K factor of the incident ray
+    计算边界条件的参数 入射光线的分量 batch_ref_factors 的单条光线版本
     @param:circle instance of Circle
     @param:incident_light instance of Light
     @param:intersection_point coordinate (x, y)
     @return: dict factors to calculation of the lights
     """
-    def convert_to_rectangular_coordinate(vertical, tangen):
-        # compute the transform factor
-        # 计算C矩阵
-        m11 = vertical.x
-        m12 = tangen.x
-        m21 = vertical.y
-        m22 = tangen.y
-        C = matrix([[m11, m12], [m21, m22]])
-        return C
-
-    center = circle.center
-    radius = circle.radius 
-    incident_vector = incident_light.k * incident_light.direction    # vector that represent the light direction
-
-    _vec = Vec2d(intersection_point[0]-center[0], intersection_point[1]-center[1])
-    angle = math.radians(_vec.angle)
-
-    vertical_direction = Vec2d(math.cos(angle), math.sin(angle)).normalized()
-    tangen_direction = Vec2d((-1)*math.sin(angle), math.cos(angle)).normalized()
-    # the components of the incident ray
-    incident_k_vertical = incident_vector.dot(vertical_direction)   # 法向
-    incident_k_tangen = incident_vector.dot(tangen_direction)       # 切向
-    # factor that determine the relection ray and refraction ray
-    transform_factor = convert_to_rectangular_coordinate(vertical_direction, tangen_direction)
-
-    return dict(c=transform_factor, tangen=incident_k_tangen, vertical=incident_k_vertical)
+    k_vector = incident_light.k_vector
+    return batch_ref_factors(circle, intersection_point, (k_vector.x, k_vector.y))
 
 
 def reflection(factors, incident_light):
@@ -139,16 +402,8 @@ def reflection(factors, incident_light):
     计算反射光线 利用边界条件的结果
     @factors ref_factors 返回的字典
     @incident_light 光线的实例"""
-    wavelength =  incident_light.wavelength
-    refraction_index = incident_light.refraction_index
-    
-    # light direction
-    # formula to calculate the K factor
-    incident_k_vertical = (-1) * factors['vertical']
-    incident_k_tangen = factors['tangen']
-    direction = factors['c'] * matrix([[incident_k_vertical], [incident_k_tangen]])
-    vector = Vec2d(direction.A1).normalized()
-    return Light(wavelength, vector, refraction_index)
+    direction = batch_reflection(factors)
+    return Light(incident_light.wavelength, Vec2d(direction), incident_light.refraction_index)
 
 
 def refraction(factors, incident_light, refraction_index):
@@ -156,16 +411,6 @@ def refraction(factors, incident_light, refraction_index):
     计算折射光线 利用边界条件的结果
     """
     wavelength = incident_light.wavelength
-    
-    # refraction light direction
-    # formula
     wavenum = Light.wavenum(wavelength, refraction_index)
-    incident_k_vertical = factors['vertical']
-    incident_k_tangen = factors['tangen']
-    sign = 1 if incident_k_vertical > 0 else -1         # 法线方向的符号和入射光线相同
-    kt_vertical = sign * math.sqrt(wavenum*wavenum - incident_k_tangen*incident_k_tangen)    # 法线方向
-    direction = factors['c'] * matrix([[kt_vertical], [incident_k_tangen]])
-    vector = Vec2d(direction.A1).normalized()
-    return Light(wavelength, vector, refraction_index)
-
-
+    direction = batch_refraction(factors, wavenum)
+    return Light(wavelength, Vec2d(direction), refraction_index)
@@ -0,0 +1,434 @@
+#/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from __future__ import division
+import numpy as np
+from rayTree import expand_tree
+from intersectionTracer import _interact
+
+__all__ = ['Scene', 'LatticeScene', 'trace_tree']
+
+
+class _Particles(object):
+    # 每条光线所在的圆 batch_ref_factors 只使用 center
+    __slots__ = ['center', 'radius']
+
+    def __init__(self, center, radius):
+        self.center = center
+        self.radius = radius
+
+
+class Scene(object):
+    """
+    多个圆（圆柱）组成的场景 用均匀网格加速光线与圆的求交
+    每个网格单元记录与其包围盒重叠的圆，光线用 DDA 逐个单元前进，只与当前单元中的圆求交
+    每条光线的代价与经过的单元数有关，与圆的总数无关
+    @param:centers (M, 2) 圆心
+    @param:radii (M,) 或标量 半径
+    @param:cell_size 网格单元的边长 None 时取平均直径与每个圆平均占有面积的边长中较大的
+    圆之间不应重叠
+    """
+    def __init__(self, centers, radii, cell_size=None):
+        self.centers = np.array(centers, dtype=np.float64, ndmin=2).reshape(-1, 2)
+        self.radii = np.array(np.broadcast_to(radii, len(self.centers)), dtype=np.float64)
+        if not len(self.centers):
+            raise ValueError('Scene should have at least one circle')
+        if np.any(self.radii <= 0):
+            raise ValueError('Radius should be positive')
+        self.lower = (self.centers - self.radii[:, None]).min(axis=0)
+        self.upper = (self.centers + self.radii[:, None]).max(axis=0)
+        if cell_size is None:
+            area = np.prod(self.upper - self.lower)
+            cell_size = max(2*self.radii.mean(), np.sqrt(area / len(self.centers)))
+        self.cell_size = float(cell_size)
+        self.shape = np.maximum(np.ceil((self.upper - self.lower) / self.cell_size), 1).astype(np.intp)
+        self._build()
+
+    @classmethod
+    def from_circles(cls, circles, cell_size=None):
+        """由 Circle 的列表生成场景
+        注意 Circle 的圆心离原点的距离小于半径时会被置为 (0, 0)
+        """
+        return cls([c.center for c in circles], [c.radius for c in circles], cell_size)
+
+    def __len__(self):
+        return len(self.centers)
+
+    def __repr__(self):
+        return "Scene({0} circles, grid={1}x{2})".format(len(self), self.shape[0], self.shape[1])
+
+    def _cells(self, points):
+        # 点所在单元的 (x, y) 序号 限制在网格内
+        index = np.floor((points - self.lower) / self.cell_size).astype(np.intp)
+        return np.clip(index, 0, self.shape - 1)
+
+    def _build(self):
+        # 每个圆加入其包围盒覆盖的所有单元 单元内的圆按 CSR 存放：cell_items[cell_starts[c]:cell_starts[c+1]]
+        lo = self._cells(self.centers - self.radii[:, None])
+        hi = self._cells(self.centers + self.radii[:, None])
+        nx = hi[:, 0] - lo[:, 0] + 1
+        counts = nx * (hi[:, 1] - lo[:, 1] + 1)
+        owners = np.repeat(np.arange(len(self)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = (lo[owners, 1] + local // nx[owners]) * self.shape[0] + lo[owners, 0] + local % nx[owners]
+        order = np.argsort(cells, kind='stable')
+        self.cell_items = owners[order]
+        self.cell_starts = np.concatenate([[0], np.cumsum(np.bincount(cells, minlength=int(np.prod(self.shape))))])
+
+    def _candidates(self, cells):
+        # 单元中的圆 返回 (每个候选所属的输入序号, 圆的序号)
+        starts = self.cell_starts[cells]
+        counts = self.cell_starts[cells+1] - starts
+        owners = np.repeat(np.arange(len(cells)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return owners, self.cell_items[starts[owners] + local]
+
+    def nearest_hit(self, positions, directions, tol=None):
+        """光线前方最近的交点 对整个光束一次计算
+        @param:positions (N, 2) 光线起点
+        @param:directions (N, 2) 光线方向
+        @param:tol 起点附近不算交点的距离 None 时为最大半径的 1e-9 倍
+        @return: 字典
+            points (N, 2) 交点 无交点的行为nan
+            indices (N,) 相交的圆的序号 无交点为 -1
+            distances (N,) 起点到交点的距离 无交点为 inf
+            hit (N,) 是否有交点
+        """
+        tol = 1e-9 * self.radii.max() if tol is None else tol
+        positions = np.array(positions, dtype=np.float64, ndmin=2).reshape(-1, 2)
+        directions = np.array(np.broadcast_to(directions, positions.shape), dtype=np.float64)
+        directions = directions / np.linalg.norm(directions, axis=-1)[:, None]
+        size = len(positions)
+        distances = np.full(size, np.inf)
+        indices = np.full(size, -1, dtype=np.intp)
+
+        # 光线与网格边界的交 得到进入与离开网格的距离
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverse = 1 / directions
+            t0 = (self.lower - positions) * inverse
+            t1 = (self.upper - positions) * inverse
+        parallel = directions == 0
+        inside_slab = (positions >= self.lower) & (positions <= self.upper)
+        t_near = np.where(parallel, np.where(inside_slab, -np.inf, np.inf), np.minimum(t0, t1)).max(axis=-1)
+        t_far = np.where(parallel, np.where(inside_slab, np.inf, -np.inf), np.maximum(t0, t1)).min(axis=-1)
+        t_enter = np.maximum(t_near, 0)
+        active = t_enter <= t_far
+
+        # DDA 的初始状态 当前单元，下一条单元边界的距离，每跨过一个单元增加的距离
+        cells = self._cells(positions + np.where(active, t_enter, 0)[:, None]*directions)
+        step = np.sign(directions).astype(np.intp)
+        boundary = self.lower + (cells + (step > 0)) * self.cell_size
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_max = np.where(parallel, np.inf, (boundary - positions) * inverse)
+            t_delta = np.where(parallel, np.inf, self.cell_size * np.abs(inverse))
+
+        while active.any():
+            rays = np.flatnonzero(active)
+            owners, items = self._candidates(cells[rays, 1]*self.shape[0] + cells[rays, 0])
+            # 候选圆的交点 取起点前方较近的一个
+            offset = positions[rays[owners]] - self.centers[items]
+            b = np.sum(offset*directions[rays[owners]], axis=-1)
+            disc = b*b - (np.sum(offset*offset, axis=-1) - self.radii[items]**2)
+            root = np.sqrt(np.where(disc >= 0, disc, np.nan))
+            t = np.where(-b - root > tol, -b - root, np.where(-b + root > tol, -b + root, np.inf))
+            t[np.isnan(t)] = np.inf
+            nearest = np.full(len(rays), np.inf)
+            np.minimum.at(nearest, owners, t)
+            # 交点在当前单元内才是最近的 之后单元中的交点留到之后的单元
+            cell_exit = t_max[rays].min(axis=-1)
+            found = np.isfinite(nearest) & (nearest <= cell_exit + tol)
+            winner = found[owners] & (t == nearest[owners])
+            indices[rays[owners[winner]]] = items[winner]
+            distances[rays[found]] = nearest[found]
+            active[rays[found]] = False
+
+            # 没有交点的光线前进一个单元
+            rays = rays[~found]
+            axis = np.argmin(t_max[rays], axis=-1)
+            cells[rays, axis] += step[rays, axis]
+            t_max[rays, axis] += t_delta[rays, axis]
+            leaving = np.any((cells[rays] < 0) | (cells[rays] >= self.shape), axis=-1) | \
+                      (t_max[rays, axis] - t_delta[rays, axis] > t_far[rays])
+            active[rays[leaving]] = False
+
+        hit = indices >= 0
+        points = positions + np.where(hit, distances, np.nan)[:, None]*directions
+        return dict(points=points, indices=indices, distances=distances, hit=hit)
+
+    def intersect(self, positions, directions):
+        """同 rayTree.forward_hits 的返回值 用于 rayTree.expand_tree
+        @return: tuple (points, hit)
+        """
+        result = self.nearest_hit(positions, directions)
+        return result['points'], result['hit']
+
+    def locate(self, points, tol=1e-6):
+        """圆周上的点所在的圆
+        @param:points (N, 2) 圆周上的点 如 nearest_hit 的交点
+        @param:tol 到圆周的距离与半径之比的容差
+        @return: (N,) 圆的序号 不在任何圆周上为 -1
+        """
+        points = np.array(points, dtype=np.float64, ndmin=2).reshape(-1, 2)
+        cells = self._cells(points)
+        owners, items = self._candidates(cells[:, 1]*self.shape[0] + cells[:, 0])
+        error = np.abs(np.linalg.norm(points[owners] - self.centers[items], axis=-1) / self.radii[items] - 1)
+        best = np.full(len(points), np.inf)
+        np.minimum.at(best, owners, error)
+        indices = np.full(len(points), -1, dtype=np.intp)
+        winner = (error == best[owners]) & (error <= tol)
+        indices[owners[winner]] = items[winner]
+        return indices
+
+    def particles(self, points):
+        # 圆周上的点所在的圆 用于作用点处的计算
+        indices = self.locate(points)
+        return _Particles(self.centers[indices], self.radii[indices])
+
+
+class LatticeScene(object):
+    """
+    周期排列的相同的圆（圆柱阵列） 正方格子或六角格子
+    光线用 DDA 逐个格子前进，每个格子只与其中的圆（六角格子的圆超出格子时加上相邻两行的圆）求交，
+    每步的代价与阵列的大小无关
+    格点 (i, j) 的圆心为 origin + ((i + shift*(j%2))*spacing, j*row_height)
+    正方格子 shift=0 row_height=spacing 六角格子 shift=1/2 row_height=spacing*√3/2
+    @param:radius 圆的半径 不大于 spacing/2
+    @param:spacing 最近的两个圆心的距离
+    @param:lattice 'square' 或 'hexagonal'
+    @param:shape (nx, ny) 每行的圆数与行数 periodic 时为一个周期
+    @param:periodic 是否为无限大的周期阵列 光线走出一个周期后从对边进入下一个周期
+    @param:origin 格点 (0, 0) 的圆心
+    """
+    def __init__(self, radius, spacing, lattice='square', shape=(1, 1), periodic=False, origin=(0, 0)):
+        if lattice not in ('square', 'hexagonal'):
+            raise ValueError('Lattice should be square or hexagonal')
+        if not 0 < radius <= spacing / 2:
+            raise ValueError('Radius should be positive and not more than half of the spacing')
+        self.radius = float(radius)
+        self.spacing = float(spacing)
+        self.lattice = lattice
+        self.shape = tuple(int(n) for n in shape)
+        if min(self.shape) < 1:
+            raise ValueError('Shape should be positive')
+        if lattice == 'hexagonal' and periodic and self.shape[1] % 2:
+            raise ValueError('Period of the hexagonal lattice should have even rows')
+        self.periodic = periodic
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.shift = 0. if lattice == 'square' else 0.5
+        self.row_height = self.spacing if lattice == 'square' else self.spacing * np.sqrt(3) / 2
+        # 六角格子的圆超出格子的上下边界时 还要与相邻两行的圆求交
+        self._neighbors = lattice == 'hexagonal' and self.radius > self.row_height / 2
+
+    def __len__(self):
+        return self.shape[0] * self.shape[1]
+
+    def __repr__(self):
+        return "LatticeScene({0} {1}x{2}{3})".format(self.lattice, self.shape[0], self.shape[1],
+                                                     ', periodic' if self.periodic else '')
+
+    @property
+    def period(self):
+        # 一个周期的大小 (宽, 高)
+        return np.array([self.shape[0]*self.spacing, self.shape[1]*self.row_height])
+
+    def centers(self, cells):
+        """格点的圆心
+        @param:cells (..., 2) 格点序号 (i, j) 周期阵列中可以超出一个周期
+        """
+        cells = np.asarray(cells)
+        i, j = cells[..., 0], cells[..., 1]
+        return self.origin + np.stack(((i + self.shift*np.mod(j, 2))*self.spacing, j*self.row_height), axis=-1)
+
+    def _cell_of(self, points, rows=None):
+        # 点所在的格子 rows 给定时使用给定的行
+        local = (points - self.origin) / [self.spacing, self.row_height]
+        j = np.floor(local[:, 1] + 0.5).astype(np.intp) if rows is None else rows
+        i = np.floor(local[:, 0] - self.shift*np.mod(j, 2) + 0.5).astype(np.intp)
+        return i, j
+
+    def _candidates(self, i, j):
+        # 格子 (i, j) 中可能有交点的圆的格点序号 (R, K, 2)
+        cells = [np.stack((i, j), axis=-1)]
+        if self._neighbors:
+            odd = np.mod(j, 2)
+            for dj in (-1, 1):
+                cells.append(np.stack((i + odd - 1, j + dj), axis=-1))
+                cells.append(np.stack((i + odd, j + dj), axis=-1))
+        return np.stack(cells, axis=1)
+
+    def _valid(self, cells):
+        # 有限阵列中存在的格点
+        if self.periodic:
+            return np.ones(cells.shape[:-1], dtype=bool)
+        return (cells[..., 0] >= 0) & (cells[..., 0] < self.shape[0]) & (cells[..., 1] >= 0) & (cells[..., 1] < self.shape[1])
+
+    def _flat(self, cells):
+        # 格点在一个周期中的序号 j*nx + i
+        return np.mod(cells[..., 1], self.shape[1])*self.shape[0] + np.mod(cells[..., 0], self.shape[0])
+
+    def _bounds(self):
+        # 有限阵列的包围盒 六角格子的圆可以超出第一行与最后一行的格子
+        margin = max(self.row_height/2, self.radius)
+        lower = self.origin - [self.spacing/2, margin]
+        extra = self.shift if self.shape[1] > 1 else 0
+        upper = self.origin + [(self.shape[0] - 0.5 + extra)*self.spacing, (self.shape[1] - 1)*self.row_height + margin]
+        return lower, upper
+
+    def nearest_hit(self, positions, directions, tol=None, max_steps=10000):
+        """光线前方最近的交点 同 Scene.nearest_hit
+        @param:positions (N, 2) 光线起点
+        @param:directions (N, 2) 光线方向
+        @param:tol 起点附近不算交点的距离 None 时为半径的 1e-9 倍
+        @param:max_steps 每条光线最多经过的格子数 周期阵列中沿通道方向的光线不会相交
+        @return: 字典
+            points (N, 2) 交点 周期阵列中为展开的坐标 无交点的行为nan
+            indices (N,) 相交的圆在一个周期中的序号 j*nx + i 无交点为 -1
+            cells (N, 2) 相交的圆的格点序号 (i, j) 周期阵列中可以超出一个周期
+            distances (N,) 起点到交点的距离 无交点为 inf
+            hit (N,) 是否有交点
+        """
+        tol = 1e-9 * self.radius if tol is None else tol
+        positions = np.array(positions, dtype=np.float64, ndmin=2).reshape(-1, 2)
+        directions = np.array(np.broadcast_to(directions, positions.shape), dtype=np.float64)
+        directions = directions / np.linalg.norm(directions, axis=-1)[:, None]
+        size = len(positions)
+        distances = np.full(size, np.inf)
+        hit_cells = np.zeros((size, 2), dtype=np.intp)
+        found_any = np.zeros(size, dtype=bool)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverse = 1 / directions
+        parallel = directions == 0
+        if self.periodic:
+            t_enter = np.zeros(size)
+            t_far = np.full(size, np.inf)
+        else:
+            lower, upper = self._bounds()
+            with np.errstate(invalid='ignore'):
+                t0 = (lower - positions) * inverse
+                t1 = (upper - positions) * inverse
+            inside_slab = (positions >= lower) & (positions <= upper)
+            t_near = np.where(parallel, np.where(inside_slab, -np.inf, np.inf), np.minimum(t0, t1)).max(axis=-1)
+            t_far = np.where(parallel, np.where(inside_slab, np.inf, -np.inf), np.maximum(t0, t1)).min(axis=-1)
+            t_enter = np.maximum(t_near, 0)
+        active = t_enter <= t_far
+
+        # DDA 的初始状态 当前格子 到下一条竖直边界与下一行的距离
+        size_xy = np.array([self.spacing, self.row_height])
+        step = np.sign(directions).astype(np.intp)
+        with np.errstate(invalid='ignore'):
+            t_delta = np.where(parallel, np.inf, size_xy * np.abs(inverse))
+        start = positions + np.where(active, t_enter, 0)[:, None]*directions
+        i, j = self._cell_of(start)
+        t_row = np.where(parallel[:, 1], np.inf,
+                         (self.origin[1] + (j + 0.5*step[:, 1])*self.row_height - positions[:, 1]) * inverse[:, 1])
+        t_column = self._column_exit(positions, directions, inverse, i, j)
+
+        rows = np.flatnonzero(active)
+        for _ in range(max_steps):
+            if not len(rows):
+                break
+            cells = self._candidates(i[rows], j[rows])
+            centers = self.centers(cells)
+            offset = positions[rows, None, :] - centers
+            b = np.sum(offset*directions[rows, None, :], axis=-1)
+            disc = b*b - (np.sum(offset*offset, axis=-1) - self.radius**2)
+            root = np.sqrt(np.where(disc >= 0, disc, np.nan))
+            t = np.where(-b - root > tol, -b - root, np.where(-b + root > tol, -b + root, np.inf))
+            t[np.isnan(t) | ~self._valid(cells)] = np.inf
+            nearest = np.argmin(t, axis=-1)
+            t = t[np.arange(len(rows)), nearest]
+            # 交点在当前格子内才是最近的
+            found = t <= np.minimum(t_row[rows], t_column[rows]) + tol
+            distances[rows[found]] = t[found]
+            hit_cells[rows[found]] = cells[found, nearest[found]]
+            found_any[rows[found]] = True
+            rows = rows[~found]
+
+            # 没有交点的光线前进一个格子 换行时重新计算所在的格子
+            across = t_row[rows] < t_column[rows]
+            moved = rows[~across]
+            i[moved] += step[moved, 0]
+            t_column[moved] += t_delta[moved, 0]
+            changed = rows[across]
+            j[changed] += step[changed, 1]
+            point = positions[changed] + t_row[changed, None]*directions[changed]
+            i[changed] = self._cell_of(point, j[changed])[0]
+            t_column[changed] = self._column_exit(positions[changed], directions[changed], inverse[changed],
+                                                  i[changed], j[changed])
+            t_row[changed] += t_delta[changed, 1]
+            with np.errstate(invalid='ignore'):
+                entered = np.where(across, t_row[rows] - t_delta[rows, 1], t_column[rows] - t_delta[rows, 0])
+            rows = rows[entered <= t_far[rows]]
+
+        points = positions + np.where(found_any, distances, np.nan)[:, None]*directions
+        indices = np.where(found_any, self._flat(hit_cells), -1)
+        return dict(points=points, indices=indices, cells=hit_cells, distances=distances, hit=found_any)
+
+    def _column_exit(self, positions, directions, inverse, i, j):
+        # 在第 j 行中 到格子 i 的下一条竖直边界的距离
+        boundary = self.origin[0] + (i + self.shift*np.mod(j, 2) + 0.5*np.sign(directions[:, 0]))*self.spacing
+        with np.errstate(invalid='ignore'):
+            return np.where(directions[:, 0] == 0, np.inf, (boundary - positions[:, 0]) * inverse[:, 0])
+
+    def intersect(self, positions, directions):
+        """同 rayTree.forward_hits 的返回值 用于 rayTree.expand_tree
+        @return: tuple (points, hit)
+        """
+        result = self.nearest_hit(positions, directions)
+        return result['points'], result['hit']
+
+    def _nearest_cells(self, points):
+        # 离点最近的格点
+        points = np.array(points, dtype=np.float64, ndmin=2).reshape(-1, 2)
+        i, j = self._cell_of(points)
+        cells = self._candidates(i, j)
+        distance = np.linalg.norm(points[:, None, :] - self.centers(cells), axis=-1)
+        nearest = np.argmin(distance, axis=-1)
+        rows = np.arange(len(points))
+        return points, cells[rows, nearest], distance[rows, nearest]
+
+    def locate(self, points, tol=1e-6):
+        """圆周上的点所在的圆 同 Scene.locate
+        @return: (N,) 圆在一个周期中的序号 不在任何圆周上为 -1
+        """
+        points, cells, distance = self._nearest_cells(points)
+        on_circle = (np.abs(distance / self.radius - 1) <= tol) & self._valid(cells)
+        return np.where(on_circle, self._flat(cells), -1)
+
+    def particles(self, points):
+        # 圆周上的点所在的圆 用于作用点处的计算
+        points, cells, distance = self._nearest_cells(points)
+        return _Particles(self.centers(cells), np.full(len(points), self.radius))
+
+    def wrap(self, points):
+        """展开的坐标变换到第一个周期内
+        @return: tuple (points, images) images (N, 2) 经过的周期数 展开的坐标 = points + images*period
+        """
+        points = np.array(points, dtype=np.float64, ndmin=2).reshape(-1, 2)
+        lower = self.origin - [self.spacing/2, self.row_height/2]
+        images = np.floor((points - lower) / self.period).astype(np.intp)
+        return points - images*self.period, images
+
+
+def trace_tree(scene, bundle, refraction_index, outside_ref_index=1, max_depth=10, min_power=None):
+    """场景中的完整反射/折射光线树 见 rayTree.expand_tree 和 intersectionTracer.trace_tree
+    光线离开一个圆后继续与场景中其他的圆作用
+    @param:scene Scene 或 LatticeScene 的实例
+    @param:bundle RayBundle的实例 圆外的入射光束
+    @param:refraction_index 圆的折射率
+    @param:outside_ref_index 外界折射率
+    @param:max_depth 最多经过的作用次数
+    @param:min_power 功率低于该值的光线不再追迹
+    RETURN 字典 同 rayTree.expand_tree 另有
+        particles (M,) 每个节点的终点所在的圆 离开场景的光线为 -1
+    """
+    def interact(source, index_out):
+        return _interact(scene.particles(source.positions), source, index_out)
+
+    tree = expand_tree(bundle, scene.intersect, interact, refraction_index, outside_ref_index, max_depth, min_power)
+    particles = np.full(len(tree['ends']), -1, dtype=np.intp)
+    ended = ~np.isnan(tree['ends'][:, 0])
+    particles[ended] = scene.locate(tree['ends'][ended])
+    tree['particles'] = particles
+    return tree
@@ -0,0 +1,260 @@
+#/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from __future__ import division
+import numpy as np
+from intersectionElements import RayBundle, Light, UNITS
+from rayTree import forward_hits, expand_tree
+from pygameVector import Vec2d
+from intersectionFuncs import pick_start_points, batch_intersection, batch_ref_factors, batch_reflection, batch_refraction, \
+                              batch_fresnel, chord_rotations, rotate_about, point_source_fan
+
+__all__ = ['trace', 'iter_orders', 'compute', 'compute_point_source', 'trace_tree', 'trace_wavelengths']
+
+
+def _interact(circle, bundle, index_out):
+    """作用点处的反射与折射 对整个光束一次计算
+    @param:bundle RayBundle 位于作用点的入射光束
+    @param:index_out 折射光所在介质的折射率
+    @return: tuple (reflected, refracted, wavenums, fresnel) 单位方向数组，折射光的波数和 Fresnel 系数
+    """
+    factors = batch_ref_factors(circle, bundle.positions, bundle.k_vectors)
+    wavenums = bundle.wavenums * index_out / bundle.refraction_indices
+    return (batch_reflection(factors), batch_refraction(factors, wavenums), wavenums,
+            batch_fresnel(factors, wavenums, bundle.wavenums))
+
+
+def _split_powers(powers, fresnel):
+    # 入射光的 s，p 功率 (N, 2) 分为反射光与折射光的功率
+    reflected = powers * np.stack((fresnel['Rs'], fresnel['Rp']), axis=-1)
+    return reflected, powers - reflected
+
+
+def _chunks(bundle, chunk_size):
+    # 按行切分光束 chunk_size 为 None 时不切分
+    if not chunk_size:
+        yield 0, bundle
+        return
+    for offset in range(0, len(bundle), chunk_size):
+        yield offset, bundle[offset:offset+chunk_size]
+
+
+def iter_orders(circle, bundle, refraction_index, outside_ref_index=1, intersection_time=1, segments=False, chunk_size=None,
+                min_power=None):
+    """逐次作用输出的光束追迹 生成器
+    每次只保存当前光束的状态，不累积之前作用的结果，内存与作用次数无关
+    @param:circle Circle的实例
+    @param:bundle RayBundle的实例 圆外的入射光束
+    @param:refraction_index 圆柱内折射率 标量或与输入光束对应的 (M,) 数组
+    @param:outside_ref_index 外界折射率
+    @param:intersection_time 作用次数
+    @param:segments 是否输出本次作用之后在圆内的线段
+    @param:chunk_size 每次追迹的光线数 None 时整个光束一起追迹
+    @param:min_power 圆内光线的功率（s与p之和）低于该值后不再追迹 None 时追迹全部作用次数
+    YIELD 字典 每个分块的每次作用一个
+        order 作用次数 1...K
+        rows (N,) 本次作用的光线在输入光束中的序号 被舍弃的光线之后不再出现
+        points (N, 2) 本次作用的交点
+        reflection_directions (N, 2) 反射光方向
+        refraction_directions (N, 2) 折射光方向
+        directions (N, 2) 出射到圆外的光的方向 第一次为反射光 之后为折射光
+        powers (N, 2) 出射光的 s，p 功率 由 Fresnel 公式得到
+        weights (N,) 出射光的功率 s与p之和
+        segments tuple (start, end) 各 (N, 2) 本次作用之后在圆内的线段 仅 segments 为 True 时输出
+    """
+    if not isinstance(intersection_time, int) or intersection_time < 1:
+        raise ValueError('Intersection times should not be less than 1 and should be int')
+
+    for offset, chunk in _chunks(bundle, chunk_size):
+        first, _, hit = batch_intersection(circle, chunk.directions, chunk.positions)
+        chunk = chunk[hit]    # 若没有交点则舍弃
+        rows = offset + np.flatnonzero(hit)
+        chunk.positions = first[hit]
+
+        for order in range(1, intersection_time+1):
+            chunk.orders += 1
+            if order == 1:
+                # 第一次作用 圆外 -> 圆内
+                index_in = refraction_index if not np.ndim(refraction_index) else np.asarray(refraction_index)[rows]
+                reflected, refracted, wavenums, fresnel = _interact(circle, chunk, index_in)
+                exit_powers, chunk.powers = _split_powers(chunk.powers, fresnel)
+                exit_directions = reflected
+                chunk.directions = refracted
+                chunk.wavenums = wavenums
+                chunk.refraction_indices = np.array(np.broadcast_to(index_in, len(chunk)), dtype=np.float64)
+                # 圆内每条弦的圆心角相同 之后的交点由旋转得到 不再求解交点方程
+                cos, sin = chord_rotations(circle, chunk.positions, chunk.directions)
+            else:
+                # 之后的作用 圆内反射继续追迹 折射光出射
+                reflected, refracted, _, fresnel = _interact(circle, chunk, outside_ref_index)
+                chunk.powers, exit_powers = _split_powers(chunk.powers, fresnel)
+                exit_directions = refracted
+                chunk.directions = reflected
+
+            position = chunk.positions
+            following = rotate_about(circle, position, cos, sin)
+            result = dict(order=order,
+                          rows=rows,
+                          points=position,
+                          reflection_directions=reflected,
+                          refraction_directions=refracted,
+                          directions=exit_directions,
+                          powers=exit_powers,
+                          weights=exit_powers.sum(axis=-1))
+            if segments:
+                result['segments'] = (position, following)
+            yield result
+            chunk.positions = following
+
+            if min_power is not None:
+                # 舍弃功率过低的圆内光线
+                keep = chunk.powers.sum(axis=-1) >= min_power
+                if not keep.all():
+                    chunk, rows, cos, sin = chunk[keep], rows[keep], cos[keep], sin[keep]
+
+
+def _collect(bundle, orders):
+    # 将 iter_orders 的输出 (不分块) 合并为 trace 的结果 被舍弃的光线之后的结果为 nan
+    results = list(orders)
+    hit = np.zeros(len(bundle), dtype=bool)
+    hit[results[0]['rows']] = True
+    hit_rows = np.flatnonzero(hit)
+
+    def stack(key, extra=None):
+        values = [r[key] for r in results] + ([] if extra is None else [extra])
+        row_lists = [r['rows'] for r in results] + ([] if extra is None else [results[-1]['rows']])
+        if all(len(rows) == len(hit_rows) for rows in row_lists):
+            return np.stack(values)
+        stacked = np.full((len(values), len(hit_rows)) + values[0].shape[1:], np.nan)
+        for i, (value, rows) in enumerate(zip(values, row_lists)):
+            stacked[i, np.searchsorted(hit_rows, rows)] = value
+        return stacked
+
+    return dict(start_points=bundle.positions[hit],
+                hit=hit,
+                points=stack('points', results[-1]['segments'][1]),
+                reflection_directions=stack('reflection_directions'),
+                refraction_directions=stack('refraction_directions'),
+                directions=stack('directions'),
+                powers=stack('powers'),
+                weights=stack('weights'),
+                orders=np.array([r['order'] for r in results]))
+
+
+def trace(circle, bundle, refraction_index, outside_ref_index=1, intersection_time=1, min_power=None):
+    """光束追迹 drawer 的数组版本，每次作用对整个光束做一次广播运算
+    @param:circle Circle的实例
+    @param:bundle RayBundle的实例 圆外的入射光束
+    @param:refraction_index 圆柱内折射率
+    @param:outside_ref_index 外界折射率
+    @param:intersection_time 作用次数
+    @param:min_power 圆内光线的功率低于该值后不再追迹 见 iter_orders
+    RETURN 字典
+        start_points (N, 2) 与圆有交点的光线的起始点
+        hit (M,) 输入光线是否与圆相交
+        points (K+1, N, 2) 第1到第K+1个交点 第k次作用在圆内的线段为 points[k-1] -> points[k]
+        reflection_directions (K, N, 2) 每次作用的反射光方向
+        refraction_directions (K, N, 2) 每次作用的折射光方向
+        directions (K, N, 2) 每次作用出射到圆外的光的方向 第一次为反射光 之后为折射光
+        powers (K, N, 2) 每次作用出射光的 s，p 功率
+        weights (K, N) 每次作用出射光的功率
+        orders (K,) 作用次数 1...K
+        舍弃的光线在之后的作用次数中为 nan
+    """
+    return _collect(bundle, iter_orders(circle, bundle, refraction_index, outside_ref_index, intersection_time,
+                                        segments=True, min_power=min_power))
+
+
+def compute(circle, incident_light, refraction_index, density=1, outside_ref_index=1, intersection_time=1, distance=2, tol=1e-2, start_point=None,
+            min_power=None):
+    """只计算不画图的追迹 参数与 intersectionDrawer.drawer 相同
+    @param:min_power 圆内光线的功率低于该值后不再追迹 见 iter_orders
+    不导入matplotlib 不生成线段，可以在没有图形界面的环境中批量计算
+    线段由 intersectionDrawer.render 另外生成
+    RETURN 字典 同 trace
+    """
+    if start_point is None or not len(start_point):
+        start_points = pick_start_points(circle, incident_light.direction.normalized(), density, distance, tol)
+    else:
+        start_points = start_point if isinstance(start_point, list) else [start_point] # 转化为列表
+    bundle = RayBundle.from_light(incident_light, start_points)
+    return trace(circle, bundle, refraction_index, outside_ref_index, intersection_time, min_power)
+
+
+def compute_point_source(circle, incident_light, refraction_index, source_points, density=1, outside_ref_index=1,
+                         intersection_time=1, min_power=None):
+    """点光源（发散光）照射的追迹 每个点光源发出 density 条光线 方向只取与圆相交的锥内 见 point_source_fan
+    @param:incident_light Light的实例 只使用其波长与折射率 方向由点光源的位置决定
+    @param:source_points 点光源的位置 单个点或点的列表 必须在圆外
+    其余参数同 compute
+    RETURN 字典 同 trace 另有
+        sources (N,) 每条光线所属的点光源的序号
+    """
+    positions, directions = point_source_fan(circle, source_points, density)
+    bundle = RayBundle.from_light(incident_light, positions, directions)
+    traced = trace(circle, bundle, refraction_index, outside_ref_index, intersection_time, min_power)
+    traced['sources'] = np.flatnonzero(traced['hit']) // int(density)
+    return traced
+
+
+def trace_tree(circle, bundle, refraction_index, outside_ref_index=1, max_depth=10, min_power=None):
+    """完整的反射/折射光线树 每个作用点的反射光与折射光都继续追迹 见 rayTree.expand_tree
+    @param:circle Circle的实例
+    @param:bundle RayBundle的实例 圆外的入射光束
+    @param:max_depth 最多经过的作用次数
+    @param:min_power 功率低于该值的光线不再追迹
+    RETURN 字典 同 rayTree.expand_tree
+    """
+    tol = 1e-9 * circle.radius
+
+    def intersect(positions, directions):
+        first, second, hit = batch_intersection(circle, directions, positions)
+        return forward_hits(positions, directions, first, second, hit, tol)
+
+    def interact(bundle, index_out):
+        return _interact(circle, bundle, index_out)
+
+    return expand_tree(bundle, intersect, interact, refraction_index, outside_ref_index, max_depth, min_power)
+
+
+def trace_wavelengths(circle, incident_light, model, wavelengths, start_points, outside_ref_index=1, intersection_time=1,
+                      unit='nm', min_power=None):
+    """多波长的色散追迹 光线 × 波长 合并为一个光束一次追迹 不逐个波长循环
+    @param:circle Circle的实例
+    @param:incident_light Light的实例 使用其方向与折射率（外界） 不使用其波长
+    @param:model 色散模型 由波长得到圆的折射率 见 dispersion 也可以是每个波长的折射率 (L,)
+    @param:wavelengths (L,) 波长
+    @param:start_points 起始点的列表
+    @param:outside_ref_index 外界折射率
+    @param:intersection_time 作用次数
+    @param:unit 波长的单位 同 Light
+    @param:min_power 圆内光线的功率低于该值后不再追迹
+    RETURN 字典 同 trace，每个数组在光线一维之前多一维波长
+        wavelengths (L,) 波长 单位为 unit
+        refraction_indices (L,) 每个波长圆的折射率
+        start_points (N, d) hit (M,) 与波长无关
+        points (K+1, L, N, d) 其余为 (K, L, N, ...)
+    """
+    if unit not in UNITS.keys():
+        raise ValueError('Use correct unit in {0}'.format(list(UNITS.keys())))
+    wavelengths = np.atleast_1d(np.asarray(wavelengths, dtype=np.float64))
+    indices = model(wavelengths, unit) if callable(model) else np.broadcast_to(np.asarray(model, dtype=np.float64), wavelengths.shape)
+    rays = RayBundle.from_light(incident_light, start_points)
+    size, count = len(rays), len(wavelengths)
+
+    # 每个波长复制一份光束 第 l 个波长为第 l*size 到 (l+1)*size 行
+    wavenums = Light.wavenum(wavelengths * UNITS[unit], incident_light.refraction_index)
+    bundle = RayBundle(np.tile(rays.positions, (count, 1)), np.tile(rays.directions, (count, 1)),
+                       np.repeat(wavenums, size), incident_light.refraction_index)
+    traced = trace(circle, bundle, np.repeat(indices, size), outside_ref_index, intersection_time, min_power)
+
+    # 是否有交点与波长无关
+    result = dict(wavelengths=wavelengths,
+                  refraction_indices=np.asarray(indices, dtype=np.float64),
+                  start_points=traced['start_points'][:len(traced['start_points'])//count],
+                  hit=traced['hit'][:size],
+                  orders=traced['orders'])
+    for key in ('points', 'reflection_directions', 'refraction_directions', 'directions', 'powers', 'weights'):
+        values = traced[key]
+        result[key] = values.reshape((values.shape[0], count, -1) + values.shape[2:])
+    return result
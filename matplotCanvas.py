@@ -43,6 +43,7 @@ class MplPlot3dCanvas(FigureCanvas):
         self.fig = Figure(figsize=(width, height), dpi=dpi)
         self.axes = self.fig.add_subplot(111, projection='3d')  # 3d图像
         self.axes.view_init()
+        self.detail = None  # drawer3d.LevelOfDetail 的实例 拖动时只画部分光线
 
         FigureCanvas.__init__(self, self.fig)
         self.setParent(parent)
@@ -51,3 +52,23 @@ class MplPlot3dCanvas(FigureCanvas):
                                    QSizePolicy.Expanding,
                                    QSizePolicy.Expanding)
         FigureCanvas.updateGeometry(self)
+        self.mpl_connect('button_press_event', self._on_press)
+        self.mpl_connect('button_release_event', self._on_release)
+
+    def set_level_of_detail(self, detail):
+        """设置拖动时切换的线段 None 时不切换
+        detail: drawer3d.LevelOfDetail 的实例 其 collections 需要已添加到 axes
+        """
+        if self.detail is not None:
+            self.detail.set_coarse(False)
+        self.detail = detail
+
+    def _on_press(self, event):
+        # 在图中按下鼠标开始拖动 只画部分光线
+        if self.detail is not None and event.inaxes is self.axes and self.detail.set_coarse(True):
+            self.draw_idle()
+
+    def _on_release(self, event):
+        # 松开鼠标 恢复全部光线
+        if self.detail is not None and self.detail.set_coarse(False):
+            self.draw_idle()
@@ -0,0 +1,218 @@
+#/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""粒子云中多次散射的 Monte Carlo 模拟
+光子从 x=0 沿 +x 射入厚度为 thickness 的平板状粒子云（横向无限大），两次散射之间的自由程按指数分布抽样，
+每次散射在一个粒子（圆或球）上用 intersectionTracer/tracer3d 的反射与折射计算，
+每个界面按 Fresnel 反射率随机选择反射或折射，直到光子离开粒子，
+光子离开平板时按散射次数累加出射角（与 +x 的夹角）的分布
+"""
+
+from __future__ import division
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from intersectionElements import Circle, Sphere, RayBundle
+from angleHistogram import AngleHistogram
+import intersectionTracer
+import tracer3d
+
+__all__ = ['Cloud', 'run_batch', 'simulate']
+
+
+class Cloud(object):
+    """
+    平板状的随机粒子云 粒子互不重叠且位置独立（独立散射）
+    @param:refraction_index 粒子的折射率
+    @param:radius 粒子半径
+    @param:number_density 单位面积（二维）或单位体积（三维）的粒子数 长度单位同半径
+    @param:thickness 平板的厚度
+    @param:dimension 2 为圆柱（圆），3 为球
+    @param:outside_ref_index 外界折射率
+    """
+    def __init__(self, refraction_index, radius, number_density, thickness, dimension=2, outside_ref_index=1):
+        if dimension not in (2, 3):
+            raise ValueError('Dimension should be 2 or 3')
+        if radius <= 0 or number_density <= 0 or thickness <= 0:
+            raise ValueError('Radius, number density and thickness should be positive')
+        self.refraction_index = refraction_index
+        self.radius = radius
+        self.number_density = number_density
+        self.thickness = thickness
+        self.dimension = dimension
+        self.outside_ref_index = outside_ref_index
+
+    def __repr__(self):
+        return "Cloud({0}d, m={1}, optical depth={2:.4g})".format(self.dimension, self.refraction_index,
+                                                                  self.optical_depth)
+
+    @property
+    def cross_section(self):
+        # 几何截面 圆为直径 球为投影面积
+        return 2*self.radius if self.dimension == 2 else np.pi*self.radius**2
+
+    @property
+    def mean_free_path(self):
+        return 1 / (self.number_density * self.cross_section)
+
+    @property
+    def optical_depth(self):
+        return self.thickness / self.mean_free_path
+
+
+def _entry_points(directions, rng):
+    """单位圆（球）上的入射点 碰撞参数在粒子的截面上均匀分布
+    @return: (N, d) 入射点 圆心在原点
+    """
+    size, dim = directions.shape
+    if dim == 2:
+        b = rng.uniform(-1, 1, size)
+        across = np.stack((-directions[:, 1], directions[:, 0]), axis=-1)
+    else:
+        b = np.sqrt(rng.random(size))   # 圆盘上均匀分布
+        phi = rng.uniform(0, 2*np.pi, size)
+        # 与方向垂直的两个单位矢量
+        helper = np.where(np.abs(directions[:, :1]) < 0.9, [[1., 0, 0]], [[0, 1., 0]])
+        e1 = np.cross(directions, helper)
+        e1 /= np.linalg.norm(e1, axis=-1)[:, None]
+        e2 = np.cross(directions, e1)
+        across = np.cos(phi)[:, None]*e1 + np.sin(phi)[:, None]*e2
+    return -np.sqrt(1 - b*b)[:, None]*directions + b[:, None]*across
+
+
+def _scatter(cloud, directions, polarizations, rng, max_bounces):
+    """光子在一个粒子上的散射 在粒子的局部坐标（单位圆或球，圆心在原点）中计算
+    每个界面按 Fresnel 反射率选择反射或折射 折射光离开粒子时结束
+    @param:directions (N, d) 入射方向
+    @param:polarizations (N,) True 为 s 偏振 False 为 p 偏振
+    @return: tuple (offsets, directions, done)
+        offsets (N, d) 出射点相对于入射点的位移 单位为半径
+        directions (N, d) 出射方向
+        done (N,) 是否在 max_bounces 次作用内离开粒子
+    """
+    dim = directions.shape[1]
+    particle, interact = (Circle(1), intersectionTracer._interact) if dim == 2 else (Sphere(1), tracer3d._interact)
+    m, outside = cloud.refraction_index, cloud.outside_ref_index
+    entries = _entry_points(directions, rng)
+    positions = entries.copy()
+    directions = directions.copy()
+    inside = np.zeros(len(directions), dtype=bool)
+    done = np.zeros(len(directions), dtype=bool)
+
+    rows = np.arange(len(directions))
+    for bounce in range(max_bounces):
+        index_in = np.where(inside[rows], m, outside)
+        index_out = np.where(inside[rows], outside, m)
+        bundle = RayBundle(positions[rows], directions[rows], index_in, index_in)
+        reflected, refracted, wavenums, fresnel = interact(particle, bundle, index_out)
+        reflectance = np.where(polarizations[rows], fresnel['Rs'], fresnel['Rp'])
+        reflect = rng.random(len(rows)) < reflectance
+        directions[rows] = np.where(reflect[:, None], reflected, refracted)
+        inside[rows] ^= ~reflect     # 折射改变光子在粒子内外
+        leaving = ~inside[rows]
+        done[rows[leaving]] = True
+        rows = rows[~leaving]
+        if not len(rows):
+            break
+        # 粒子内的光子沿弦到达下一个作用点 p - 2(p.d)d
+        chord = -2*np.sum(positions[rows]*directions[rows], axis=-1)
+        positions[rows] += chord[:, None]*directions[rows]
+    return positions - entries, directions, done
+
+
+def run_batch(cloud, photons, seed=None, bins=180, max_events=1000, max_bounces=100):
+    """一批光子的模拟 在一个进程中执行
+    @param:cloud Cloud的实例
+    @param:photons 光子数
+    @param:seed 随机数种子 整数或 np.random.SeedSequence
+    @param:bins 出射角分布的分格数 范围为 0 到 180 度
+    @param:max_events 每个光子最多的散射次数 超过的计入 lost
+    @param:max_bounces 每次散射在粒子内最多的作用次数 超过的计入 lost
+    RETURN 字典
+        transmitted AngleHistogram 从 x=thickness 一侧离开的光子 第 k 行为散射 k 次的光子
+        reflected AngleHistogram 从 x=0 一侧离开的光子
+        ballistic 没有散射直接透过的光子数
+        lost 超过 max_events 或 max_bounces 的光子数
+        photons 光子数
+    """
+    rng = np.random.default_rng(seed)
+    dim = cloud.dimension
+    axis = (1, 0) if dim == 2 else (1, 0, 0)
+    transmitted = AngleHistogram(bins, (0, 180), angle='scattering', axis=axis)
+    reflected = AngleHistogram(bins, (0, 180), angle='scattering', axis=axis)
+
+    positions = np.zeros((photons, dim))
+    directions = np.zeros((photons, dim))
+    directions[:, 0] = 1
+    events = np.zeros(photons, dtype=np.intp)
+    polarizations = rng.random(photons) < 0.5   # 非偏振光 s，p 各一半
+    rows = np.arange(photons)
+    ballistic = lost = 0
+
+    while len(rows):
+        # 自由程
+        positions[rows] += rng.exponential(cloud.mean_free_path, len(rows))[:, None]*directions[rows]
+        x = positions[rows, 0]
+        for histogram, leaving in ((transmitted, x > cloud.thickness), (reflected, x < 0)):
+            scattered = rows[leaving & (events[rows] > 0)]
+            for order in np.unique(events[scattered]):
+                same = scattered[events[scattered] == order]
+                histogram.add_directions(int(order), directions[same])
+        ballistic += np.count_nonzero((x > cloud.thickness) & (events[rows] == 0))
+        rows = rows[(x >= 0) & (x <= cloud.thickness)]
+        over = events[rows] >= max_events
+        lost += np.count_nonzero(over)
+        rows = rows[~over]
+        if not len(rows):
+            break
+
+        # 在粒子上散射 三维时每个粒子的入射面不同 s，p 重新抽样
+        if dim == 3:
+            polarizations[rows] = rng.random(len(rows)) < 0.5
+        offsets, directions[rows], done = _scatter(cloud, directions[rows], polarizations[rows], rng, max_bounces)
+        positions[rows] += offsets*cloud.radius
+        events[rows] += 1
+        lost += np.count_nonzero(~done)
+        rows = rows[done]
+
+    return dict(transmitted=transmitted, reflected=reflected, ballistic=ballistic, lost=lost, photons=photons)
+
+
+def _run_chunk(args):
+    return run_batch(*args)
+
+
+def simulate(cloud, photons, seed=None, workers=None, batch_size=100000, bins=180, max_events=1000, max_bounces=100):
+    """多进程的 Monte Carlo 模拟 光子分为每批 batch_size 个
+    每批用 np.random.SeedSequence(seed).spawn 得到独立的随机数流 结果与进程数无关，相同 seed 的结果相同
+    @param:workers 进程数 None 时为CPU核数 1 时在当前进程中计算
+    其余参数同 run_batch
+    RETURN 字典 同 run_batch 各批的结果合并
+    """
+    photons = int(photons)
+    if photons < 1:
+        raise ValueError('Photons should not be less than 1')
+    sizes = [batch_size]*(photons // batch_size) + ([photons % batch_size] if photons % batch_size else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(cloud, size, s, bins, max_events, max_bounces) for size, s in zip(sizes, seeds)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        results = map(_run_chunk, tasks)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(_run_chunk, tasks)
+
+    total = None
+    try:
+        for result in results:
+            if total is None:
+                total = result
+                continue
+            total['transmitted'].merge(result['transmitted'])
+            total['reflected'].merge(result['reflected'])
+            for key in ('ballistic', 'lost', 'photons'):
+                total[key] += result[key]
+    finally:
+        if workers != 1:
+            executor.shutdown()
+    return total
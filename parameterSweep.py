@@ -0,0 +1,164 @@
+#/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""参数扫描 对半径，折射率，波长，光线条数与作用次数的组合批量追迹
+每个组合在一个进程中调用 intersectionTracer.compute（二维）或 tracer3d.compute（三维）
+参数的单位与界面相同：半径 um，波长 nm
+
+命令行：
+    python parameterSweep.py --radius 10 20 --m 1.333 1.5 --wavelength 532 --light-num 100 --times 3 -o sweep.npz
+"""
+
+from __future__ import division
+import os
+import sys
+import argparse
+import itertools
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from pygameVector import Vec2d, Vec3d
+from intersectionElements import Circle, Sphere, Light
+from funcs3d import generate_multi_start_points
+import intersectionTracer
+import tracer3d
+
+__all__ = ['FIELDS', 'expand_grid', 'run_case', 'sweep', 'save_results', 'main']
+
+# 与界面的输入框对应的参数 参数组合按此顺序构成元组
+FIELDS = ('radius', 'refraction_index', 'wavelength', 'light_num', 'times')
+
+
+def expand_grid(radius, refraction_index, wavelength, light_num, times):
+    """展开参数网格 每个参数可以是单个值或列表
+    @return: list 参数组合的元组 顺序同 FIELDS
+    """
+    values = [v if isinstance(v, (list, tuple, np.ndarray)) else [v]
+              for v in (radius, refraction_index, wavelength, light_num, times)]
+    return list(itertools.product(*values))
+
+
+def run_case(case, dimension=2, reduce=None):
+    """追迹一个参数组合 在子进程中执行
+    @param:case 参数组合的元组 顺序同 FIELDS
+    @param:dimension 2 为圆（平面光），3 为球（片状光 y=-2r，z=0）
+    @param:reduce 对追迹结果的处理函数 必须可以 pickle（模块级函数） None 时返回追迹结果
+    @return: compute 返回的字典 或 reduce 的返回值
+    """
+    radius, refraction_index, wavelength, light_num, times = case
+    radius = float(radius) / 1000    # um -> mm 同界面
+    if dimension == 2:
+        circle = Circle(radius)
+        light = Light(float(wavelength), Vec2d(1, 0), 1, unit='nm')
+        traced = intersectionTracer.compute(circle, light, float(refraction_index), int(light_num),
+                                            intersection_time=int(times))
+    elif dimension == 3:
+        sphere = Sphere(radius)
+        light = Light(float(wavelength), Vec3d(0, 1, 0), 1, unit='nm')
+        start_point_list = generate_multi_start_points(radius, int(light_num), set_y=-2*radius, set_z=0)
+        traced = tracer3d.compute(sphere, light, float(refraction_index), start_point_list, int(times), symmetry=True)
+    else:
+        raise ValueError('Dimension should be 2 or 3')
+    return traced if reduce is None else reduce(traced)
+
+
+def _format_error(e):
+    return ''.join(traceback.format_exception_only(type(e), e)).strip()
+
+
+def _run_isolated(cases, dimension, reduce, results, failures, progress):
+    # 进程池损坏后 剩余的组合每个用单独的进程重试 使导致崩溃的组合不影响其他组合
+    for case in cases:
+        try:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                results[case] = executor.submit(run_case, case, dimension, reduce).result()
+        except BrokenProcessPool:
+            failures[case] = 'worker process terminated abruptly'
+        except Exception as e:
+            failures[case] = _format_error(e)
+        if progress is not None:
+            progress(len(results) + len(failures), case)
+
+
+def sweep(cases, dimension=2, workers=None, reduce=None, progress=None):
+    """多进程参数扫描
+    @param:cases expand_grid 返回的参数组合列表
+    @param:dimension 2 或 3 见 run_case
+    @param:workers 进程数 None 时为CPU核数
+    @param:reduce 见 run_case
+    @param:progress 进度回调 progress(finished, case) 每完成一个组合调用一次
+    @return: tuple (results, failures)
+        results 字典 参数组合 -> 结果
+        failures 字典 参数组合 -> 异常信息 子进程异常或进程池损坏（如内存不足被杀死）的组合
+    """
+    if dimension not in (2, 3):
+        raise ValueError('Dimension should be 2 or 3')
+    results = {}
+    failures = {}
+    pending = []
+    workers = workers or os.cpu_count() or 1
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_case, case, dimension, reduce): case for case in cases}
+            for future in as_completed(futures):
+                case = futures[future]
+                try:
+                    results[case] = future.result()
+                except BrokenProcessPool:
+                    pending.append(case)
+                    continue
+                except Exception as e:
+                    failures[case] = _format_error(e)
+                if progress is not None:
+                    progress(len(results) + len(failures), case)
+    except BrokenProcessPool:
+        pending = [case for case in cases if case not in results and case not in failures]
+    if pending:
+        # 进程池损坏 剩余的组合逐个重试 仍失败的记录下来
+        _run_isolated(pending, dimension, reduce, results, failures, progress)
+    return results, failures
+
+
+def save_results(filename, results):
+    """保存扫描结果为 npz 每个组合的每个数组一项 键为 '半径_折射率_波长_光线条数_作用次数/数组名'
+    """
+    arrays = {}
+    for case, traced in results.items():
+        prefix = '_'.join(str(v) for v in case)
+        for key, value in traced.items():
+            arrays['%s/%s' % (prefix, key)] = np.asarray(value)
+    np.savez_compressed(filename, **arrays)
+
+
+def _print_progress(total):
+    def progress(finished, case):
+        sys.stderr.write('\r[%d/%d] %s' % (finished, total, dict(zip(FIELDS, case))))
+        if finished == total:
+            sys.stderr.write('\n')
+        sys.stderr.flush()
+    return progress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Parameter sweep of the geometric optics tracing')
+    parser.add_argument('--radius', type=float, nargs='+', required=True, help='radius (um)')
+    parser.add_argument('--m', type=float, nargs='+', required=True, help='refraction index')
+    parser.add_argument('--wavelength', type=float, nargs='+', default=[532], help='wave length (nm)')
+    parser.add_argument('--light-num', type=int, nargs='+', default=[100], help='number of light')
+    parser.add_argument('--times', type=int, nargs='+', default=[1], help='intersection times')
+    parser.add_argument('--dim', type=int, choices=(2, 3), default=2, help='2d circle or 3d sphere')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes, default all cores')
+    parser.add_argument('-o', '--output', default='sweep.npz', help='output npz file')
+    args = parser.parse_args(argv)
+
+    cases = expand_grid(args.radius, args.m, args.wavelength, args.light_num, args.times)
+    results, failures = sweep(cases, args.dim, args.workers, progress=_print_progress(len(cases)))
+    save_results(args.output, results)
+    for case, error in failures.items():
+        sys.stderr.write('failed %s: %s\n' % (dict(zip(FIELDS, case)), error))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
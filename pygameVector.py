@@ -3,6 +3,7 @@
 ################## http://www.pygame.org/wiki/2DVectorClass ##################
 import operator
 import math
+import numpy as np
 
 class Vec2d(object):
     """2d vector class, supports vector and scalar operators,
@@ -730,3 +731,269 @@ class Vec3d(object):
     def __setstate__(self, dict):
         self.x, self.y, self.z = dict
 
+
+########################## array-backed companions ###########################
+class _VecArray(object):
+    """N vectors stored as one (N, d) float64 ndarray, supports the same
+       vector and scalar operators as Vec2d/Vec3d, each applied to all rows.
+       The array is shared, not copied: vec_array.data is the ndarray,
+       np.asarray(vec_array) returns it, and x/y/z are column views.
+       Operands may be another array of vectors, a single Vec2d/Vec3d or
+       pair/triple, a scalar, or (N,) per-vector scalars.
+       """
+    __slots__ = ['data']
+    _dim = None
+    _vector = None
+
+    def __init__(self, data, y=None, z=None):
+        if y is not None:
+            data = np.stack(np.broadcast_arrays(*((data, y) if z is None else (data, y, z))), axis=-1)
+        if isinstance(data, _VecArray):
+            data = data.data
+        self.data = np.asarray(data, dtype=np.float64).reshape(-1, self._dim)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self._vector(self.data[key].tolist())
+        return self.__class__(self.data[key])
+
+    def __setitem__(self, key, value):
+        self.data[key] = self._operand(value)
+
+    def __iter__(self):
+        for row in self.data.tolist():
+            yield self._vector(row)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.data.tolist() if len(self) <= 6 else '%d vectors' % len(self))
+
+    def __array__(self, dtype=None, copy=None):
+        return self.data if dtype is None else self.data.astype(dtype, copy=False)
+
+    def __getstate__(self):
+        return self.data
+
+    def __setstate__(self, data):
+        self.data = data
+
+    def _operand(self, other):
+        if isinstance(other, _VecArray):
+            return other.data
+        other = np.asarray(list(other) if isinstance(other, (Vec2d, Vec3d)) else other, dtype=np.float64)
+        if other.ndim == 1 and other.shape[0] != self._dim:
+            return other[:, None]   # per-vector scalars
+        return other
+
+    def _o2(self, other, f):
+        return self.__class__(f(self.data, self._operand(other)))
+
+    def _r_o2(self, other, f):
+        return self.__class__(f(self._operand(other), self.data))
+
+    def _io(self, other, f):
+        self.data[...] = f(self.data, self._operand(other))
+        return self
+
+    def __add__(self, other):
+        return self._o2(other, operator.add)
+    __radd__ = __add__
+
+    def __iadd__(self, other):
+        return self._io(other, operator.add)
+
+    def __sub__(self, other):
+        return self._o2(other, operator.sub)
+
+    def __rsub__(self, other):
+        return self._r_o2(other, operator.sub)
+
+    def __isub__(self, other):
+        return self._io(other, operator.sub)
+
+    def __mul__(self, other):
+        return self._o2(other, operator.mul)
+    __rmul__ = __mul__
+
+    def __imul__(self, other):
+        return self._io(other, operator.mul)
+
+    def __truediv__(self, other):
+        return self._o2(other, operator.truediv)
+
+    def __rtruediv__(self, other):
+        return self._r_o2(other, operator.truediv)
+
+    def __itruediv__(self, other):
+        return self._io(other, operator.truediv)
+    __div__, __rdiv__, __idiv__ = __truediv__, __rtruediv__, __itruediv__
+
+    def __neg__(self):
+        return self.__class__(-self.data)
+
+    def __pos__(self):
+        return self.__class__(self.data.copy())
+
+    def __abs__(self):
+        return self.__class__(np.abs(self.data))
+
+    # vectory functions
+    def get_length_sqrd(self):
+        return np.einsum('ij,ij->i', self.data, self.data)
+
+    def get_length(self):
+        return np.sqrt(self.get_length_sqrd())
+    length = property(get_length, None, None, "gets the magnitudes of the vectors")
+
+    def normalized(self):
+        # zero vectors are left unchanged, as in Vec2d/Vec3d
+        length = self.get_length()
+        return self.__class__(self.data / np.where(length == 0, 1, length)[:, None])
+
+    def normalize_return_length(self):
+        length = self.get_length()
+        self.data /= np.where(length == 0, 1, length)[:, None]
+        return length
+
+    def dot(self, other):
+        return np.sum(self.data*self._operand(other), axis=-1)
+
+    def get_distance(self, other):
+        return np.sqrt(self.get_dist_sqrd(other))
+
+    def get_dist_sqrd(self, other):
+        diff = self.data - self._operand(other)
+        return np.sum(diff*diff, axis=-1)
+
+    def projection(self, other):
+        other = np.broadcast_to(self._operand(other), self.data.shape)
+        return self.__class__(other * (self.dot(other) / np.sum(other*other, axis=-1))[:, None])
+
+    def interpolate_to(self, other, range):
+        return self.__class__(self.data + (self._operand(other) - self.data)*self._factor(range))
+
+    def _factor(self, value):
+        # scalar or (N,) -> broadcastable against (N, d)
+        value = np.asarray(value, dtype=np.float64)
+        return value[:, None] if value.ndim == 1 else value
+
+    @staticmethod
+    def _rotate(a, b, angle_degrees):
+        radians = np.radians(angle_degrees)
+        cos = np.cos(radians)
+        sin = np.sin(radians)
+        return a*cos - b*sin, a*sin + b*cos
+
+    @staticmethod
+    def _angle(y, x, zero):
+        return np.where(zero, 0., np.degrees(np.arctan2(y, x)))
+
+
+class Vec2dArray(_VecArray):
+    """N 2d vectors backed by an (N, 2) ndarray, mirrors the Vec2d API:
+       scalar results (dot, cross, angle, length ...) are (N,) arrays,
+       vector results are Vec2dArray, indexing with an int returns a Vec2d.
+       """
+    __slots__ = []
+    _dim = 2
+    _vector = Vec2d
+
+    def _get_x(self):
+        return self.data[:, 0]
+    def _set_x(self, value):
+        self.data[:, 0] = value
+    x = property(_get_x, _set_x, None, "view of the x column")
+
+    def _get_y(self):
+        return self.data[:, 1]
+    def _set_y(self, value):
+        self.data[:, 1] = value
+    y = property(_get_y, _set_y, None, "view of the y column")
+
+    def rotated(self, angle_degrees):
+        # angle_degrees: scalar or (N,)
+        return Vec2dArray(*self._rotate(self.x, self.y, angle_degrees))
+
+    def rotate(self, angle_degrees):
+        self.data[...] = self.rotated(angle_degrees).data
+
+    def get_angle(self):
+        return self._angle(self.y, self.x, self.get_length_sqrd() == 0)
+    angle = property(get_angle, None, None, "gets the angles of the vectors")
+
+    def get_angle_between(self, other):
+        other = self._operand(other)
+        return np.degrees(np.arctan2(self.cross(other), self.dot(other)))
+
+    def perpendicular(self):
+        return Vec2dArray(-self.y, self.x)
+
+    def perpendicular_normal(self):
+        return self.perpendicular().normalized()
+
+    def cross(self, other):
+        other = np.broadcast_to(self._operand(other), self.data.shape)
+        return self.x*other[:, 1] - self.y*other[:, 0]
+
+
+class Vec3dArray(_VecArray):
+    """N 3d vectors backed by an (N, 3) ndarray, mirrors the Vec3d API:
+       scalar results (dot, angles, length ...) are (N,) arrays,
+       vector results (cross, rotations ...) are Vec3dArray,
+       indexing with an int returns a Vec3d.
+       """
+    __slots__ = []
+    _dim = 3
+    _vector = Vec3d
+
+    def _get_x(self):
+        return self.data[:, 0]
+    def _set_x(self, value):
+        self.data[:, 0] = value
+    x = property(_get_x, _set_x, None, "view of the x column")
+
+    def _get_y(self):
+        return self.data[:, 1]
+    def _set_y(self, value):
+        self.data[:, 1] = value
+    y = property(_get_y, _set_y, None, "view of the y column")
+
+    def _get_z(self):
+        return self.data[:, 2]
+    def _set_z(self, value):
+        self.data[:, 2] = value
+    z = property(_get_z, _set_z, None, "view of the z column")
+
+    def rotated_around_z(self, angle_degrees):
+        x, y = self._rotate(self.x, self.y, angle_degrees)
+        return Vec3dArray(x, y, self.z)
+
+    def rotated_around_x(self, angle_degrees):
+        y, z = self._rotate(self.y, self.z, angle_degrees)
+        return Vec3dArray(self.x, y, z)
+
+    def rotated_around_y(self, angle_degrees):
+        z, x = self._rotate(self.z, self.x, angle_degrees)
+        return Vec3dArray(x, self.y, z)
+
+    def get_angle_around_z(self):
+        return self._angle(self.y, self.x, self.get_length_sqrd() == 0)
+    angle_around_z = property(get_angle_around_z, None, None, "gets the angles of the vectors in the XY plane")
+
+    def get_angle_around_x(self):
+        return self._angle(self.z, self.y, self.get_length_sqrd() == 0)
+    angle_around_x = property(get_angle_around_x, None, None, "gets the angles of the vectors in the YZ plane")
+
+    def get_angle_around_y(self):
+        return self._angle(self.x, self.z, self.get_length_sqrd() == 0)
+    angle_around_y = property(get_angle_around_y, None, None, "gets the angles of the vectors in the ZX plane")
+
+    def get_angle_between(self, other):
+        other = Vec3dArray(np.broadcast_to(self._operand(other), self.data.shape))
+        cos = self.normalized().dot(other.normalized())
+        return np.degrees(np.arccos(np.clip(cos, -1, 1)))
+
+    def cross(self, other):
+        return Vec3dArray(np.cross(self.data, self._operand(other)))
@@ -6,6 +6,7 @@ import sys
 import csv
 from collections import namedtuple
 import webbrowser
+import numpy as np
 import matplotlib
 matplotlib.use('Qt5Agg')
 import matplotlib.pyplot as plt
@@ -15,7 +16,11 @@ from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as Navigatio
 from matplotCanvas import ScatterCanvas
 from intersectionElements import Light, Circle
 from intersectionDrawer import drawer
-from intersectionFuncs import tangential_vector_to_circle
+from intersectionTracer import compute_point_source
+from angleHistogram import AngleHistogram
+from traceCache import TraceCache
+from traceResult import TraceResult
+from intersectionFuncs import tangential_vector_to_circle, pick_start_points, impact_parameters, deviation_angles
 from pygameVector import Vec2d
 
 
@@ -40,6 +45,8 @@ class ApplicationWindow(QtWidgets.QMainWindow):
 
         self.if_3d = False
         self.angle_y = None # 方位角初始为None
+        self.histogram = None   # 方位角分布初始为None
+        self.trace_cache = TraceCache()     # 只改变半径时不再追迹
 
         self.addMenu()
 
@@ -222,6 +229,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self.comboBox = QtWidgets.QComboBox()   # 下拉选择框
         self.comboBox.addItem("Single Points")
         self.comboBox.addItem("Continuous")
+        self.comboBox.addItem("Point Source")
         self.comboBox.currentIndexChanged.connect(self.selectionChange) # 当选择改变时
         self.canvas_layout.addWidget(self.comboBox)
 
@@ -292,6 +300,13 @@ class ApplicationWindow(QtWidgets.QMainWindow):
             self.data_layout.setEnabled(False)
             self.box_lightNum.setEnabled(True)
             self.box_lightNum.setMinimum(2)
+        elif "Point Source" == self.comboBox.currentText():
+            # 表中的起始点作为点光源 每个点光源发出的光线条数由 Light Nums 设置
+            self.data_frame.setHidden(False)
+            self.output_frame.setHidden(True)
+            self.data_layout.setEnabled(True)
+            self.box_lightNum.setEnabled(True)
+            self.box_lightNum.setMinimum(1)
         else:
             self.data_frame.setHidden(False)
             self.output_frame.setHidden(True)
@@ -307,6 +322,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
                                  QtCore.Qt.CTRL + QtCore.Qt.Key_N)  # Ctrl+N 新建
         self.file_menu.addAction('Save Data', self.fileSave,
                                  QtCore.Qt.CTRL + QtCore.Qt.SHIFT + QtCore.Qt.Key_S)    # Ctrl+Shift+S 保存输出数据
+        self.file_menu.addAction('Save Histogram', self.histogramSave)  # 保存方位角分布
         self.file_menu.addAction('&Save Image', self.imageSave,
                                  QtCore.Qt.CTRL + QtCore.Qt.Key_S)  # Ctrl+S 保存追迹图像
         self.file_menu.addAction('&Quit', self.fileQuit, 
@@ -352,6 +368,20 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         except FileNotFoundError:
             self.statusBar().showMessage('data not save.')
 
+    def histogramSave(self):
+        """save the azimuth histogram
+        保存各次作用的方位角分布 CSV格式 每个分格一行
+        """
+        if self.histogram is None:
+            self.statusBar().showMessage('No data simulated.')
+            return
+        files_types = "CSV data files (*.csv)"
+        filename, fil = QtWidgets.QFileDialog.getSaveFileName(self, 'Save file', os.path.expanduser('~'), files_types)
+        try:
+            self.histogram.write_csv(filename)
+        except FileNotFoundError:
+            self.statusBar().showMessage('data not save.')
+
     def fileQuit(self):
         # quit app
         self.close()
@@ -385,25 +415,36 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         x = []
         y = []
         if_continuous = True if 'Continuous' == self.comboBox.currentText() else False  # 入射光线的方式
-        if not if_continuous:
+        if 'Point Source' == self.comboBox.currentText():
+            # 表中的起始点作为点光源 忽略方向 光线只取与圆相交的锥内
+            sources = list(dict.fromkeys(self.data['start_point']))    # 去掉重复的起始点
+            if not sources:
+                self.statusBar().showMessage('！ No data')
+                return
+            light = Light(waveLength, Vec2d(1, 0), 1, unit='nm')
+            try:
+                traced = compute_point_source(circle, light, refraction_index, sources, lightNum, intersection_time=times)
+            except ValueError as e:
+                self.statusBar().showMessage('！ %s' % e)
+                return
+            result = TraceResult.from_trace(traced, circle)
+            x, y = result.points[:, 0], result.points[:, 1]
+            collections = result.collections
+        elif not if_continuous:
             points_and_lines = []
             start_points = self.data['start_point']
             directions = self.data['vector']
             for p, v in zip(start_points, directions):
                 v = (float(v[0]), float(v[1]))
                 light = Light(waveLength, Vec2d(v).normalized(), 1, unit='nm')
-                points_and_lines.append(drawer(circle, light, refraction_index, intersection_time=times, start_point=p))
-            x = []
-            y = []
-            lines = []
+                points_and_lines.append(drawer(circle, light, refraction_index, intersection_time=times, start_point=p,
+                                               lines=False))
+            collections = []
             for pl in points_and_lines:
-                xy = pl['intersection_points']
-                x.extend(xy[0])
-                y.extend(xy[1])
-                lines.append(pl['incident_lines'])
-                lines.append(pl['refraction_lines'])
-                lines.append(pl['reflection_lines'])
-            lines = [ ll for line in lines for l in line for ll in l ]
+                collections.extend(pl['result'].collections)
+            points = np.concatenate([pl['result'].points for pl in points_and_lines]) if points_and_lines \
+                else np.empty((0, 2))
+            x, y = points[:, 0], points[:, 1]
         else:
             # 将输出画板一张张删除
             for i in reversed(range(self.output_figure_layout.count())):
@@ -411,25 +452,22 @@ class ApplicationWindow(QtWidgets.QMainWindow):
                     self.output_figure_layout.itemAt(i).widget().setParent(None)
             v = (1, 0)
             light = Light(waveLength, Vec2d(v).normalized(), 1, unit='nm')
-            points_and_lines = drawer(circle, light, refraction_index, density=lightNum, intersection_time=times)
-            xy = points_and_lines['intersection_points']
-            x = xy[0]
-            y = xy[1]
-            lines = [line for l in (points_and_lines['incident_lines'], \
-                                    points_and_lines['refraction_lines'], \
-                                    points_and_lines['reflection_lines']) for ll in l for line in ll]   # 解构所有的线段
-
-            # angle of refraction
-            lights = points_and_lines['refraction_lights']
-            lights[0] = points_and_lines['reflection_lights'][0]
-            angle_x = list(range(len(lights[0])))
-            self.angle_y = []   # 方位角
-            for l in lights:
-                self.angle_y.append([light.direction.angle for light in l])
+            tol = 1e-2 * radius     # 光线离圆顶端的距离与半径成比例 改变半径时使用缓存的追迹结果
+            start_points = pick_start_points(circle, light.direction, lightNum, tol=tol)
+            self.histogram = AngleHistogram()   # 每度一个分格
+            points_and_lines = drawer(circle, light, refraction_index, density=lightNum, intersection_time=times, tol=tol,
+                                      histogram=self.histogram, cache=self.trace_cache, lines=False)
+            result = points_and_lines['result']
+            x, y = result.points[:, 0], result.points[:, 1]
+            collections = result.collections    # 每次作用一个 LineCollection 不再逐条添加线段
+
+            # angle of refraction 方位角由偏折角公式直接得到
+            impact = impact_parameters(circle, light.direction, start_points)
+            angle_x = list(range(len(start_points)))
+            self.angle_y = deviation_angles(circle, light, refraction_index, impact, range(1, times+1)).tolist()
             for i, _y in enumerate(self.angle_y):
                 _canvas = ScatterCanvas(width=3, height=5)   # size of each figure 
-                s = [5] * len(angle_x)
-                _canvas.axes.scatter(angle_x, _y, s=s)
+                _canvas.axes.scatter(angle_x, _y, s=5)
                 _canvas.axes.set_title('(%i time) Aimuth angle distribution' % (i+1))
                 _canvas.axes.set_ylabel('angle (degree)')
                 _canvas.axes.set_xlabel('num of light')
@@ -437,13 +475,11 @@ class ApplicationWindow(QtWidgets.QMainWindow):
                 self.output_figure_layout.addWidget(_canvas)
             self.output_scroll.updateGeometry()
 
-        s = [5] * len(x)    # 5表示点的大小 x表示有多少个点 所有点的大小都相等
-        ax.scatter(x, y, s=s)
+        ax.scatter(x, y, s=5)   # 5表示点的大小 所有点的大小都相等
         ax.add_patch(circle_patch)
         ax.axis('equal')
-        if lines:
-            for l in lines:
-                ax.add_line(l)
+        for c in collections:
+            ax.add_collection(c)
         boarder = 2*radius
         ax.axis([-boarder, boarder, -boarder, boarder])
         self.canvas_2d.draw()
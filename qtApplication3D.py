@@ -4,7 +4,6 @@
 import os
 import sys
 import csv
-import math
 import webbrowser
 from collections import namedtuple
 import matplotlib
@@ -16,8 +15,7 @@ from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as Navigatio
 from matplotCanvas import ScatterCanvas, MplPlot3dCanvas
 from intersectionElements import Sphere, Light
 from pygameVector import Vec3d
-from drawer3d import drawer, multi_line_drawer, generate_multi_start_points, draw_sphere_at_axes
-from funcs3d import calculate_elevation_angle
+from drawer3d import drawer, multi_line_drawer, generate_multi_start_points, draw_sphere_at_axes, LevelOfDetail
 
 
 class MyNavigationToolbar(NavigationToolbar):
@@ -417,6 +415,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
     def simulate_3d(self):
         ax = self.canvas_3d.axes
         ax.clear()
+        self.canvas_3d.set_level_of_detail(None)
         self.canvas_3d.draw()
 
         radius = float(self.box_radius.value())/1000
@@ -433,6 +432,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         points_and_lines = []
         points = []
         lines = []
+        detail = None
         if_continuous = True if 'Continuous' == self.comboBox.currentText() else False
         if not if_continuous:
             start_points = self.data['start_point']
@@ -473,25 +473,24 @@ class ApplicationWindow(QtWidgets.QMainWindow):
                                                            set_x=co_settings[0], 
                                                            set_y=self.set_y.value()/1000,
                                                            set_z=co_settings[1])
-            points_and_lines_and_lights = multi_line_drawer(sphere, light, refraction_index, start_point_list, times)
+            points_and_lines_and_lights = multi_line_drawer(sphere, light, refraction_index, start_point_list, times, symmetry=True,
+                                                            lines=False)
             if not points_and_lines_and_lights:
                 self.statusBar().showMessage('No intersection point exists')
                 return
-            points = points_and_lines_and_lights['points']
-            lines = points_and_lines_and_lights['lines']['incident_lines']
-            lines.extend(points_and_lines_and_lights['lines']['reflection_lines'])
-            lines.extend(points_and_lines_and_lights['lines']['refraction_lines'])
-            lines = [p_line for time_lines in lines for p_line in time_lines]
-            x, y, z = points
-            lights = points_and_lines_and_lights['lights']['refraction_lights']
-            lights[0] = points_and_lines_and_lights['lights']['reflection_lights'][0]
+            result = points_and_lines_and_lights['result']
+            x, y, z = points_and_lines_and_lights['points']
+            # 每次作用一个 Line3DCollection 拖动旋转时只画部分光线
+            detail = LevelOfDetail(result.traced, radius)
+            # 每次作用出射到球外的光 第一次为反射光 之后为折射光 是 result 的切片
             output_x = []
             self.elevation_angle = []
             self.azimuth = []
-            for l in lights:
-                output_x.append(list(range(len(l))))
-                self.elevation_angle.append([ calculate_elevation_angle(light.direction) for light in l])  # 抬升角
-                self.azimuth.append([math.degrees(math.atan2(light.direction.x, light.direction.y)) for light in l]) # 方位角
+            for order in range(1, times+1):
+                view = result.order_view(order)
+                output_x.append(list(range(len(view))))
+                self.elevation_angle.append(view.elevation.tolist())  # 抬升角
+                self.azimuth.append(view.azimuth.tolist()) # 方位角
             # 一张张分布图的增加 属性都想相同
             for i, (_ele, _azi) in enumerate(zip(self.elevation_angle, self.azimuth)):
                 _output_canvas_frame = QtWidgets.QFrame()
@@ -501,9 +500,8 @@ class ApplicationWindow(QtWidgets.QMainWindow):
                 _canvas2 = ScatterCanvas(width=0.5, height=0.5)
                 ax2 = _canvas2.fig.axes[0]
                 ax1 = _canvas1.fig.axes[0]
-                s1 = [10]*len(_ele)
-                ax1.scatter(output_x[i], _ele, s=s1)
-                ax2.scatter(output_x[i], _azi, s=s1)
+                ax1.scatter(output_x[i], _ele, s=10)
+                ax2.scatter(output_x[i], _azi, s=10)
                 ax1.set_title('(%i time) elevation angle distribution' % (i+1))
                 ax2.set_title('(%i time) azimuth distribution' % (i+1))
                 ax1.set_ylabel('angle (degree)')
@@ -518,11 +516,13 @@ class ApplicationWindow(QtWidgets.QMainWindow):
                 _output_canvas_hbox.addWidget(_canvas2)
                 self.output_figure_layout.addWidget(_output_canvas_frame)
 
-        s = [8] * len(x)
-        ax.scatter(x, y, z, s=s)
-        if lines:
-            for l in lines:
-                ax.add_line(l)
+        ax.scatter(x, y, z, s=8)
+        for l in lines:
+            ax.add_line(l)
+        if detail is not None:
+            for c in detail.collections:
+                ax.add_collection3d(c)
+            self.canvas_3d.set_level_of_detail(detail)
         boarder = 1.5*radius
         # ax.axis('equal')
         ax.set_xlim(-boarder, boarder)
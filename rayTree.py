@@ -0,0 +1,127 @@
+#/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from __future__ import division
+import numpy as np
+from intersectionElements import RayBundle
+
+__all__ = ['forward_hits', 'expand_tree', 'tree_paths']
+
+# 节点的种类
+INCIDENT, REFLECTED, REFRACTED = 0, 1, 2
+
+
+def forward_hits(starts, directions, first, second, hit, tol=1e-9):
+    """由两个交点选出光线前方最近的交点 起点本身（t<=tol）不算
+    @param:starts (N, d) 起点
+    @param:directions (N, d) 单位方向
+    @param:first, second, hit batch_intersection 或 batch_intersection_on_sphere 的返回值
+    @param:tol 起点附近不算交点的距离
+    @return: tuple (points, hit) 无交点的行为nan
+    """
+    t = np.stack((np.sum((first - starts)*directions, axis=-1),
+                  np.sum((second - starts)*directions, axis=-1)))
+    t = np.where(hit & (t > tol), t, np.inf)
+    nearest = t.min(axis=0)
+    forward = np.isfinite(nearest)
+    points = starts + np.where(forward, nearest, np.nan)[:, None]*directions
+    return points, forward
+
+
+def expand_tree(bundle, intersect, interact, refraction_index, outside_ref_index=1, max_depth=10, min_power=None):
+    """完整的反射/折射光线树 按层（广度优先）整层一起展开
+    每个作用点同时产生反射光与折射光两个子节点，每个节点是一段光线，用父节点序号表示树，不用嵌套列表
+    @param:bundle RayBundle的实例 粒子外的入射光束 作为根节点
+    @param:intersect 函数 (positions, directions) -> (points, hit) 光线前方最近的交点
+    @param:interact 函数 (bundle, index_out) -> (reflected, refracted, wavenums, fresnel) 见 intersectionTracer._interact
+    @param:refraction_index 粒子的折射率
+    @param:outside_ref_index 外界折射率
+    @param:max_depth 最多经过的作用次数 根节点为0
+    @param:min_power 功率（s与p之和）低于该值的子节点不再产生 None 时只舍弃功率为0的（如全反射的折射光）
+    RETURN 字典 M 为节点数 同一层的节点连续存放
+        origins (M, d) 光线段的起点
+        directions (M, d) 光线段的方向
+        ends (M, d) 光线段的终点（下一个作用点） 离开粒子的光线为nan
+        parents (M,) 父节点的序号 根节点为 -1
+        roots (M,) 根节点在输入光束中的序号
+        depths (M,) 经过的作用次数
+        kinds (M,) 0 入射光 1 反射光 2 折射光
+        inside (M,) 是否在粒子内
+        powers (M, 2) s，p 功率
+        levels (L+1,) 每层节点的起止序号 第 d 层为 levels[d]:levels[d+1] L 为层数
+    """
+    if not isinstance(max_depth, int) or max_depth < 0:
+        raise ValueError('Depth should not be less than 0 and should be int')
+
+    size = len(bundle)
+    level = bundle[np.arange(size)]     # 复制 不修改输入
+    parents = np.full(size, -1, dtype=np.intp)
+    roots = np.arange(size)
+    kinds = np.full(size, INCIDENT, dtype=np.int8)
+    inside = np.zeros(size, dtype=bool)
+    records = []
+    offset = 0
+    levels = [0]
+
+    for depth in range(max_depth+1):
+        ends, hit = intersect(level.positions, level.directions)
+        records.append((level.positions, level.directions, ends, parents, roots, kinds, inside, level.powers))
+        count = len(level)
+        if depth == max_depth or not hit.any():
+            offset += count
+            levels.append(offset)
+            break
+
+        # 有交点的节点产生反射与折射两个子节点
+        source = level[hit]
+        source.positions = ends[hit]
+        source_inside = inside[hit]
+        index_out = np.where(source_inside, outside_ref_index, refraction_index)
+        reflected, refracted, wavenums, fresnel = interact(source, index_out)
+        reflectance = np.stack((fresnel['Rs'], fresnel['Rp']), axis=-1)
+        reflected_powers = source.powers * reflectance
+        refracted_powers = source.powers - reflected_powers
+
+        children = RayBundle(np.concatenate([source.positions, source.positions]),
+                             np.concatenate([reflected, refracted]),
+                             np.concatenate([source.wavenums, wavenums]),
+                             np.concatenate([source.refraction_indices, index_out]),
+                             np.concatenate([source.orders, source.orders]) + 1,
+                             np.concatenate([reflected_powers, refracted_powers]))
+        child_parents = np.tile(offset + np.flatnonzero(hit), 2)
+        child_roots = np.tile(roots[hit], 2)
+        child_kinds = np.repeat(np.array([REFLECTED, REFRACTED], dtype=np.int8), len(source))
+        child_inside = np.concatenate([source_inside, ~source_inside])
+
+        total = children.powers.sum(axis=-1)
+        keep = total > 0 if min_power is None else total >= min_power
+        level = children[keep]
+        parents, roots, kinds, inside = child_parents[keep], child_roots[keep], child_kinds[keep], child_inside[keep]
+        offset += count
+        levels.append(offset)
+        if not len(level):
+            break
+
+    fields = list(zip(*records))
+    return dict(origins=np.concatenate(fields[0]),
+                directions=np.concatenate(fields[1]),
+                ends=np.concatenate(fields[2]),
+                parents=np.concatenate(fields[3]),
+                roots=np.concatenate(fields[4]),
+                depths=np.repeat(np.arange(len(records)), [len(r[0]) for r in records]),
+                kinds=np.concatenate(fields[5]),
+                inside=np.concatenate(fields[6]),
+                powers=np.concatenate(fields[7]),
+                levels=np.array(levels))
+
+
+def tree_paths(tree, node):
+    """从根节点到某个节点经过的节点序号
+    @param:tree expand_tree 返回的字典
+    @param:node 节点序号
+    @return: list 由根节点开始
+    """
+    path = [node]
+    while tree['parents'][path[-1]] >= 0:
+        path.append(tree['parents'][path[-1]])
+    return path[::-1]
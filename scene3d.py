@@ -0,0 +1,256 @@
+#/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from __future__ import division
+import numpy as np
+from rayTree import expand_tree
+from tracer3d import _interact
+
+__all__ = ['SphereScene', 'trace_tree']
+
+
+class _Particles(object):
+    # 每条光线所在的球 batch_ref_factors 只使用 center
+    __slots__ = ['center', 'radius']
+
+    def __init__(self, center, radius):
+        self.center = center
+        self.radius = radius
+
+
+def _slabs(positions, inverse, lower, upper):
+    # 光线与包围盒的交 返回进入与离开的距离 方向分量为0时 inverse 为 ±inf
+    with np.errstate(invalid='ignore'):
+        t0 = (lower - positions) * inverse
+        t1 = (upper - positions) * inverse
+    # 0*inf 为 nan：起点在该面上且平行 视为在盒内
+    t_near = np.fmax.reduce(np.fmin(t0, t1), axis=-1)
+    t_far = np.fmin.reduce(np.fmax(t0, t1), axis=-1)
+    return t_near, t_far
+
+
+def _segment_reduce(ufunc, values, starts, counts):
+    # 每段 values[start:start+count] 的 reduce 各段可以不相连
+    padded = np.concatenate([values, values[:1]])     # 最后一段的终点可以等于数组长度
+    bounds = np.stack((starts, starts + counts), axis=-1).reshape(-1)
+    return ufunc.reduceat(padded, bounds)[::2]
+
+
+class SphereScene(object):
+    """
+    任意位置的多个球组成的场景 用包围体层次（BVH）加速光线与球的求交
+    BVH 在建立场景时按层构建一次：每层把所有节点的球沿球心分布最长的轴按中位数分为两半
+    光线按包（数组）遍历 包内每条光线有自己的栈，每步所有光线各处理一个节点，先近后远，
+    已找到的交点比节点更近时不再进入该节点，每条光线的代价约为 log(球数)
+    @param:centers (M, 3) 球心
+    @param:radii (M,) 或标量 半径
+    @param:leaf_size 叶节点最多的球数
+    """
+    def __init__(self, centers, radii, leaf_size=4):
+        self.centers = np.array(centers, dtype=np.float64, ndmin=2).reshape(-1, 3)
+        self.radii = np.array(np.broadcast_to(radii, len(self.centers)), dtype=np.float64)
+        if not len(self.centers):
+            raise ValueError('Scene should have at least one sphere')
+        if np.any(self.radii <= 0):
+            raise ValueError('Radius should be positive')
+        self.leaf_size = max(int(leaf_size), 1)
+        self._build()
+
+    @classmethod
+    def from_spheres(cls, spheres, leaf_size=4):
+        # 由 Sphere 的列表生成场景
+        return cls([s.center for s in spheres], [s.radius for s in spheres], leaf_size)
+
+    def __len__(self):
+        return len(self.centers)
+
+    def __repr__(self):
+        return "SphereScene({0} spheres, {1} nodes, depth={2})".format(len(self), len(self.children), self.depth)
+
+    def _build(self):
+        """按层构建 BVH 节点按层连续编号 内部节点的两个子节点为 children[i] 与 children[i]+1
+        lower/upper (K, 3) 包围盒 children (K,) 叶节点为 -1 axes (K,) 划分的轴
+        starts/counts (K,) 节点的球为 order[start:start+count]
+        """
+        lows = self.centers - self.radii[:, None]
+        highs = self.centers + self.radii[:, None]
+        order = np.arange(len(self))
+        starts, counts = np.array([0]), np.array([len(self)])
+        levels = []
+        offset = 1      # 下一层第一个节点的编号
+        while len(starts):
+            lower = _segment_reduce(np.minimum, lows[order], starts, counts)
+            upper = _segment_reduce(np.maximum, highs[order], starts, counts)
+            extent = _segment_reduce(np.maximum, self.centers[order], starts, counts) - \
+                     _segment_reduce(np.minimum, self.centers[order], starts, counts)
+            axes = np.argmax(extent, axis=-1)
+            split = counts > self.leaf_size
+            children = np.full(len(starts), -1, dtype=np.intp)
+            children[split] = offset + 2*np.arange(np.count_nonzero(split))
+            levels.append((lower, upper, children, axes, starts, counts))
+
+            # 需要划分的节点内按划分轴的球心坐标排序
+            owners = np.repeat(np.flatnonzero(split), counts[split])
+            elements = np.repeat(starts[split], counts[split]) + \
+                       np.arange(len(owners)) - np.repeat(np.cumsum(counts[split]) - counts[split], counts[split])
+            key = self.centers[order[elements], axes[owners]]
+            order[elements] = order[elements[np.lexsort((key, owners))]]
+            half = counts[split] // 2
+            offset += 2*len(half)
+            starts = np.stack((starts[split], starts[split] + half), axis=-1).reshape(-1)
+            counts = np.stack((half, counts[split] - half), axis=-1).reshape(-1)
+
+        fields = list(zip(*levels))
+        self.lower, self.upper, self.children, self.axes, self.starts, self.counts = [np.concatenate(f) for f in fields]
+        self.order = order
+        self.depth = len(levels)
+
+    def _leaf_items(self, nodes):
+        # 叶节点中的球 (R, leaf_size) 不足的位置为 -1
+        slots = self.starts[nodes][:, None] + np.arange(self.leaf_size)
+        valid = np.arange(self.leaf_size) < self.counts[nodes][:, None]
+        return np.where(valid, self.order[np.where(valid, slots, 0)], -1)
+
+    def _sphere_hits(self, positions, directions, items, tol):
+        # 光线与球的交点 取起点前方较近的一个 (R, L) 无交点为 inf
+        offset = positions[:, None, :] - self.centers[items]
+        b = np.sum(offset*directions[:, None, :], axis=-1)
+        disc = b*b - (np.sum(offset*offset, axis=-1) - self.radii[items]**2)
+        root = np.sqrt(np.where(disc >= 0, disc, np.nan))
+        t = np.where(-b - root > tol, -b - root, np.where(-b + root > tol, -b + root, np.inf))
+        t[np.isnan(t) | (items < 0)] = np.inf
+        return t
+
+    def nearest_hit(self, positions, directions, tol=None, packet_size=65536):
+        """光线前方最近的交点 同 intersectionScene.Scene.nearest_hit
+        @param:positions (N, 3) 光线起点
+        @param:directions (N, 3) 光线方向
+        @param:tol 起点附近不算交点的距离 None 时为最大半径的 1e-9 倍
+        @param:packet_size 每个光线包的光线数 限制栈的内存
+        @return: 字典 points (N, 3) indices (N,) distances (N,) hit (N,)
+        """
+        tol = 1e-9 * self.radii.max() if tol is None else tol
+        positions = np.array(positions, dtype=np.float64, ndmin=2).reshape(-1, 3)
+        directions = np.array(np.broadcast_to(directions, positions.shape), dtype=np.float64)
+        directions = directions / np.linalg.norm(directions, axis=-1)[:, None]
+        distances = np.full(len(positions), np.inf)
+        indices = np.full(len(positions), -1, dtype=np.intp)
+        for offset in range(0, len(positions), packet_size):
+            packet = slice(offset, offset+packet_size)
+            distances[packet], indices[packet] = self._traverse(positions[packet], directions[packet], tol)
+        hit = indices >= 0
+        points = positions + np.where(hit, distances, np.nan)[:, None]*directions
+        return dict(points=points, indices=indices, distances=distances, hit=hit)
+
+    def _traverse(self, positions, directions, tol):
+        # 一个光线包的遍历 每条光线一个栈 每步每条光线弹出一个节点
+        size = len(positions)
+        with np.errstate(divide='ignore'):
+            inverse = 1 / directions
+        best = np.full(size, np.inf)
+        best_index = np.full(size, -1, dtype=np.intp)
+        stack = np.zeros((size, self.depth + 1), dtype=np.intp)     # 根节点为 0
+        depth = np.ones(size, dtype=np.intp)
+
+        rows = np.arange(size)
+        while len(rows):
+            depth[rows] -= 1
+            nodes = stack[rows, depth[rows]]
+            t_near, t_far = _slabs(positions[rows], inverse[rows], self.lower[nodes], self.upper[nodes])
+            enter = (t_near <= t_far) & (t_far > tol) & (t_near < best[rows])
+            leaf = self.children[nodes] < 0
+
+            # 叶节点 与其中的球求交
+            tested = enter & leaf
+            if tested.any():
+                leaf_rows = rows[tested]
+                items = self._leaf_items(nodes[tested])
+                t = self._sphere_hits(positions[leaf_rows], directions[leaf_rows], items, tol)
+                nearest = np.argmin(t, axis=-1)
+                t = t[np.arange(len(leaf_rows)), nearest]
+                closer = t < best[leaf_rows]
+                best[leaf_rows[closer]] = t[closer]
+                best_index[leaf_rows[closer]] = items[closer, nearest[closer]]
+
+            # 内部节点 先压入远的子节点 再压入近的 下一步先处理近的
+            expand = enter & ~leaf
+            if expand.any():
+                inner_rows = rows[expand]
+                first = self.children[nodes[expand]]
+                forward = directions[inner_rows, self.axes[nodes[expand]]] >= 0   # 沿划分轴正向时左子节点较近
+                near = np.where(forward, first, first + 1)
+                far = np.where(forward, first + 1, first)
+                stack[inner_rows, depth[inner_rows]] = far
+                stack[inner_rows, depth[inner_rows] + 1] = near
+                depth[inner_rows] += 2
+            rows = rows[depth[rows] > 0]
+        return best, best_index
+
+    def intersect(self, positions, directions):
+        """同 rayTree.forward_hits 的返回值 用于 rayTree.expand_tree
+        @return: tuple (points, hit)
+        """
+        result = self.nearest_hit(positions, directions)
+        return result['points'], result['hit']
+
+    def locate(self, points, tol=1e-6):
+        """球面上的点所在的球 同 intersectionScene.Scene.locate
+        沿 BVH 下降到包含该点的叶节点
+        @return: (N,) 球的序号 不在任何球面上为 -1
+        """
+        points = np.array(points, dtype=np.float64, ndmin=2).reshape(-1, 3)
+        size = len(points)
+        best = np.full(size, np.inf)
+        indices = np.full(size, -1, dtype=np.intp)
+        stack = np.zeros((size, self.depth + 1), dtype=np.intp)
+        depth = np.ones(size, dtype=np.intp)
+        margin = tol * self.radii.max()
+
+        rows = np.arange(size)
+        while len(rows):
+            depth[rows] -= 1
+            nodes = stack[rows, depth[rows]]
+            inside = np.all((points[rows] >= self.lower[nodes] - margin) &
+                            (points[rows] <= self.upper[nodes] + margin), axis=-1)
+            leaf = self.children[nodes] < 0
+            tested = inside & leaf
+            if tested.any():
+                leaf_rows = rows[tested]
+                items = self._leaf_items(nodes[tested])
+                error = np.abs(np.linalg.norm(points[leaf_rows, None, :] - self.centers[items], axis=-1) /
+                               self.radii[items] - 1)
+                error[items < 0] = np.inf
+                nearest = np.argmin(error, axis=-1)
+                error = error[np.arange(len(leaf_rows)), nearest]
+                closer = (error < best[leaf_rows]) & (error <= tol)
+                best[leaf_rows[closer]] = error[closer]
+                indices[leaf_rows[closer]] = items[closer, nearest[closer]]
+            expand = inside & ~leaf
+            if expand.any():
+                inner_rows = rows[expand]
+                first = self.children[nodes[expand]]
+                stack[inner_rows, depth[inner_rows]] = first
+                stack[inner_rows, depth[inner_rows] + 1] = first + 1
+                depth[inner_rows] += 2
+            rows = rows[depth[rows] > 0]
+        return indices
+
+
+def trace_tree(scene, bundle, refraction_index, outside_ref_index=1, max_depth=10, min_power=None):
+    """场景中的完整反射/折射光线树 见 rayTree.expand_tree 和 tracer3d.trace_tree
+    @param:scene SphereScene的实例
+    @param:bundle RayBundle的实例 球外的入射光束
+    其余参数同 tracer3d.trace_tree
+    RETURN 字典 同 rayTree.expand_tree 另有
+        particles (M,) 每个节点的终点所在的球 离开场景的光线为 -1
+    """
+    def interact(source, index_out):
+        indices = scene.locate(source.positions)
+        return _interact(_Particles(scene.centers[indices], scene.radii[indices]), source, index_out)
+
+    tree = expand_tree(bundle, scene.intersect, interact, refraction_index, outside_ref_index, max_depth, min_power)
+    particles = np.full(len(tree['ends']), -1, dtype=np.intp)
+    ended = ~np.isnan(tree['ends'][:, 0])
+    particles[ended] = scene.locate(tree['ends'][ended])
+    tree['particles'] = particles
+    return tree
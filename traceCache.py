@@ -0,0 +1,100 @@
+#/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from __future__ import division
+from collections import OrderedDict
+import numpy as np
+from intersectionElements import Circle, Sphere
+import intersectionTracer
+import tracer3d
+
+__all__ = ['TraceCache']
+
+# 随半径缩放，随圆心平移的数组 其余（方向，功率）与半径无关
+POSITION_KEYS = ('start_points', 'points')
+
+
+class TraceCache(object):
+    """
+    与半径无关的追迹结果的缓存
+    几何光学中光线的方向与功率和半径无关，交点随半径缩放，随圆心平移。
+    缓存单位圆（球），圆心在原点的追迹结果，半径或圆心改变时由缓存的结果缩放平移得到，不再追迹。
+    @param:maxsize 最多缓存的结果数 超过时舍弃最久未使用的
+    """
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self._traces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._traces)
+
+    def __repr__(self):
+        return "TraceCache({0}/{1}):hits={2}, misses={3}".format(len(self), self.maxsize, self.hits, self.misses)
+
+    def clear(self):
+        self._traces.clear()
+
+    def _get(self, key, trace):
+        # 取出缓存的单位结果 没有则追迹并缓存
+        if key in self._traces:
+            self.hits += 1
+            self._traces.move_to_end(key)
+            return self._traces[key]
+        self.misses += 1
+        traced = trace()
+        for value in traced.values():
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False    # 缓存的结果被多次返回 不允许修改
+        self._traces[key] = traced
+        if len(self._traces) > self.maxsize:
+            self._traces.popitem(last=False)
+        return traced
+
+    @staticmethod
+    def _scaled(traced, radius, center):
+        # 单位结果 -> 半径为 radius 圆心为 center 的结果
+        center = np.asarray(center, dtype=np.float64)
+        result = dict(traced)
+        for key in POSITION_KEYS:
+            result[key] = traced[key]*radius + center
+        return result
+
+    @staticmethod
+    def _direction_key(direction):
+        direction = np.asarray(tuple(direction), dtype=np.float64)
+        return tuple(np.round(direction / np.linalg.norm(direction), 12))
+
+    def compute(self, circle, incident_light, refraction_index, density=1, outside_ref_index=1, intersection_time=1,
+                distance=2, tol=1e-2, min_power=None):
+        """同 intersectionTracer.compute 起始点由 pick_start_points 生成
+        键为 (折射率, 外界折射率, 光线条数, 作用次数, 入射方向, 光线离圆顶端的距离与半径之比, distance, min_power)
+        @return: 字典 同 intersectionTracer.compute 数组不可修改
+        """
+        radius = circle.radius
+        key = ('2d', refraction_index, incident_light.refraction_index, outside_ref_index, density, intersection_time,
+               self._direction_key(incident_light.direction), round(tol/radius, 12), distance, min_power)
+
+        def trace():
+            return intersectionTracer.compute(Circle(1), incident_light, refraction_index, density, outside_ref_index,
+                                              intersection_time, distance, tol/radius, min_power=min_power)
+
+        return self._scaled(self._get(key, trace), radius, circle.center)
+
+    def compute3d(self, sphere, incident_light, refraction_index, start_point_list, intersection_time, symmetry=False,
+                  min_power=None):
+        """同 tracer3d.compute 起始点相对于球心与半径的位置相同时使用缓存
+        @return: 字典 同 tracer3d.compute 数组不可修改
+        """
+        radius = sphere.radius
+        center = np.asarray(sphere.center, dtype=np.float64)
+        unit_points = np.round((np.asarray(start_point_list, dtype=np.float64).reshape(-1, 3) - center) / radius, 12)
+        key = ('3d', refraction_index, incident_light.refraction_index, intersection_time,
+               self._direction_key(incident_light.direction), unit_points.tobytes(), symmetry, min_power)
+
+        def trace():
+            return tracer3d.compute(Sphere(1), incident_light, refraction_index, unit_points, intersection_time,
+                                    symmetry, min_power)
+
+        return self._scaled(self._get(key, trace), radius, center)
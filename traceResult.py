@@ -0,0 +1,146 @@
+#/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from __future__ import division
+import numpy as np
+from angleHistogram import direction_angles
+
+__all__ = ['TraceResult']
+
+
+class TraceResult(object):
+    """
+    追迹结果的按列存储 每条出射光一行 按作用次数排序 每个作用次数的行连续
+    舍弃的光线(nan)不保存 每个作用次数的结果是数组的切片 不复制
+    @param:ray (M,) 出射光所属的入射光线 为 start_points 的行
+    @param:order (M,) 作用次数 1...K 不减
+    @param:points (M, d) 出射点 第一次为入射点 第k次为第k个交点
+    @param:directions (M, d) 出射到圆（球）外的光的方向 第一次为反射光 之后为折射光
+    @param:weights (M,) 出射光的功率 没有功率时为 None
+    @param:traced 原始的追迹字典 生成线段时使用
+    @param:particle Circle或Sphere的实例 生成线段时使用其半径
+    @param:distance 圆（球）外线段的长度为半径的几倍
+    """
+    def __init__(self, ray, order, points, directions, weights=None, traced=None, particle=None, distance=2):
+        self.ray = ray
+        self.order = order
+        self.points = points
+        self.directions = directions
+        self.weights = weights
+        self.traced = traced
+        self.particle = particle
+        self.distance = distance
+        self._azimuth = None
+        self._elevation = None
+        self._lines = None
+        self._collections = None
+
+    @classmethod
+    def from_trace(cls, traced, particle=None, distance=2):
+        """由 intersectionTracer/tracer3d 的 trace，compute 返回的字典生成
+        (K, N) 的数组按作用次数展开 本身就是按作用次数排序的
+        """
+        directions = traced['directions']
+        count, size, dim = directions.shape
+        valid = ~np.isnan(directions[..., 0]).reshape(-1)
+        order = np.repeat(np.asarray(traced['orders'], dtype=np.intp), size)[valid]
+        ray = np.tile(np.arange(size), count)[valid]
+        weights = traced.get('weights')
+        return cls(ray, order,
+                   traced['points'][:count].reshape(-1, dim)[valid],   # 第k次作用的出射点为 points[k-1]
+                   directions.reshape(-1, dim)[valid],
+                   None if weights is None else weights.reshape(-1)[valid],
+                   traced, particle, distance)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __repr__(self):
+        return "TraceResult({0} rays, orders={1}, {2}d)".format(len(self), self.orders.tolist(), self.dimension)
+
+    @property
+    def dimension(self):
+        return self.directions.shape[-1]
+
+    @property
+    def orders(self):
+        # 出现的作用次数
+        return np.unique(self.order)
+
+    def _bounds(self, order):
+        # order 已排序 同一作用次数的行为 [start, stop)
+        start, stop = np.searchsorted(self.order, [order, order+1])
+        return slice(start, stop)
+
+    def order_view(self, order):
+        """一个作用次数的结果 各列是本对象的数组的切片（视图）
+        @return: TraceResult 没有该作用次数时长度为0
+        """
+        rows = self._bounds(order)
+
+        def cut(column):
+            return None if column is None else column[rows]
+
+        view = TraceResult(self.ray[rows], self.order[rows], self.points[rows], self.directions[rows],
+                           cut(self.weights), self.traced, self.particle, self.distance)
+        view._azimuth = cut(self._azimuth)
+        view._elevation = cut(self._elevation)
+        return view
+
+    def iter_orders(self):
+        # 逐个作用次数的视图
+        for order in self.orders:
+            yield int(order), self.order_view(order)
+
+    @property
+    def azimuth(self):
+        # 出射光的方位角 单位为度 见 angleHistogram.direction_angles
+        if self._azimuth is None:
+            self._azimuth = direction_angles(self.directions, 'azimuth')
+        return self._azimuth
+
+    @property
+    def elevation(self):
+        # 出射光的抬升角 只用于三维
+        if self._elevation is None:
+            self._elevation = direction_angles(self.directions, 'elevation')
+        return self._elevation
+
+    @property
+    def lines(self):
+        """线段 第一次使用时由 intersectionDrawer.render 或 drawer3d.render 生成
+        只需要数值结果时不导入matplotlib
+        RETURN 字典 incident_lines, reflection_lines, refraction_lines 每次作用一个列表
+        """
+        if self._lines is None:
+            if self.traced is None or self.particle is None:
+                raise ValueError('Lines need the traced result and the particle')
+            if self.dimension == 2:
+                from intersectionDrawer import render
+                self._lines = render(self.traced, self.particle, self.distance)
+            else:
+                from drawer3d import render
+                self._lines = render(self.traced, self.particle.radius)
+        return self._lines
+
+    @property
+    def collections(self):
+        """入射光线一个 之后每次作用一个线段集合 第一次使用时由 intersectionDrawer.render_collections
+        或 drawer3d.render_collections 生成 线段数目很多时代替 lines 绘制的开销不随线段数目增加
+        """
+        if self._collections is None:
+            if self.traced is None or self.particle is None:
+                raise ValueError('Lines need the traced result and the particle')
+            if self.dimension == 2:
+                from intersectionDrawer import render_collections
+                self._collections = render_collections(self.traced, self.particle, self.distance)
+            else:
+                from drawer3d import render_collections
+                self._collections = render_collections(self.traced, self.particle.radius)
+        return self._collections
+
+    def artists(self):
+        # 所有线段的列表 入射光线，反射光线，折射光线的顺序
+        lines = self.lines
+        return [line for key in ('incident_lines', 'reflection_lines', 'refraction_lines')
+                for time_lines in lines[key] for line in time_lines]
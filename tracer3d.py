@@ -0,0 +1,296 @@
+#/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from __future__ import division
+import numpy as np
+from intersectionElements import RayBundle, Light, UNITS
+from rayTree import forward_hits, expand_tree
+from funcs3d import batch_intersection_on_sphere, batch_ref_factors, batch_reflection, batch_refraction, batch_fresnel
+
+__all__ = ['trace', 'iter_orders', 'compute', 'trace_tree', 'trace_wavelengths']
+
+
+def _interact(sphere, bundle, index_out):
+    """作用点处建立 (n, t, b) 坐标系 对整个光束一次计算反射与折射
+    @return: tuple (reflected, refracted, wavenums, fresnel) 单位方向数组，折射光的波数和 Fresnel 系数
+    """
+    factors = batch_ref_factors(sphere, bundle.positions, bundle.k_vectors)
+    wavenums = bundle.wavenums * index_out / bundle.refraction_indices
+    return (batch_reflection(factors), batch_refraction(factors, wavenums), wavenums,
+            batch_fresnel(factors, wavenums, bundle.wavenums))
+
+
+def _split_powers(powers, fresnel):
+    # 入射光的 s，p 功率 (N, 2) 分为反射光与折射光的功率
+    # s，p 相对于每个作用点的入射面 球内各次作用的入射面相同
+    reflected = powers * np.stack((fresnel['Rs'], fresnel['Rp']), axis=-1)
+    return reflected, powers - reflected
+
+
+def _chord_end(sphere, points, directions):
+    # 起点在球上 弦的另一个端点 p - 2((p-c).d)d
+    offset = points - np.asarray(sphere.center, dtype=np.float64)
+    return points - 2*np.sum(offset*directions, axis=-1)[:, None]*directions
+
+
+def _chunks(bundle, chunk_size):
+    # 按行切分光束 chunk_size 为 None 时不切分
+    if not chunk_size:
+        yield 0, bundle
+        return
+    for offset in range(0, len(bundle), chunk_size):
+        yield offset, bundle[offset:offset+chunk_size]
+
+
+def iter_orders(sphere, bundle, refraction_index, outside_ref_index=1, intersection_time=1, segments=False, chunk_size=None,
+                min_power=None):
+    """逐次作用输出的球的光束追迹 生成器 与 intersectionTracer.iter_orders 相同
+    每次只保存当前光束的状态，不累积之前作用的结果，内存与作用次数无关
+    @param:segments 是否输出本次作用之后在球内的线段
+    @param:chunk_size 每次追迹的光线数 None 时整个光束一起追迹
+    @param:min_power 球内光线的功率（s与p之和）低于该值后不再追迹 None 时追迹全部作用次数
+    YIELD 字典 每个分块的每次作用一个
+        order 作用次数 1...K
+        rows (N,) 本次作用的光线在输入光束中的序号 被舍弃的光线之后不再出现
+        points (N, 3) 本次作用的交点
+        reflection_directions (N, 3) 反射光方向
+        refraction_directions (N, 3) 折射光方向
+        directions (N, 3) 出射到球外的光的方向 第一次为反射光 之后为折射光
+        powers (N, 2) 出射光的 s，p 功率 由 Fresnel 公式得到
+        weights (N,) 出射光的功率 s与p之和
+        segments tuple (start, end) 各 (N, 3) 本次作用之后在球内的线段 仅 segments 为 True 时输出
+    """
+    if not isinstance(intersection_time, int) or intersection_time < 1:
+        raise ValueError('Intersection times should not be less than 1 and should be int')
+
+    for offset, chunk in _chunks(bundle, chunk_size):
+        first, _, hit = batch_intersection_on_sphere(sphere, chunk.directions, chunk.positions)
+        chunk = chunk[hit]    # 若没有交点则舍弃
+        rows = offset + np.flatnonzero(hit)
+        chunk.positions = first[hit]
+
+        for order in range(1, intersection_time+1):
+            chunk.orders += 1
+            if order == 1:
+                # 第一次作用 球外 -> 球内
+                index_in = refraction_index if not np.ndim(refraction_index) else np.asarray(refraction_index)[rows]
+                reflected, refracted, wavenums, fresnel = _interact(sphere, chunk, index_in)
+                exit_powers, chunk.powers = _split_powers(chunk.powers, fresnel)
+                exit_directions = reflected
+                chunk.directions = refracted
+                chunk.wavenums = wavenums
+                chunk.refraction_indices = np.array(np.broadcast_to(index_in, len(chunk)), dtype=np.float64)
+            else:
+                # 之后的作用 球内反射继续追迹 折射光出射
+                reflected, refracted, _, fresnel = _interact(sphere, chunk, outside_ref_index)
+                chunk.powers, exit_powers = _split_powers(chunk.powers, fresnel)
+                exit_directions = refracted
+                chunk.directions = reflected
+
+            position = chunk.positions
+            following = _chord_end(sphere, position, chunk.directions)
+            result = dict(order=order,
+                          rows=rows,
+                          points=position,
+                          reflection_directions=reflected,
+                          refraction_directions=refracted,
+                          directions=exit_directions,
+                          powers=exit_powers,
+                          weights=exit_powers.sum(axis=-1))
+            if segments:
+                result['segments'] = (position, following)
+            yield result
+            chunk.positions = following
+
+            if min_power is not None:
+                # 舍弃功率过低的球内光线
+                keep = chunk.powers.sum(axis=-1) >= min_power
+                if not keep.all():
+                    chunk, rows = chunk[keep], rows[keep]
+
+
+def _collect(bundle, orders):
+    # 将 iter_orders 的输出 (不分块) 合并为 trace 的结果 被舍弃的光线之后的结果为 nan
+    results = list(orders)
+    hit = np.zeros(len(bundle), dtype=bool)
+    hit[results[0]['rows']] = True
+    hit_rows = np.flatnonzero(hit)
+
+    def stack(key, extra=None):
+        values = [r[key] for r in results] + ([] if extra is None else [extra])
+        row_lists = [r['rows'] for r in results] + ([] if extra is None else [results[-1]['rows']])
+        if all(len(rows) == len(hit_rows) for rows in row_lists):
+            return np.stack(values)
+        stacked = np.full((len(values), len(hit_rows)) + values[0].shape[1:], np.nan)
+        for i, (value, rows) in enumerate(zip(values, row_lists)):
+            stacked[i, np.searchsorted(hit_rows, rows)] = value
+        return stacked
+
+    return dict(start_points=bundle.positions[hit],
+                hit=hit,
+                points=stack('points', results[-1]['segments'][1]),
+                reflection_directions=stack('reflection_directions'),
+                refraction_directions=stack('refraction_directions'),
+                directions=stack('directions'),
+                powers=stack('powers'),
+                weights=stack('weights'),
+                orders=np.array([r['order'] for r in results]))
+
+
+def trace(sphere, bundle, refraction_index, outside_ref_index=1, intersection_time=1, min_power=None):
+    """球的光束追迹 multi_line_drawer 的数组版本
+    @param:sphere Sphere的实例
+    @param:bundle RayBundle的实例 (N, 3) 球外的入射光束
+    @param:refraction_index 球的折射率
+    @param:outside_ref_index 外界折射率
+    @param:intersection_time 作用次数
+    @param:min_power 球内光线的功率低于该值后不再追迹 见 iter_orders
+    RETURN 字典 与 intersectionTracer.trace 相同
+        start_points (N, 3) 与球有交点的光线的起始点
+        hit (M,) 输入光线是否与球相交
+        points (K+1, N, 3) 第1到第K+1个交点 第k次作用在球内的线段为 points[k-1] -> points[k]
+        reflection_directions (K, N, 3) 每次作用的反射光方向
+        refraction_directions (K, N, 3) 每次作用的折射光方向
+        directions (K, N, 3) 每次作用出射到球外的光的方向 第一次为反射光 之后为折射光
+        powers (K, N, 2) 每次作用出射光的 s，p 功率
+        weights (K, N) 每次作用出射光的功率
+        orders (K,) 作用次数 1...K
+        舍弃的光线在之后的作用次数中为 nan
+    """
+    return _collect(bundle, iter_orders(sphere, bundle, refraction_index, outside_ref_index, intersection_time,
+                                        segments=True, min_power=min_power))
+
+
+def _rotate_around_axis(vectors, axis, cos, sin):
+    """Rodrigues 公式 将矢量绕单位轴旋转 每一行有各自的旋转角
+    """
+    axial = np.sum(vectors*axis, axis=-1)[..., None] * axis
+    return vectors*cos[:, None] + np.cross(axis, vectors)*sin[:, None] + axial*(1 - cos[:, None])
+
+
+def _trace_symmetric(sphere, incident_light, refraction_index, start_point_list, intersection_time, min_power=None, tol=1e-9):
+    """利用平面波照射球的旋转对称性追迹
+    每条光线都在入射轴与其起始点确定的平面内，结果只与碰撞参数的大小有关。
+    只追迹不同碰撞参数的光线各一次，再绕入射轴旋转得到其余光线的结果。
+    @param:tol 碰撞参数相同的判断精度 半径的倍数
+    """
+    center = np.asarray(sphere.center, dtype=np.float64)
+    axis = np.array(tuple(incident_light.direction), dtype=np.float64)
+    axis = axis / np.linalg.norm(axis)
+    offset = np.array(start_point_list, dtype=np.float64).reshape(-1, 3) - center
+    radial = offset - np.sum(offset*axis, axis=-1)[:, None]*axis     # 垂直于入射轴的分量
+    impact = np.linalg.norm(radial, axis=-1)   # 碰撞参数
+    keys = np.round(impact / (tol*sphere.radius))
+    _, representative, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    bundle = RayBundle.from_light(incident_light, [start_point_list[i] for i in representative])
+    traced = trace(sphere, bundle, refraction_index, 1, intersection_time, min_power)
+    rows = np.cumsum(traced['hit']) - 1    # 代表光线在结果数组中的行
+    hit = traced['hit'][inverse]
+    group = inverse[hit]
+
+    # 代表光线到各光线的旋转角 碰撞参数为0时不需要旋转
+    unit = radial / np.where(impact == 0, 1, impact)[:, None]
+    source, target = unit[representative][group], unit[hit]
+    cos = np.sum(source*target, axis=-1)
+    sin = np.sum(np.cross(source, target)*axis, axis=-1)
+    on_axis = impact[hit] == 0
+    cos[on_axis], sin[on_axis] = 1, 0
+
+    def expand(arrays, shift=False, rotate=True):
+        arrays = arrays[:, rows[group]]
+        if not rotate:
+            return arrays
+        arrays = arrays - center if shift else arrays
+        rotated = np.stack([_rotate_around_axis(a, axis, cos, sin) for a in arrays])
+        return rotated + center if shift else rotated
+
+    start_points = np.array(start_point_list, dtype=np.float64).reshape(-1, 3)[hit]
+    return dict(start_points=start_points,
+                hit=hit,
+                points=expand(traced['points'], shift=True),
+                reflection_directions=expand(traced['reflection_directions']),
+                refraction_directions=expand(traced['refraction_directions']),
+                directions=expand(traced['directions']),
+                powers=expand(traced['powers'], rotate=False),     # s，p 相对于入射面 旋转后不变
+                weights=expand(traced['weights'], rotate=False),
+                orders=traced['orders'])
+
+
+def compute(sphere, incident_light, refraction_index, start_point_list, intersection_time, symmetry=False, min_power=None):
+    """只计算不画图的追迹 参数与 drawer3d.multi_line_drawer 相同 外界折射率为1
+    不导入matplotlib 不生成线段，线段由 drawer3d.render 另外生成
+    @param:symmetry 利用平面波照射球的旋转对称性，只追迹不同碰撞参数的光线
+    @param:min_power 球内光线的功率低于该值后不再追迹 见 iter_orders
+    RETURN 字典 同 trace
+    """
+    if not isinstance(intersection_time, int) or intersection_time < 1:
+        raise ValueError('Intersection times should not be less than 1 and should be int')
+    if symmetry:
+        return _trace_symmetric(sphere, incident_light, refraction_index, start_point_list, intersection_time, min_power)
+    bundle = RayBundle.from_light(incident_light, start_point_list)
+    return trace(sphere, bundle, refraction_index, 1, intersection_time, min_power)
+
+
+def trace_tree(sphere, bundle, refraction_index, outside_ref_index=1, max_depth=10, min_power=None):
+    """完整的反射/折射光线树 每个作用点的反射光与折射光都继续追迹 见 rayTree.expand_tree
+    @param:sphere Sphere的实例
+    @param:bundle RayBundle的实例 球外的入射光束
+    @param:max_depth 最多经过的作用次数
+    @param:min_power 功率低于该值的光线不再追迹
+    RETURN 字典 同 rayTree.expand_tree
+    """
+    tol = 1e-9 * sphere.radius
+
+    def intersect(positions, directions):
+        first, second, hit = batch_intersection_on_sphere(sphere, directions, positions)
+        return forward_hits(positions, directions, first, second, hit, tol)
+
+    def interact(bundle, index_out):
+        return _interact(sphere, bundle, index_out)
+
+    return expand_tree(bundle, intersect, interact, refraction_index, outside_ref_index, max_depth, min_power)
+
+
+def trace_wavelengths(sphere, incident_light, model, wavelengths, start_point_list, outside_ref_index=1, intersection_time=1,
+                      unit='nm', min_power=None):
+    """多波长的色散追迹 光线 × 波长 合并为一个光束一次追迹 不逐个波长循环
+    @param:sphere Sphere的实例
+    @param:incident_light Light的实例 使用其方向与折射率（外界） 不使用其波长
+    @param:model 色散模型 由波长得到球的折射率 见 dispersion 也可以是每个波长的折射率 (L,)
+    @param:wavelengths (L,) 波长
+    @param:start_point_list 起始点的列表
+    @param:outside_ref_index 外界折射率
+    @param:intersection_time 作用次数
+    @param:unit 波长的单位 同 Light
+    @param:min_power 球内光线的功率低于该值后不再追迹
+    RETURN 字典 同 trace，每个数组在光线一维之前多一维波长
+        wavelengths (L,) 波长 单位为 unit
+        refraction_indices (L,) 每个波长球的折射率
+        start_points (N, d) hit (M,) 与波长无关
+        points (K+1, L, N, d) 其余为 (K, L, N, ...)
+    """
+    if unit not in UNITS.keys():
+        raise ValueError('Use correct unit in {0}'.format(list(UNITS.keys())))
+    wavelengths = np.atleast_1d(np.asarray(wavelengths, dtype=np.float64))
+    indices = model(wavelengths, unit) if callable(model) else np.broadcast_to(np.asarray(model, dtype=np.float64), wavelengths.shape)
+    rays = RayBundle.from_light(incident_light, start_point_list)
+    size, count = len(rays), len(wavelengths)
+
+    # 每个波长复制一份光束 第 l 个波长为第 l*size 到 (l+1)*size 行
+    wavenums = Light.wavenum(wavelengths * UNITS[unit], incident_light.refraction_index)
+    bundle = RayBundle(np.tile(rays.positions, (count, 1)), np.tile(rays.directions, (count, 1)),
+                       np.repeat(wavenums, size), incident_light.refraction_index)
+    traced = trace(sphere, bundle, np.repeat(indices, size), outside_ref_index, intersection_time, min_power)
+
+    # 是否有交点与波长无关
+    result = dict(wavelengths=wavelengths,
+                  refraction_indices=np.asarray(indices, dtype=np.float64),
+                  start_points=traced['start_points'][:len(traced['start_points'])//count],
+                  hit=traced['hit'][:size],
+                  orders=traced['orders'])
+    for key in ('points', 'reflection_directions', 'refraction_directions', 'directions', 'powers', 'weights'):
+        values = traced[key]
+        result[key] = values.reshape((values.shape[0], count, -1) + values.shape[2:])
+    return result